@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+    Framework-agnostic ASGI middleware for LTI launch verification
+"""
+from __future__ import absolute_import
+
+import logging
+
+from .common import (
+    LTI_PROPERTY_LIST,
+    TIMESTAMP_THRESHOLD,
+    check_content_length,
+    verify_request_common,
+    LTIException,
+)
+from .forms import (
+    DEFAULT_MAX_BODY_SIZE,
+    FORM_CONTENT_TYPE,
+    decode_form,
+    first_value,
+)
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def header_name(name):
+    """
+    Canonical capitalization,
+    e.g. b'x-forwarded-proto' -> 'X-Forwarded-Proto'
+    """
+    return '-'.join(part.capitalize()
+                    for part in name.decode('latin-1').split('-'))
+
+
+def scope_url(scope, headers):
+    """
+    Full request URL of an ASGI HTTP scope. Per the ASGI spec, ``path``
+    already includes any ``root_path`` the application is mounted at.
+    """
+    host = headers.get('Host')
+    if host is None and scope.get('server'):
+        server_host, port = scope['server']
+        host = '{}:{}'.format(server_host, port)
+    url = '{}://{}{}'.format(scope.get('scheme', 'http'), host,
+                             scope['path'])
+    query_string = scope.get('query_string', b'').decode('latin-1')
+    return '{}?{}'.format(url, query_string)
+
+
+class LTIMiddleware(object):
+    """
+    ASGI middleware that verifies LTI launch requests before they reach
+    the wrapped application.
+
+    Requests under any of ``paths`` must be valid, signed launches; the
+    body is buffered (up to ``max_body_size`` bytes), verified with
+    :py:func:`aiolti.common.verify_request_common`, and replayed to the
+    application (fields longer than ``max_field_size`` are rejected).
+    The verified LTI parameters are attached to the scope
+    as ``scope[scope_key]``. Invalid launches get a plain 400 response.
+    ``nonce_store`` and ``timestamp_threshold`` are passed on to the
+    verification.
+
+    Usage::
+
+        app = LTIMiddleware(app, consumers, paths=['/launch'])
+    """
+
+    def __init__(self, app, consumers, paths=None, scope_key='lti',
+                 property_list=None, max_body_size=DEFAULT_MAX_BODY_SIZE,
+                 nonce_store=None, timestamp_threshold=TIMESTAMP_THRESHOLD,
+                 max_field_size=None):
+        # pylint: disable=too-many-arguments
+        self.app = app
+        self.consumers = consumers
+        self.paths = tuple(paths) if paths is not None else None
+        self.scope_key = scope_key
+        self.property_list = property_list or LTI_PROPERTY_LIST
+        self.max_body_size = max_body_size
+        self.max_field_size = max_field_size
+        self.nonce_store = nonce_store
+        self.timestamp_threshold = timestamp_threshold
+
+    def _is_protected(self, scope):
+        if scope['type'] != 'http':
+            return False
+        if self.paths is None:
+            return True
+        return scope['path'].startswith(self.paths)
+
+    async def __call__(self, scope, receive, send):
+        if not self._is_protected(scope):
+            await self.app(scope, receive, send)
+            return
+
+        headers = {header_name(name): value.decode('latin-1')
+                   for name, value in scope.get('headers', [])}
+        try:
+            check_content_length(headers, self.max_body_size)
+            body = await self._read_body(receive)
+            claims = self._verify(scope, headers, body)
+        except LTIException as lti_exception:
+            log.debug('LTI middleware rejected request: %s', lti_exception)
+            await self._reject(send, lti_exception)
+            return
+
+        scope = dict(scope)
+        scope[self.scope_key] = claims
+        await self.app(scope, self._replay(body, receive), send)
+
+    async def _read_body(self, receive):
+        chunks = []
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise LTIException('Client disconnected')
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if self.max_body_size is not None and size > self.max_body_size:
+                raise LTIException('Request body too large')
+            chunks.append(chunk)
+            more_body = message.get('more_body', False)
+        return b''.join(chunks)
+
+    @staticmethod
+    def _replay(body, receive):
+        sent = []
+
+        async def replay_receive():
+            if not sent:
+                sent.append(True)
+                return {'type': 'http.request', 'body': body,
+                        'more_body': False}
+            return await receive()
+
+        return replay_receive
+
+    def _verify(self, scope, headers, body):
+        method = scope['method']
+        content_type = headers.get('Content-Type', '').split(';')[0].strip()
+        if method == 'POST' and content_type == FORM_CONTENT_TYPE:
+            params = decode_form(body, max_field_size=self.max_field_size)
+        else:
+            params = decode_form(scope.get('query_string', b''),
+                                 max_field_size=self.max_field_size)
+
+        verify_request_common(self.consumers, scope_url(scope, headers),
+                              method, headers, params,
+                              nonce_store=self.nonce_store,
+                              timestamp_threshold=self.timestamp_threshold)
+        return {prop: first_value(params[prop])
+                for prop in self.property_list if params.get(prop)}
+
+    @staticmethod
+    async def _reject(send, lti_exception):
+        body = 'LTI Error: {}'.format(lti_exception.args[0]).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': 400,
+            'headers': [
+                (b'content-type', b'text/plain; charset=utf-8'),
+                (b'content-length', str(len(body)).encode('ascii')),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Per-host circuit breakers for outcome passback
+"""
+from __future__ import absolute_import
+
+import logging
+import time
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+CLOSED = u'closed'
+OPEN = u'open'
+HALF_OPEN = u'half-open'
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker with the usual closed/open/half-open states.
+
+    After ``failure_threshold`` consecutive failures the breaker opens
+    and calls are refused. Once ``reset_timeout`` seconds have passed it
+    goes half-open and lets up to ``half_open_max_calls`` probes through;
+    a successful probe closes it, a failed one opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0,
+                 half_open_max_calls=1, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.failures = 0
+        self._clock = clock
+        self._state = CLOSED
+        self._opened_at = None
+        self._probes = 0
+
+    @property
+    def state(self):
+        """
+        Current state (one of CLOSED, OPEN, HALF_OPEN)
+        """
+        if self._state == OPEN and self.retry_after == 0:
+            self._state = HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    @property
+    def retry_after(self):
+        """
+        Seconds until an open breaker will admit a probe (0 otherwise)
+        """
+        if self._state != OPEN:
+            return 0
+        remaining = self._opened_at + self.reset_timeout - self._clock()
+        return max(0.0, remaining)
+
+    def allow(self):
+        """
+        Whether a call may go through now. In half-open state, every
+        admitted call counts as a probe and must be followed by
+        :py:meth:`record_success` or :py:meth:`record_failure`.
+
+        :return: True if call is allowed
+        """
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and self._probes < self.half_open_max_calls:
+            self._probes += 1
+            return True
+        return False
+
+    def record_success(self):
+        """
+        Report a successful call
+        """
+        if self._state != CLOSED:
+            log.info("Circuit breaker closed")
+        self._state = CLOSED
+        self.failures = 0
+        self._probes = 0
+
+    def release(self):
+        """
+        Report that an admitted call was abandoned (e.g. cancelled)
+        without an outcome
+        """
+        if self._probes > 0:
+            self._probes -= 1
+
+    def record_failure(self):
+        """
+        Report a failed call
+        """
+        self.failures += 1
+        if self._state == HALF_OPEN or (
+                self._state == CLOSED and
+                self.failures >= self.failure_threshold):
+            log.warning("Circuit breaker opened after %d failures",
+                        self.failures)
+            self._state = OPEN
+            self._opened_at = self._clock()
+            self._probes = 0
+
+
+class CircuitBreakerRegistry(object):
+    """
+    One circuit breaker per outcome host, created on first use
+    with the registry's settings.
+    """
+
+    def __init__(self, clock=time.monotonic, **settings):
+        self._clock = clock
+        self._settings = settings
+        self._breakers = dict()
+
+    def configure(self, **settings):
+        """
+        Change settings (failure_threshold, reset_timeout,
+        half_open_max_calls) for all breakers; existing state is discarded.
+        """
+        self._settings = settings
+        self._breakers.clear()
+
+    def get(self, host):
+        """
+        Returns breaker for host
+
+        :param host: outcome service host (netloc)
+        :return: CircuitBreaker
+        """
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(clock=self._clock, **self._settings)
+            self._breakers[host] = breaker
+        return breaker
+
+    def states(self):
+        """
+        Returns current state of every known breaker
+
+        :return: dict mapping host to state
+        """
+        return {host: breaker.state
+                for host, breaker in self._breakers.items()}
+
+    def reset(self):
+        """
+        Forget all breakers
+        """
+        self._breakers.clear()
+
+
+breakers = CircuitBreakerRegistry()  # pylint: disable=invalid-name
+
+
+def breaker_state(host):
+    """
+    Returns state of the breaker for an outcome host
+
+    :param host: outcome service host (netloc)
+    :return: one of CLOSED, OPEN, HALF_OPEN
+    """
+    return breakers.get(host).state
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Coalescing of redundant grade passback requests
+"""
+from __future__ import absolute_import
+
+import asyncio
+import logging
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+COALESCE_WINDOW_KEY = 'passback_coalesce_window'
+
+
+class _Pending(object):
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('send', 'future', 'waiters')
+
+    def __init__(self, send, future):
+        self.send = send
+        self.future = future
+        self.waiters = 1
+
+
+class Coalescer(object):
+    """
+    Collapses calls that share a key within a short window: only the
+    most recently submitted call is actually made, once the window
+    (started by the first submission) expires, and every caller
+    receives its outcome.
+    """
+
+    def __init__(self):
+        self._pending = dict()
+
+    def pending(self, key):
+        """
+        Number of callers waiting on key
+
+        :param key: coalescing key
+        :return: waiter count (0 if nothing is pending)
+        """
+        entry = self._pending.get(key)
+        return entry.waiters if entry is not None else 0
+
+    async def submit(self, key, send, window):
+        """
+        Submit a call, superseding any pending call with the same key
+
+        :param key: coalescing key (hashable)
+        :param send: zero-argument coroutine function making the call
+        :param window: seconds to wait for further submissions
+        :return: result of the call that was actually made
+        """
+        entry = self._pending.get(key)
+        if entry is None:
+            loop = asyncio.get_running_loop()
+            entry = _Pending(send, loop.create_future())
+            self._pending[key] = entry
+            loop.call_later(window, self._flush, key, entry)
+        else:
+            entry.send = send
+            entry.waiters += 1
+            log.debug("Coalesced call for %s (%d waiting)",
+                      key, entry.waiters)
+        # Shield, so one cancelled caller doesn't cancel the shared call
+        return await asyncio.shield(entry.future)
+
+    def _flush(self, key, entry):
+        if self._pending.get(key) is entry:
+            del self._pending[key]
+        task = asyncio.ensure_future(entry.send())
+        task.add_done_callback(
+            lambda done: self._resolve(entry.future, done))
+
+    @staticmethod
+    def _resolve(future, done):
+        if future.done():
+            return
+        if done.cancelled():
+            future.cancel()
+        elif done.exception() is not None:
+            future.set_exception(done.exception())
+        else:
+            future.set_result(done.result())
+
+
+passback_coalescer = Coalescer()  # pylint: disable=invalid-name
+
+
+def consumer_coalesce_window(consumers, lti_key):
+    """
+    Configured coalescing window for consumer
+
+    :param consumers: consumers map
+    :param lti_key: consumer key
+    :return: window in seconds, or None if coalescing is off
+    """
+    if not consumers:
+        return None
+    consumer = consumers.get(lti_key) or dict()
+    return consumer.get(COALESCE_WINDOW_KEY)
@@ -6,17 +6,28 @@ Common classes and methods for PyLTI module
 from __future__ import absolute_import
 
 import asyncio
+from collections import Counter, namedtuple
 from functools import partial
 
 from abc import ABC, abstractmethod
 
 import logging
 import json
-from xml.etree import ElementTree as etree
-
-import oauth2
-from oauth2 import STRING_TYPES
-from six.moves.urllib.parse import urlparse, urlencode
+import socket
+import time
+from urllib.parse import unquote, urlparse
+
+from .breaker import breakers, breaker_state
+from .coalesce import passback_coalescer, consumer_coalesce_window
+from .context import CONTEXT_PROPERTIES, CONTEXT_REF_KEY
+from .hedge import consumer_hedge, hedge_policy, hedged
+from .limiter import passback_limits
+from .ratelimit import throttle_passback
+from .rotation import secret_order
+from .scheduler import passback_scheduler, INTERACTIVE
+from .signer import get_signer
+from .tracing import tracer
+from .transport import get_transport
 
 log = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
@@ -24,7 +35,6 @@ LTI_PROPERTY_LIST = [
     'oauth_consumer_key',
     'launch_presentation_return_url',
     'user_id',
-    'oauth_nonce',
     'context_label',
     'context_id',
     'resource_link_title',
@@ -56,56 +66,51 @@ LTI_SESSION_KEY = u'lti_authenticated'
 
 LTI_REQUEST_TYPE = [u'any', u'initial', u'session']
 
+# Allowed clock skew for oauth_timestamp, in seconds
+TIMESTAMP_THRESHOLD = 300
 
-class LTIOAuthServer(oauth2.Server):
-    """
-    Largely taken from reference implementation
-    for app engine at https://code.google.com/p/ims-dev/
-    """
+OAUTH_REQUIRED_PARAMS = (
+    'oauth_consumer_key',
+    'oauth_signature_method',
+    'oauth_signature',
+    'oauth_timestamp',
+    'oauth_nonce',
+)
 
-    def __init__(self, consumers, signature_methods=None):
-        """
-        Create OAuth server
-        """
-        super(LTIOAuthServer, self).__init__(signature_methods)
-        self.consumers = consumers
+# Rejection message for failed oauth checks; does not say which failed
+OAUTH_ERROR = "OAuth error: Please check your key and secret"
 
-    def lookup_consumer(self, key):
-        """
-        Search through keys
-        """
-        if not self.consumers:
-            log.critical(("No consumers defined in settings."
-                          "Have you created a configuration file?"))
-            return None
+# Verification stages, cheapest first
+STAGE_CONTENT_LENGTH = u'content_length'
+STAGE_REQUIRED_FIELDS = u'required_fields'
+STAGE_CONSUMER = u'consumer'
+STAGE_TIMESTAMP = u'timestamp'
+STAGE_NONCE = u'nonce'
+STAGE_SIGNATURE = u'signature'
+STAGE_BODY_HASH = u'body_hash'
 
-        consumer = self.consumers.get(key)
-        if not consumer:
-            log.info("Did not find consumer, using key: %s ", key)
-            return None
+# Count of rejected requests, per stage
+VERIFICATION_REJECTIONS = Counter()
 
-        secret = consumer.get('secret', None)
-        if not secret:
-            log.critical(('Consumer %s, is missing secret'
-                          'in settings file, and needs correction.'), key)
-            return None
-        return oauth2.Consumer(key, secret)
+# Classes from aiolti.oauth, loaded on first access (see __getattr__ below)
+_OAUTH_NAMES = (
+    'LTIOAuthServer',
+    'SignatureMethod_HMAC_SHA1_Unicode',
+    'SignatureMethod_PLAINTEXT_Unicode',
+    'Request_Fix_Duplicate',
+)
 
-    def lookup_cert(self, key):
-        """
-        Search through keys
-        """
-        if not self.consumers:
-            log.critical(("No consumers defined in settings."
-                          "Have you created a configuration file?"))
-            return None
 
-        consumer = self.consumers.get(key)
-        if not consumer:
-            log.info("Did not find consumer, using key: %s ", key)
-            return None
-        cert = consumer.get('cert', None)
-        return cert
+def __getattr__(name):
+    """
+    Lazily re-export the oauth2-based classes, so importing this module
+    doesn't pull in oauth2 and httplib2 (PEP 562)
+    """
+    if name in _OAUTH_NAMES:
+        from . import oauth  # pylint: disable=import-outside-toplevel
+        return getattr(oauth, name)
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name))
 
 
 class LTIException(Exception):
@@ -124,6 +129,17 @@ class LTINotInSessionException(LTIException):
     pass
 
 
+class LTIVerificationException(LTIException):
+    """
+    Exception class for when request verification fails;
+    ``stage`` records which check rejected the request.
+    """
+
+    def __init__(self, message, stage=None):
+        super(LTIVerificationException, self).__init__(message)
+        self.stage = stage
+
+
 class LTIRoleException(LTIException):
     """
     Exception class for when LTI user doesn't have the
@@ -140,77 +156,235 @@ class LTIPostMessageException(LTIException):
     pass
 
 
+class LTIRateLimitException(LTIException):
+    """
+    Exception class for when a consumer exceeds its
+    configured launch rate.
+    """
+
+    def __init__(self, message, retry_after=None):
+        super(LTIRateLimitException, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class LTITokenException(LTIException):
+    """
+    Exception class for when a bearer token is missing, malformed,
+    forged or expired.
+    """
+    pass
+
+
+class LTIOutcomeException(LTIException):
+    """
+    Exception class for when a received outcome (POX) request
+    is malformed.
+    """
+    pass
+
+
+class LTIPostMessageTimeout(LTIPostMessageException):
+    """
+    Exception class for when passback did not complete
+    within its timeout.
+    """
+    pass
+
+
+class LTICircuitOpenException(LTIPostMessageException):
+    """
+    Exception class for when passback is refused because the
+    outcome host's circuit breaker is open.
+    """
+
+    def __init__(self, message, host=None, retry_after=None):
+        super(LTICircuitOpenException, self).__init__(message)
+        self.host = host
+        self.retry_after = retry_after
+
+
+class Timeout(namedtuple('Timeout', ['connect', 'read', 'total'])):
+    """
+    Passback timeouts, in seconds (None means no limit):
+
+    - ``connect``: establishing the connection (including TLS handshake)
+    - ``read``: each blocking read/write once connected
+    - ``total``: whole call, including waits for the consumer's passback
+      rate limit, the host's concurrency limit and the passback
+      scheduler; on expiry the call is aborted
+    """
+    __slots__ = ()
+
+    @classmethod
+    def coerce(cls, value):
+        """
+        Accept a Timeout, a dict of its fields, or a number used for
+        all three.
+        """
+        if value is None or isinstance(value, cls):
+            return value
+        if isinstance(value, dict):
+            return cls(**value)
+        return cls(value, value, value)
+
+
+Timeout.__new__.__defaults__ = (None, None, None)
+
+# Global default, used unless the call or the consumer's
+# ``passback_timeout`` setting says otherwise
+DEFAULT_TIMEOUT = Timeout(connect=10.0, read=30.0, total=60.0)
+
+
+def _resolve_timeout(consumers, lti_key, timeout):
+    if timeout is not None:
+        return Timeout.coerce(timeout)
+    consumer = (consumers or dict()).get(lti_key) or dict()
+    if consumer.get('passback_timeout') is not None:
+        return Timeout.coerce(consumer['passback_timeout'])
+    return DEFAULT_TIMEOUT
+
+
 async def _post_patched_request(consumers, lti_key, body,
-                                url, method, content_type):
+                                url, method, content_type, timeout=None,
+                                transport=None, lane=None):
     """
-    Authorization header needs to be capitalized for some LTI clients
-    this function ensures that header is capitalized
+    Sends a signed request to an LTI consumer. The Authorization header
+    is sent capitalized, as some LTI consumers require.
 
     :param body: body of the call
-    :param client: OAuth Client
     :param url: outcome url
-    :return: response
+    :param timeout: Timeout (or number); None for consumer/global default
+    :param transport: Transport to send with (default: the one set with
+        :py:func:`aiolti.transport.set_transport`)
+    :param lane: :py:data:`aiolti.scheduler.passback_scheduler` lane to send
+        the request in (None: not scheduled)
+    :return: (response, content)
+    :exception: LTIPostMessageTimeout if a timeout expired
+    :exception: ValueError for an unknown lane
     """
     # pylint: disable=too-many-locals, too-many-arguments
-    oauth_server = LTIOAuthServer(consumers)
-    oauth_server.add_signature_method(SignatureMethod_HMAC_SHA1_Unicode())
-    lti_consumer = oauth_server.lookup_consumer(lti_key)
-    lti_cert = oauth_server.lookup_cert(lti_key)
-    secret = lti_consumer.secret
-
-    consumer = oauth2.Consumer(key=lti_key, secret=secret)
-    client = oauth2.Client(consumer)
-
-    if lti_cert:
-        client.add_certificate(key=lti_cert, cert=lti_cert, domain='')
-        log.debug("cert %s", lti_cert)
-
-    import httplib2  # pylint: disable=import-outside-toplevel
-
-    http = httplib2.Http
-    # pylint: disable=protected-access
-    normalize = http._normalize_headers
-
-    def my_normalize(self, headers):
-        """ This function patches Authorization header """
-        ret = normalize(self, headers)
-        if 'authorization' in ret:
-            ret['Authorization'] = ret.pop('authorization')
-        log.debug("headers")
-        log.debug(headers)
-        return ret
-
-    http._normalize_headers = my_normalize
-    monkey_patch_function = normalize
-    # oauth2 (not to be confused with python-oauth2) is a 5yr old library at this point...
-    # so, for async, we'll take the easy way out and run in default thread executor
-    response, content = \
-        await asyncio.get_running_loop().run_in_executor(None, partial(client.request,
-            url,
-            method,
-            body=body.encode('utf-8'),
-            headers={'Content-Type': content_type}
-        ))
-    # response, content = client.request(
-    #     url,
-    #     method,
-    #     body=body.encode('utf-8'),
-    #     headers={'Content-Type': content_type})
-
-    http = httplib2.Http
-    # pylint: disable=protected-access
-    http._normalize_headers = monkey_patch_function
+    host = urlparse(url).netloc
+    with tracer.span('passback', host=host, method=method) as span:
+        response, content = await _send_passback(
+            consumers, lti_key, body, url, method, content_type, timeout,
+            transport, host, lane)
+        span.args['status'] = response.status
+    return response, content
+
+
+async def _send_passback(consumers, lti_key, body, url, method,
+                         content_type, timeout, transport, host, lane):
+    """
+    Body of :py:func:`_post_patched_request`, within its trace span
+    """
+    # pylint: disable=too-many-locals, too-many-arguments
+    if lane is not None:
+        # A bad lane is the caller's error, not the host's
+        passback_scheduler.check_lane(lane)
+    timeout = _resolve_timeout(consumers, lti_key, timeout)
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout.total is None else loop.time() + timeout.total
+
+    def remaining():
+        if deadline is None:
+            return None
+        return max(0.0, deadline - loop.time())
+
+    breaker = breakers.get(host)
+    if not breaker.allow():
+        log.info("Circuit open for %s, refusing passback", host)
+        raise LTICircuitOpenException(
+            "Outcome service unavailable", host=host,
+            retry_after=breaker.retry_after)
+    limit = passback_limits.get(host)
+    try:
+        with tracer.span('passback.throttle'):
+            await asyncio.wait_for(
+                throttle_passback(consumers, lti_key, host), remaining())
+
+        consumer = (consumers or dict()).get(lti_key) or dict()
+        # Always the current secret, even while previous ones still verify
+        secret = consumer.get('secret')
+        if not secret:
+            raise LTIPostMessageException(
+                "No secret configured for consumer key")
+        lti_cert = consumer.get('cert')
+
+        with tracer.span('passback.sign'):
+            data = body.encode('utf-8')
+            headers = get_signer(lti_key, secret).sign_request(
+                method, url, data)
+            headers['Content-Type'] = content_type
+
+        # Wait for one of the host's adaptive concurrency slots
+        with tracer.span('passback.slot'):
+            await asyncio.wait_for(limit.acquire(lane), remaining())
+    except asyncio.TimeoutError:
+        breaker.release()
+        log.info("Passback to %s timed out waiting for a slot", host)
+        raise LTIPostMessageTimeout("Post Message timed out")
+    except BaseException:
+        # Cancelled or failed before the request: give back a
+        # half-open probe taken by allow()
+        breaker.release()
+        raise
+
+    started = None
+
+    async def send():
+        nonlocal started
+        started = time.monotonic()
+        with tracer.span('passback.request'):
+            return await (transport or get_transport()).request(
+                url, method, headers, data,
+                timeout._replace(total=remaining()), cert=lti_cert)
+
+    try:
+        if lane is None:
+            response, content = await send()
+        else:
+            # The scheduler slot is only taken once throttling and the
+            # host's limit let the request through, and is held for the
+            # request alone
+            response, content = await asyncio.wait_for(
+                passback_scheduler.run(lane, send), remaining())
+    except asyncio.CancelledError:
+        limit.release()
+        breaker.release()
+        raise
+    except (asyncio.TimeoutError, socket.timeout):
+        if started is None:
+            # Timed out waiting for the scheduler, not on the host
+            limit.release()
+            breaker.release()
+        else:
+            limit.release(time.monotonic() - started, success=False)
+            breaker.record_failure()
+        log.info("Passback to %s timed out", host)
+        raise LTIPostMessageTimeout("Post Message timed out")
+    except Exception:
+        limit.release(time.monotonic() - started, success=False)
+        breaker.record_failure()
+        raise
+    success = response.status < 500
+    latency = time.monotonic() - started
+    limit.release(latency, success=success)
+    if success:
+        hedge_policy.record(host, latency)
+        breaker.record_success()
+    else:
+        breaker.record_failure()
 
     log.debug("key %s", lti_key)
-    log.debug("secret %s", secret)
     log.debug("url %s", url)
-    log.debug("response %s", response)
+    log.debug("response %s", response.status)
     log.debug("content %s", format(content))
 
     return response, content
 
 
-async def post_message(consumers, lti_key, url, body):
+async def post_message(consumers, lti_key, url, body, timeout=None,
+                       lane=None):
     """
         Posts a signed message to LTI consumer
 
@@ -218,8 +392,11 @@ async def post_message(consumers, lti_key, url, body):
     :param lti_key: key to find appropriate consumer
     :param url: post url
     :param body: xml body
+    :param timeout: Timeout (or number of seconds) for this call
+    :param lane: passback scheduler lane (None: not scheduled)
     :return: success
     """
+    # pylint: disable=too-many-arguments
     content_type = 'application/xml'
     method = 'POST'
     (_, content) = await _post_patched_request(
@@ -229,6 +406,8 @@ async def post_message(consumers, lti_key, url, body):
         url,
         method,
         content_type,
+        timeout=timeout,
+        lane=lane,
     )
 
     is_success = b"<imsx_codeMajor>success</imsx_codeMajor>" in content
@@ -237,7 +416,8 @@ async def post_message(consumers, lti_key, url, body):
 
 
 async def post_message2(consumers, lti_key, url, body,
-                  method='POST', content_type='application/xml'):
+                        method='POST', content_type='application/xml',
+                        timeout=None, lane=None):
     """
         Posts a signed message to LTI consumer using LTI 2.0 format
 
@@ -245,6 +425,8 @@ async def post_message2(consumers, lti_key, url, body,
     :param: lti_key: key to find appropriate consumer
     :param: url: post url
     :param: body: xml body
+    :param: timeout: Timeout (or number of seconds) for this call
+    :param: lane: passback scheduler lane (None: not scheduled)
     :return: success
     """
     # pylint: disable=too-many-arguments
@@ -255,6 +437,8 @@ async def post_message2(consumers, lti_key, url, body,
         url,
         method,
         content_type,
+        timeout=timeout,
+        lane=lane,
     )
 
     is_success = response.status == 200
@@ -263,24 +447,161 @@ async def post_message2(consumers, lti_key, url, body,
     return is_success
 
 
-def verify_request_common(consumers, url, method, headers, params):
+def _oauth_header_params(headers):
+    """
+    OAuth protocol parameters from the Authorization header, if any
+    (cheap parse, without building an oauth2 request)
+    """
+    auth = headers.get('Authorization', headers.get('HTTP_AUTHORIZATION'))
+    if not auth or not auth.startswith('OAuth '):
+        return dict()
+    params = dict()
+    for param in auth[len('OAuth '):].split(','):
+        key, _, value = param.strip().partition('=')
+        if key.startswith('oauth_'):
+            params[key] = unquote(value.strip('"'))
+    return params
+
+
+def reject(stage, message):
+    """
+    Record rejection at a verification stage and build its exception
+
+    :param stage: rejecting stage, one of the ``STAGE_*`` constants
+    :param message: exception message
+    :return: LTIVerificationException
+    """
+    log.info('LTI request rejected at stage %s', stage)
+    VERIFICATION_REJECTIONS[stage] += 1
+    return LTIVerificationException(message, stage=stage)
+
+
+def _nonce_seen(nonce_store, consumer_key, nonce):
+    """
+    Read-only replay check, before any signature work
+    """
+    seen = getattr(nonce_store, 'seen', None)
+    return seen is not None and seen(consumer_key, nonce)
+
+
+def check_content_length(headers, max_content_length):
+    """
+    First verification stage: reject oversized requests from the
+    Content-Length header alone, before the body is read
+
+    :param headers: request headers
+    :param max_content_length: size limit in bytes, or None for no limit
+    :raises: LTIVerificationException if body is too large
+    """
+    if max_content_length is None:
+        return
+    try:
+        content_length = int(headers.get('Content-Length') or 0)
+    except ValueError:
+        content_length = 0
+    if content_length > max_content_length:
+        raise reject(STAGE_CONTENT_LENGTH, 'Request body too large')
+
+
+def verify_oauth_params(consumers, headers, params=None, nonce_store=None,
+                        timestamp_threshold=TIMESTAMP_THRESHOLD,
+                        extra_required=()):
+    """
+    Verification stages that need no signature work, shared by launches
+    and outcome requests: required oauth fields, consumer key, timestamp
+    and a read-only nonce lookup (the nonce is left for the caller to
+    record once the request is known to be authentic).
+
+    :param consumers: consumers from config file
+    :param headers: request headers
+    :param params: request params, for oauth fields not in the
+        Authorization header (None: header only)
+    :param nonce_store: optional store for replay checks
+    :param timestamp_threshold: allowed clock skew, in seconds
+    :param extra_required: oauth fields required besides
+        OAUTH_REQUIRED_PARAMS, e.g. ``oauth_body_hash``
+    :return: (oauth params, consumer config, timestamp)
+    :raises: LTIVerificationException, with the rejecting ``stage``
+    """
+    # pylint: disable=too-many-arguments
+    required = OAUTH_REQUIRED_PARAMS + tuple(extra_required)
+    oauth_params = _oauth_header_params(headers)
+    for key in required:
+        # Protocol parameters may not be repeated
+        if key not in oauth_params and isinstance(
+                (params or dict()).get(key), str):
+            oauth_params[key] = params[key]
+    if any(not oauth_params.get(key) for key in required):
+        log.info('Received non oauth request on oauth protected page')
+        raise reject(STAGE_REQUIRED_FIELDS,
+                     'This page requires a valid oauth session or request')
+
+    consumer_key = oauth_params['oauth_consumer_key']
+    consumer_config = (consumers or dict()).get(consumer_key)
+    if not consumer_config or not consumer_config.get('secret'):
+        raise reject(STAGE_CONSUMER, OAUTH_ERROR)
+
+    try:
+        timestamp = int(oauth_params['oauth_timestamp'])
+    except ValueError:
+        raise reject(STAGE_TIMESTAMP, OAUTH_ERROR)
+    if abs(time.time() - timestamp) > timestamp_threshold:
+        raise reject(STAGE_TIMESTAMP, OAUTH_ERROR)
+
+    if _nonce_seen(nonce_store, consumer_key, oauth_params['oauth_nonce']):
+        raise reject(STAGE_NONCE, OAUTH_ERROR)
+    return oauth_params, consumer_config, timestamp
+
+
+def verify_request_common(consumers, url, method, headers, params,
+                          nonce_store=None, max_content_length=None,
+                          timestamp_threshold=TIMESTAMP_THRESHOLD):
     """
     Verifies that request is valid
 
+    Checks run cheapest first, so that invalid requests are turned away
+    before any signature work: content length, required oauth fields,
+    consumer key, timestamp, nonce, and finally the signature itself.
+    The nonce is only looked up at first; it is recorded once the
+    signature is verified, so unsigned requests cannot fill the store
+    or use up nonces they have seen in flight.
+
     :param consumers: consumers from config file
     :param url: request url
     :param method: request method
     :param headers: request headers
     :param params: request params
+    :param nonce_store: optional store for replay checks
+        (see :py:mod:`aiolti.nonce`); stores without a ``seen`` method
+        are only checked after the signature
+    :param max_content_length: optional request body size limit
+    :param timestamp_threshold: allowed clock skew, in seconds
     :return: is request valid
+    :raises: LTIVerificationException, with the rejecting ``stage``
     """
+    # pylint: disable=too-many-arguments, too-many-locals
     log.debug("consumers %s", consumers)
     log.debug("url %s", url)
     log.debug("method %s", method)
     log.debug("headers %s", headers)
     log.debug("params %s", params)
 
+    check_content_length(headers, max_content_length)
+    oauth_params, consumer_config, timestamp = verify_oauth_params(
+        consumers, headers, params, nonce_store, timestamp_threshold)
+    oauth_consumer_key = oauth_params['oauth_consumer_key']
+
+    # pylint: disable=import-outside-toplevel
+    import oauth2
+    from .oauth import (
+        LTIOAuthServer,
+        Request_Fix_Duplicate,
+        SignatureMethod_HMAC_SHA1_Unicode,
+        SignatureMethod_PLAINTEXT_Unicode,
+    )
+
     oauth_server = LTIOAuthServer(consumers)
+    oauth_server.timestamp_threshold = timestamp_threshold
     oauth_server.add_signature_method(
         SignatureMethod_PLAINTEXT_Unicode())
     oauth_server.add_signature_method(
@@ -303,26 +624,36 @@ def verify_request_common(consumers, url, method, headers, params):
     )
     if not oauth_request:
         log.info('Received non oauth request on oauth protected page')
-        raise LTIException('This page requires a valid oauth session '
-                           'or request')
-    try:
-        # pylint: disable=protected-access
-        oauth_consumer_key = oauth_request.get_parameter('oauth_consumer_key')
-        consumer = oauth_server.lookup_consumer(oauth_consumer_key)
-        if not consumer:
-            raise oauth2.Error('Invalid consumer.')
-        oauth_server.verify_request(oauth_request, consumer, None)
-    except oauth2.Error:
-        # Rethrow our own for nice error handling (don't print
-        # error message as it will contain the key
-        raise LTIException("OAuth error: Please check your key and secret")
-
+        raise reject(STAGE_REQUIRED_FIELDS,
+                     'This page requires a valid oauth session or request')
+    # During secret rotation, try each valid secret, starting with the
+    # one this consumer last signed with
+    with tracer.span('launch.signature'):
+        for secret in secret_order.candidates(oauth_consumer_key,
+                                              consumer_config):
+            consumer = oauth2.Consumer(oauth_consumer_key, secret)
+            try:
+                oauth_server.verify_request(oauth_request, consumer, None)
+            except oauth2.Error:
+                continue
+            secret_order.record_success(oauth_consumer_key, secret)
+            break
+        else:
+            # Raise our own for nice error handling (don't include
+            # oauth2's error message as it will contain the key)
+            raise reject(STAGE_SIGNATURE, OAUTH_ERROR)
+
+    # Record nonce now that the request is known to be authentic (and
+    # catch a concurrent replay that passed the lookup)
+    if nonce_store is not None and not nonce_store.check_and_add(
+            oauth_consumer_key, oauth_params['oauth_nonce'], timestamp):
+        raise reject(STAGE_NONCE, OAUTH_ERROR)
     return True
 
 
 def generate_request_xml(message_identifier_id, operation,
                          lis_result_sourcedid, score):
-    # pylint: disable=too-many-locals
+    # pylint: disable=too-many-locals, import-outside-toplevel
     """
     Generates LTI 1.1 XML for posting result to LTI consumer.
 
@@ -332,6 +663,8 @@ def generate_request_xml(message_identifier_id, operation,
     :param score:
     :return: XML string
     """
+    from xml.etree import ElementTree as etree
+
     root = etree.Element(u'imsx_POXEnvelopeRequest',
                          xmlns=u'http://www.imsglobal.org/services/'
                                u'ltiv1p1/xsd/imsoms_v1p0')
@@ -365,109 +698,6 @@ def generate_request_xml(message_identifier_id, operation,
     return ret
 
 
-class SignatureMethod_HMAC_SHA1_Unicode(oauth2.SignatureMethod_HMAC_SHA1):
-    """
-    Temporary workaround for
-    https://github.com/joestump/python-oauth2/issues/207
-
-    Original code is Copyright (c) 2007 Leah Culver, MIT license.
-    """
-
-    def check(self, request, consumer, token, signature):
-        """
-        Returns whether the given signature is the correct signature for
-        the given consumer and token signing the given request.
-        """
-        built = self.sign(request, consumer, token)
-        if isinstance(signature, STRING_TYPES):
-            signature = signature.encode("utf8")
-        return built == signature
-
-
-class SignatureMethod_PLAINTEXT_Unicode(oauth2.SignatureMethod_PLAINTEXT):
-    """
-    Temporary workaround for
-    https://github.com/joestump/python-oauth2/issues/207
-
-    Original code is Copyright (c) 2007 Leah Culver, MIT license.
-    """
-
-    def check(self, request, consumer, token, signature):
-        """
-        Returns whether the given signature is the correct signature for
-        the given consumer and token signing the given request.
-        """
-        built = self.sign(request, consumer, token)
-        if isinstance(signature, STRING_TYPES):
-            signature = signature.encode("utf8")
-        return built == signature
-
-
-class Request_Fix_Duplicate(oauth2.Request):
-    """
-    Temporary workaround for
-    https://github.com/joestump/python-oauth2/pull/197
-
-    Original code is Copyright (c) 2007 Leah Culver, MIT license.
-    """
-
-    def get_normalized_parameters(self):
-        """
-        Return a string that contains the parameters that must be signed.
-        """
-        items = []
-        for key, value in self.items():
-            if key == 'oauth_signature':
-                continue
-            # 1.0a/9.1.1 states that kvp must be sorted by key, then by value,
-            # so we unpack sequence values into multiple items for sorting.
-            if isinstance(value, STRING_TYPES):
-                items.append(
-                    (oauth2.to_utf8_if_string(key), oauth2.to_utf8(value))
-                )
-            else:
-                try:
-                    value = list(value)
-                except TypeError as e:
-                    assert 'is not iterable' in str(e)
-                    items.append(
-                        (oauth2.to_utf8_if_string(key),
-                         oauth2.to_utf8_if_string(value))
-                    )
-                else:
-                    items.extend(
-                        (oauth2.to_utf8_if_string(key),
-                         oauth2.to_utf8_if_string(item))
-                        for item in value
-                    )
-
-        # Include any query string parameters from the provided URL
-        query = urlparse(self.url)[4]
-        url_items = self._split_url_string(query).items()
-        url_items = [
-            (oauth2.to_utf8(k), oauth2.to_utf8_optional_iterator(v))
-            for k, v in url_items if k != 'oauth_signature'
-        ]
-
-        # Merge together URL and POST parameters.
-        # Eliminates parameters duplicated between URL and POST.
-        items_dict = {}
-        for k, v in items:
-            items_dict.setdefault(k, []).append(v)
-        for k, v in url_items:
-            if not (k in items_dict and v in items_dict[k]):
-                items.append((k, v))
-
-        items.sort()
-
-        encoded_str = urlencode(items, True)
-        # Encode signature parameters per Oauth Core 1.0 protocol
-        # spec draft 7, section 3.6
-        # (http://tools.ietf.org/html/draft-hammer-oauth-07#section-3.6)
-        # Spaces must be encoded with "%20" instead of "+"
-        return encoded_str.replace('+', '%20').replace('%7E', '~')
-
-
 class LTIBase(ABC):
     """
     LTI Object represents abstraction of current LTI session. It provides
@@ -614,15 +844,83 @@ class LTIBase(ABC):
         else:
             raise LTIException("Unknown role {}.".format(role))
 
-    def _check_role(self):
+    def _context_registry(self):  # pylint: disable=no-self-use
+        """
+        Registry of shared context data, if one is configured
+
+        :return: ContextRegistry or None
+        """
+        return None
+
+    def launch_param(self, prop):
+        """
+        Launch property of the current session, read through the context
+        registry for shared context properties
+
+        :param prop: LTI property name
+        :return: value
+        :raises: KeyError if the launch did not provide it
+        """
+        value = self.session.get(prop)
+        if value is None:
+            ref = self.session.get(CONTEXT_REF_KEY)
+            registry = self._context_registry()
+            if ref and registry is not None:
+                value = (registry.lookup(ref) or dict()).get(prop)
+        if value is None:
+            raise KeyError(prop)
+        return value
+
+    def _update_session(self, params, property_list):
+        """
+        Bring LTI properties in session in line with params. Only keys whose
+        values actually change are written, so that an unchanged session is
+        not re-signed and re-sent. With a context registry, properties
+        shared by the launch's context are kept there and the session holds
+        a reference instead.
+
+        :param params: dict of launch parameters (property values, or lists
+            of values for repeated fields, in which case the first is used)
+        :param property_list: LTI properties kept in session
+        """
+        property_list = list(property_list) + [CONTEXT_REF_KEY]
+        registry = self._context_registry()
+        if registry is not None:
+            ref = registry.register(
+                params.get('oauth_consumer_key'), params)
+            if ref is not None:
+                params = {prop: value for prop, value in params.items()
+                          if prop not in CONTEXT_PROPERTIES}
+                params[CONTEXT_REF_KEY] = ref
+        for prop in property_list:
+            value = params.get(prop)
+            if isinstance(value, list):
+                value = value[0]
+            if value:
+                if self.session.get(prop) != value:
+                    self.session[prop] = value
+            elif prop in self.session:
+                del self.session[prop]
+
+    def _set_logged_in(self, logged_in):
+        """
+        Set LTI_SESSION_KEY, if it changes
+
+        :param logged_in: bool
+        """
+        if bool(self.session.get(LTI_SESSION_KEY, False)) != logged_in:
+            self.session[LTI_SESSION_KEY] = logged_in
+
+    def _check_role(self, role=None):
         """
         Check that user is in role specified as wrapper attribute
+        (or as argument)
 
+        :param: role: role to check instead of the wrapper's
         :exception: LTIRoleException if user is not in roles
         """
-        role = u'any'
-        if 'role' in self.lti_kwargs:
-            role = self.lti_kwargs['role']
+        if role is None:
+            role = self.lti_kwargs.get('role', u'any')
         log.debug(
             "check_role lti_role=%s decorator_role=%s", self.role, role
         )
@@ -630,11 +928,51 @@ class LTIBase(ABC):
         if not (role == u'any' or self.is_role(role)):
             raise LTIRoleException('Not authorized.')
 
-    async def post_grade(self, grade):
+    @property
+    def outcome_service_state(self):
+        """
+        State of the circuit breaker guarding this launch's outcome host
+
+        :return: one of 'closed', 'open', 'half-open'
+        """
+        return breaker_state(urlparse(self.response_url).netloc)
+
+    async def _passback(self, coalesce_key, send, coalesce_window):
+        """
+        Make a passback call, coalescing it with other pending calls
+        for the same key if a coalescing window is in effect
+
+        :param coalesce_key: identifies calls that supersede each other
+        :param send: zero-argument coroutine function making the call
+        :param coalesce_window: seconds, None for consumer default, 0 for off
+        :return: result of the call actually made
+        """
+        if coalesce_window is None:
+            coalesce_window = consumer_coalesce_window(self._consumers(),
+                                                       self.key)
+        if coalesce_window:
+            return await passback_coalescer.submit(coalesce_key, send,
+                                                   coalesce_window)
+        return await send()
+
+    async def post_grade(self, grade, coalesce_window=None, timeout=None,
+                         lane=INTERACTIVE, hedge=None):
         """
         Post grade to LTI consumer using XML
 
         :param: grade: 0 <= grade <= 1
+        :param: coalesce_window: seconds to wait for newer grades for the
+            same sourcedid, sending only the latest (None: consumer's
+            ``passback_coalesce_window`` setting, 0: disabled)
+        :param: timeout: :py:class:`Timeout` (or seconds) for the call
+        :param: lane: passback priority lane,
+            :py:data:`aiolti.scheduler.INTERACTIVE` (default) for grades
+            a user is waiting on, or :py:data:`aiolti.scheduler.BULK`
+            for background work such as regrades
+        :param: hedge: if the request is slower than usual for the host,
+            send it again and take whichever answers first (see
+            :py:mod:`aiolti.hedge`; None: consumer's ``passback_hedge``
+            setting)
         :return: True if post successful and grade valid
         :exception: LTIPostMessageException if call failed
         """
@@ -647,21 +985,36 @@ class LTIBase(ABC):
             xml = generate_request_xml(
                 message_identifier_id, operation, lis_result_sourcedid,
                 score)
-            ret = await post_message(self._consumers(), self.key,
-                                     self.response_url, xml)
+            consumers = self._consumers()
+            url = self.response_url
+            send = partial(post_message, consumers, self.key, url, xml,
+                           timeout=timeout, lane=lane)
+            if hedge is None:
+                hedge = consumer_hedge(consumers, self.key)
+            if hedge:
+                # replaceResult is idempotent, so a duplicate is harmless
+                send = partial(hedged, urlparse(url).netloc, send)
+            ret = await self._passback(
+                (self.key, url, lis_result_sourcedid), send,
+                coalesce_window)
             if not ret:
                 raise LTIPostMessageException("Post Message Failed")
             return True
 
         return False
 
-    async def post_grade2(self, grade, user=None, comment=''):
+    async def post_grade2(self, grade, user=None, comment='',
+                          coalesce_window=None, timeout=None,
+                          lane=INTERACTIVE):
         """
         Post grade to LTI consumer using REST/JSON
         URL munging will is related to:
         https://openedx.atlassian.net/browse/PLAT-281
 
         :param: grade: 0 <= grade <= 1
+        :param: coalesce_window: as for :py:meth:`post_grade`
+        :param: timeout: as for :py:meth:`post_grade`
+        :param: lane: as for :py:meth:`post_grade`
         :return: True if post successful and grade valid
         :exception: LTIPostMessageException if call failed
         """
@@ -679,9 +1032,12 @@ class LTIBase(ABC):
                 "resultScore": score,
                 "comment": comment
             })
-            ret = await post_message2(self._consumers(), self.key, lti2_url, body,
-                                      method='PUT',
-                                      content_type=content_type)
+            ret = await self._passback(
+                (self.key, lti2_url, user),
+                partial(post_message2, self._consumers(), self.key, lti2_url,
+                        body, method='PUT', content_type=content_type,
+                        timeout=timeout, lane=lane),
+                coalesce_window)
             if not ret:
                 raise LTIPostMessageException("Post Message Failed")
             return True
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Launch data shared by all learners of a course context, kept once
+instead of in every session
+"""
+from __future__ import absolute_import
+
+import hashlib
+import logging
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# Launch properties that are the same for every launch of a resource link
+CONTEXT_PROPERTIES = (
+    'context_id',
+    'context_label',
+    'resource_link_id',
+    'resource_link_title',
+    'lis_outcome_service_url',
+)
+
+# Session key holding the reference to the shared context data
+CONTEXT_REF_KEY = 'lti_context'
+
+
+def _first(value):
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+def context_ref(consumer_key, context_id, resource_link_id):
+    """
+    Compact reference for a (consumer, context, resource link)
+
+    :return: hex string
+    """
+    return hashlib.blake2b(
+        u'{}\0{}\0{}'.format(consumer_key, context_id or '',
+                             resource_link_id or '').encode('utf-8'),
+        digest_size=12).hexdigest()
+
+
+class ContextRegistry(object):
+    """
+    Shared launch data (:py:data:`CONTEXT_PROPERTIES`) per consumer key,
+    ``context_id`` and ``resource_link_id``. Sessions keep only the
+    reference returned by :py:meth:`register`.
+
+    ``store`` is any mapping (default: an in-process dict); when sessions
+    are served by several processes it must be shared by all of them,
+    as entries are written only by the process that handled the launch.
+    """
+
+    def __init__(self, store=None):
+        self._store = dict() if store is None else store
+
+    def register(self, consumer_key, params):
+        """
+        Record context data of a verified launch, merged into what
+        earlier launches recorded: fields a launch leaves out (e.g.
+        ``lis_outcome_service_url``, which instructor launches often do
+        not carry) are kept. The store is written only if the data
+        changed.
+
+        :param consumer_key: oauth_consumer_key of launch (or list of
+            values, as decoded from a form)
+        :param params: launch parameters
+        :return: reference, or None if the launch names no context
+            or resource link (its data is then kept in session)
+        """
+        consumer_key = _first(consumer_key)
+        context_id = _first(params.get('context_id'))
+        resource_link_id = _first(params.get('resource_link_id'))
+        if not consumer_key or not (context_id or resource_link_id):
+            return None
+        ref = context_ref(consumer_key, context_id, resource_link_id)
+        stored = self._store.get(ref)
+        fields = dict(stored or ())
+        for prop in CONTEXT_PROPERTIES:
+            value = _first(params.get(prop))
+            if value:
+                fields[prop] = value
+        if stored != fields:
+            log.debug('Context %s updated', ref)
+            self._store[ref] = fields
+        return ref
+
+    def lookup(self, ref):
+        """
+        Context data for reference
+
+        :param ref: reference returned by register
+        :return: dict of properties, or None if unknown
+        """
+        return self._store.get(ref)
+
+    def __len__(self):
+        return len(self._store)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded, streaming decoding of launch request bodies
+"""
+from __future__ import absolute_import
+
+import codecs
+import logging
+from urllib.parse import unquote_to_bytes
+
+from .common import (
+    LTIVerificationException,
+    STAGE_CONTENT_LENGTH,
+    reject,
+)
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+
+DEFAULT_MAX_BODY_SIZE = 64 * 1024
+
+
+def first_value(value):
+    """
+    First value of a decoded form field (fields sent more than once
+    are decoded to a list)
+
+    :param value: str or list of str
+    :return: str
+    """
+    if isinstance(value, list):
+        return value[0]
+    return value
+
+
+def add_value(params, key, value):
+    """
+    Add field to decoded form, keeping duplicates as a list, in order
+
+    :param params: decoded form dict
+    :param key: field name
+    :param value: field value
+    """
+    existing = params.get(key)
+    if existing is None:
+        params[key] = value
+    elif isinstance(existing, list):
+        existing.append(value)
+    else:
+        params[key] = [existing, value]
+
+
+class FormDecoder(object):
+    """
+    Incremental ``application/x-www-form-urlencoded`` decoder.
+
+    Chunks are fed as they arrive and each field is decoded as soon as it
+    is complete, so only the field in progress is buffered. The result is
+    a dict of field name to value, with fields sent more than once
+    decoded to a list of their values (which is what the OAuth
+    signature check expects).
+
+    The total body size and the size of any one field are bounded by
+    ``max_body_size`` and ``max_field_size`` (None for no limit).
+    """
+
+    def __init__(self, max_body_size=None, max_field_size=None,
+                 charset='utf-8'):
+        try:
+            # Only text encodings (not e.g. 'rot13' or 'base64') decode
+            # bytes to str
+            # pylint: disable=protected-access
+            text_encoding = codecs.lookup(charset)._is_text_encoding
+        except LookupError:
+            text_encoding = False
+        if not text_encoding:
+            raise LTIVerificationException('Invalid form encoding')
+        self.max_body_size = max_body_size
+        self.max_field_size = max_field_size
+        self.charset = charset
+        self.params = dict()
+        self._size = 0
+        self._pending = b''
+
+    def feed(self, chunk):
+        """
+        Decode a chunk of the body
+
+        :param chunk: bytes
+        :raises: LTIVerificationException if a size limit is exceeded,
+            or the body is not valid in the charset
+        """
+        self._size += len(chunk)
+        if self.max_body_size is not None and self._size > self.max_body_size:
+            raise reject(STAGE_CONTENT_LENGTH, 'Request body too large')
+        fields = (self._pending + chunk).split(b'&')
+        self._pending = fields.pop()
+        for field in fields:
+            self._decode_field(field)
+        self._check_field_size(self._pending)
+
+    def close(self):
+        """
+        Decode the remainder of the body
+
+        :return: decoded form dict
+        """
+        self._decode_field(self._pending)
+        self._pending = b''
+        return self.params
+
+    def _check_field_size(self, field):
+        if (self.max_field_size is not None and
+                len(field) > self.max_field_size):
+            raise reject(STAGE_CONTENT_LENGTH, 'Form field too large')
+
+    def _decode_field(self, field):
+        if not field:
+            return
+        self._check_field_size(field)
+        key, _, value = field.partition(b'=')
+        try:
+            key = unquote_to_bytes(key.replace(b'+', b' ')).decode(
+                self.charset)
+            value = unquote_to_bytes(value.replace(b'+', b' ')).decode(
+                self.charset)
+        except UnicodeDecodeError:
+            raise LTIVerificationException('Invalid form encoding')
+        add_value(self.params, key, value)
+
+
+async def read_form(body, max_body_size=None, max_field_size=None,
+                    charset='utf-8'):
+    """
+    Decode a form body from an async iterable of chunks
+
+    :param body: async iterable of bytes (e.g. a Quart request body)
+    :param max_body_size: body size limit, or None
+    :param max_field_size: field size limit, or None
+    :param charset: body charset
+    :return: decoded form dict
+    :raises: LTIVerificationException
+    """
+    decoder = FormDecoder(max_body_size, max_field_size, charset)
+    async for chunk in body:
+        decoder.feed(chunk)
+    return decoder.close()
+
+
+def decode_form(data, max_body_size=None, max_field_size=None,
+                charset='utf-8'):
+    """
+    Decode a complete form body (or query string)
+
+    :param data: bytes
+    :return: decoded form dict
+    :raises: LTIVerificationException
+    """
+    decoder = FormDecoder(max_body_size, max_field_size, charset)
+    decoder.feed(data)
+    return decoder.close()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Hedged passback requests, for idempotent operations (replaceResult)
+"""
+from __future__ import absolute_import
+
+import asyncio
+from collections import deque
+import logging
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+HEDGE_KEY = 'passback_hedge'
+
+
+class HedgePolicy(object):
+    """
+    Decides when to hedge a request to an outcome host.
+
+    Latencies of completed passback calls are kept per host (the last
+    ``window`` of them); once ``min_samples`` are known, a hedged call
+    sends a second attempt if the first has not completed within the
+    ``percentile`` latency. Hedges are limited to ``budget`` extra
+    requests per call made (e.g. 0.05 is at most 5% extra load), with up
+    to ``burst`` saved up.
+    """
+
+    def __init__(self, percentile=0.95, budget=0.05, burst=10,
+                 min_samples=20, window=200):
+        # pylint: disable=too-many-arguments
+        self.percentile = percentile
+        self.budget = budget
+        self.burst = burst
+        self.min_samples = min_samples
+        self.window = window
+        self._latencies = dict()
+        self._credit = dict()
+        self.hedges = 0
+
+    def record(self, host, latency):
+        """
+        Record latency of a completed call to host
+
+        :param host: outcome service host (netloc)
+        :param latency: seconds
+        """
+        latencies = self._latencies.get(host)
+        if latencies is None:
+            latencies = self._latencies[host] = deque(maxlen=self.window)
+        latencies.append(latency)
+
+    def delay(self, host):
+        """
+        Hedging delay for host
+
+        :param host: outcome service host (netloc)
+        :return: seconds, or None if too little is known yet
+        """
+        latencies = self._latencies.get(host)
+        if latencies is None or len(latencies) < self.min_samples:
+            return None
+        ordered = sorted(latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile))
+        return ordered[index]
+
+    def earn(self, host):
+        """
+        Add budget for one call to host
+        """
+        self._credit[host] = min(self.burst,
+                                 self._credit.get(host, 0.0) + self.budget)
+
+    def spend(self, host):
+        """
+        Take budget for one hedge to host, if there is enough
+
+        :return: True if a hedge may be sent
+        """
+        credit = self._credit.get(host, 0.0)
+        if credit < 1:
+            return False
+        self._credit[host] = credit - 1
+        self.hedges += 1
+        return True
+
+    def reset(self):
+        """
+        Forget latencies and budget
+        """
+        self._latencies.clear()
+        self._credit.clear()
+        self.hedges = 0
+
+
+hedge_policy = HedgePolicy()  # pylint: disable=invalid-name
+
+
+async def hedged(host, send, policy=None):
+    """
+    Make a call, sending a second identical one if the first is slower
+    than the host's hedging delay; the first successful result wins and
+    the other attempt is cancelled
+
+    :param host: outcome service host (netloc)
+    :param send: zero-argument coroutine function making the call
+        (must be idempotent)
+    :param policy: HedgePolicy (default: module-wide ``hedge_policy``)
+    :return: result of the winning call
+    """
+    policy = policy or hedge_policy
+    policy.earn(host)
+    delay = policy.delay(host)
+    attempts = [asyncio.ensure_future(send())]
+    try:
+        done, _ = await asyncio.wait(attempts, timeout=delay)
+        if not done and policy.spend(host):
+            log.debug("Hedging passback to %s after %.3fs", host, delay)
+            attempts.append(asyncio.ensure_future(send()))
+        pending = set(attempts)
+        while True:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for attempt in attempts:
+                if attempt in done and attempt.exception() is None:
+                    return attempt.result()
+            if not pending:
+                # All failed: report the first attempt's error
+                return attempts[0].result()
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+
+
+def consumer_hedge(consumers, lti_key):
+    """
+    Whether hedging is configured for consumer
+
+    :param consumers: consumers map
+    :param lti_key: consumer key
+    :return: bool
+    """
+    consumer = (consumers or dict()).get(lti_key) or dict()
+    return bool(consumer.get(HEDGE_KEY))
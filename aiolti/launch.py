@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Consumer side: signed LTI launches of third-party tools
+"""
+from __future__ import absolute_import
+
+import binascii
+from html import escape as html_escape
+import json
+import os
+import time
+
+from .common import LTIException
+from .signer import (
+    OAUTH_VERSION,
+    SIGNATURE_METHOD,
+    base_string_uri,
+    escape,
+    get_signer,
+)
+
+# Parameters every basic launch carries, unless overridden
+LAUNCH_DEFAULTS = {
+    'lti_message_type': u'basic-lti-launch-request',
+    'lti_version': u'LTI-1p0',
+}
+
+_AUTO_SUBMIT = u'<script>document.getElementById({}).submit();</script>'
+
+
+def _nonces(count):
+    """
+    count fresh random nonces, from a single read of os.urandom
+    """
+    data = binascii.hexlify(os.urandom(16 * count)).decode('ascii')
+    return [data[index:index + 32] for index in range(0, 32 * count, 32)]
+
+
+def launch_form(url, params, form_id=u'ltiLaunchForm', target=None,
+                auto_submit=True, submit_label=u'Launch'):
+    """
+    HTML form posting signed launch parameters to a tool
+
+    :param url: tool launch URL
+    :param params: signed launch parameters
+    :param form_id: id of the form element
+    :param target: name of the window or iframe to launch in
+    :param auto_submit: add a script submitting the form on load
+        (the submit button is then only shown without javascript)
+    :param submit_label: label of the submit button
+    :return: HTML string
+    """
+    # pylint: disable=too-many-arguments
+    parts = [u'<form action="{}" method="post" id="{}" '
+             u'enctype="application/x-www-form-urlencoded"'.format(
+                 html_escape(url), html_escape(form_id))]
+    if target:
+        parts.append(u' target="{}"'.format(html_escape(target)))
+    parts.append(u'>')
+    for key, value in params.items():
+        parts.append(u'<input type="hidden" name="{}" value="{}"/>'.format(
+            html_escape(key), html_escape(value)))
+    button = u'<button type="submit">{}</button>'.format(
+        html_escape(submit_label))
+    if auto_submit:
+        parts.append(u'<noscript>{}</noscript></form>'.format(button))
+        parts.append(_AUTO_SUBMIT.format(
+            json.dumps(form_id).replace(u'<', u'\\u003c')))
+    else:
+        parts.append(u'{}</form>'.format(button))
+    return u''.join(parts)
+
+
+class LaunchBuilder(object):
+    """
+    Builds signed basic launches of one tool, with the key and secret
+    the tool issued us. Signing uses aiolti's cached per-consumer signer
+    (see :py:func:`aiolti.signer.get_signer`), as outcome passback does.
+
+    :py:meth:`batch` signs many launches at once (e.g. one per item on
+    a page), sharing the timestamp, nonce generation, URL parsing and
+    the encoding of parameters common to all of them.
+    """
+
+    def __init__(self, key, secret, defaults=None):
+        self.signer = get_signer(key, secret)
+        self.defaults = dict(LAUNCH_DEFAULTS)
+        self.defaults.update(defaults or dict())
+
+    def params(self, url, params, timestamp=None, nonce=None):
+        """
+        Signed parameters for one launch
+
+        :param url: tool launch URL
+        :param params: dict of launch parameters (user_id, roles,
+            resource_link_id, ...), added to the builder's defaults
+        :param timestamp: seconds since epoch (default: now)
+        :param nonce: nonce (default: random)
+        :return: dict of signed parameters
+        :raises: LTIException if resource_link_id is missing
+        """
+        launch = dict(self.defaults)
+        launch.update(params)
+        if not launch.get('resource_link_id'):
+            raise LTIException('resource_link_id is required')
+        return self.signer.sign_params('POST', url, launch,
+                                       timestamp=timestamp, nonce=nonce)
+
+    def form(self, url, params, **form_options):
+        """
+        Auto-submitting HTML form for one launch
+
+        :param url: tool launch URL
+        :param params: dict of launch parameters
+        :param form_options: options for :py:func:`launch_form`
+        :return: HTML string
+        """
+        return launch_form(url, self.params(url, params), **form_options)
+
+    def batch(self, launches, common=None, timestamp=None):
+        """
+        Signed parameters for many launches
+
+        :param launches: iterable of (url, params) pairs
+        :param common: dict of launch parameters shared by all launches
+            (e.g. context_id, user_id, roles); launch params override them
+        :param timestamp: seconds since epoch (default: now)
+        :return: list of dicts of signed parameters, in order
+        :raises: LTIException if a launch has no resource_link_id
+        """
+        # pylint: disable=too-many-locals
+        launches = list(launches)
+        shared = dict(self.defaults)
+        shared.update(common or dict())
+        shared.update([
+            ('oauth_consumer_key', self.signer.key),
+            ('oauth_signature_method', SIGNATURE_METHOD),
+            ('oauth_timestamp', str(int(
+                timestamp if timestamp is not None else time.time()))),
+            ('oauth_version', OAUTH_VERSION),
+        ])
+        shared_escaped = {key: (escape(key), escape(value))
+                          for key, value in shared.items()}
+        nonce_key = escape('oauth_nonce')
+        bases = dict()
+        signed_launches = []
+        for (url, params), nonce in zip(launches, _nonces(len(launches))):
+            base = bases.get(url)
+            if base is None:
+                uri, query = base_string_uri(url)
+                base = bases[url] = (
+                    'POST&{}&'.format(escape(uri)),
+                    [(escape(key), escape(value)) for key, value in query])
+            prefix, query = base
+            escaped = dict(shared_escaped)
+            for key, value in params.items():
+                escaped[key] = (escape(key), escape(value))
+            signed = dict(shared)
+            signed.update(params)
+            if not signed.get('resource_link_id'):
+                raise LTIException('resource_link_id is required')
+            signed['oauth_nonce'] = nonce
+            normalized = '&'.join('{}={}'.format(key, value) for key, value
+                                  in sorted(list(escaped.values()) + query +
+                                            [(nonce_key, nonce)]))
+            signed['oauth_signature'] = self.signer.sign_base_string(
+                prefix + escape(normalized))
+            signed_launches.append(signed)
+        return signed_launches
+
+    def batch_forms(self, launches, common=None, form_id=u'ltiLaunchForm',
+                    **form_options):
+        """
+        HTML forms for many launches (not auto-submitting, by default),
+        with ids ``<form_id>-0``, ``<form_id>-1``, ...
+
+        :param launches: iterable of (url, params) pairs
+        :param common: dict of launch parameters shared by all launches
+        :param form_id: prefix of form element ids
+        :param form_options: other options for :py:func:`launch_form`
+        :return: list of HTML strings, in order
+        """
+        launches = list(launches)
+        form_options.setdefault('auto_submit', False)
+        return [
+            launch_form(url, params, form_id=u'{}-{}'.format(form_id, index),
+                        **form_options)
+            for index, ((url, _), params) in enumerate(
+                zip(launches, self.batch(launches, common)))]
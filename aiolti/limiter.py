@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive per-host concurrency limits for outcome passback
+"""
+from __future__ import absolute_import
+
+import asyncio
+import logging
+import time
+
+from .scheduler import LaneQueue, passback_scheduler
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class AdaptiveLimit(object):
+    """
+    Concurrency limit for one outcome host, tuned by AIMD from observed
+    latency and errors.
+
+    Every successful call that is not slow raises the limit by
+    ``increase / limit`` (so by about ``increase`` per limit's worth of
+    calls); a failure, or a call slower than ``latency_tolerance`` times
+    the host's baseline latency (or ``latency_floor``, if that is higher,
+    so that jitter on very fast hosts is ignored), multiplies it by
+    ``decrease``. Decreases are spaced at least one typical latency
+    apart, so a burst of failures from calls that were already in flight
+    counts once.
+
+    The baseline is the lowest latency seen, drifting slowly towards
+    current latencies so that it follows lasting changes.
+
+    Calls waiting for a slot are queued in the passback scheduler's
+    lanes, with its weights, so that interactive calls also jump a bulk
+    backlog for a single host.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, initial=4, min_limit=1, max_limit=64, increase=1.0,
+                 decrease=0.5, latency_tolerance=2.0, latency_floor=0.01,
+                 clock=time.monotonic):
+        # pylint: disable=too-many-arguments
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.latency_floor = latency_floor
+        self.in_flight = 0
+        self.baseline = None
+        self.latency = None
+        self._clock = clock
+        self._last_decrease = None
+        self._waiters = LaneQueue()
+
+    async def acquire(self, lane=None):
+        """
+        Wait for an in-flight slot
+
+        :param lane: :py:data:`aiolti.scheduler.passback_scheduler` lane
+            to wait in (None: a lane of its own, of weight 1)
+        """
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(lane, waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                self._waiters.remove(lane, waiter)
+            else:
+                # Slot was handed over just as we were cancelled
+                self.release()
+            raise
+
+    def release(self, latency=None, success=True):
+        """
+        Give back a slot, reporting the call's outcome
+
+        :param latency: call duration in seconds, or None if the call
+            was abandoned (no sample is taken)
+        :param success: whether the call succeeded
+        """
+        self.in_flight -= 1
+        if latency is not None:
+            self._sample(latency, success)
+        self._wake()
+
+    def _sample(self, latency, success):
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        else:
+            self.baseline += (latency - self.baseline) * 0.01
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += (latency - self.latency) * 0.2
+
+        slow = latency > (max(self.baseline, self.latency_floor) *
+                          self.latency_tolerance)
+        if success and not slow:
+            self.limit = min(self.max_limit,
+                             self.limit + self.increase / self.limit)
+            return
+        now = self._clock()
+        if (self._last_decrease is not None and
+                now - self._last_decrease < self.latency):
+            return
+        self._last_decrease = now
+        limit = max(self.min_limit, self.limit * self.decrease)
+        if int(limit) < int(self.limit):
+            log.info("Passback concurrency limit lowered to %d (%s)",
+                     limit, 'slow' if success else 'failure')
+        self.limit = limit
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft(passback_scheduler.weights)
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+
+
+class AdaptiveLimitRegistry(object):
+    """
+    One adaptive limit per outcome host, created on first use
+    with the registry's settings.
+    """
+
+    def __init__(self, clock=time.monotonic, **settings):
+        self._clock = clock
+        self._settings = settings
+        self._limits = dict()
+
+    def configure(self, **settings):
+        """
+        Change settings (initial, min_limit, max_limit, increase, decrease,
+        latency_tolerance, latency_floor) for all hosts; learned limits are
+        discarded.
+        """
+        self._settings = settings
+        self._limits.clear()
+
+    def get(self, host):
+        """
+        Returns limit for host
+
+        :param host: outcome service host (netloc)
+        :return: AdaptiveLimit
+        """
+        limit = self._limits.get(host)
+        if limit is None:
+            limit = AdaptiveLimit(clock=self._clock, **self._settings)
+            self._limits[host] = limit
+        return limit
+
+    def limits(self):
+        """
+        Returns current limit of every known host
+
+        :return: dict mapping host to (limit, in flight)
+        """
+        return {host: (int(limit.limit), limit.in_flight)
+                for host, limit in self._limits.items()}
+
+    def reset(self):
+        """
+        Forget all learned limits
+        """
+        self._limits.clear()
+
+
+passback_limits = AdaptiveLimitRegistry()  # pylint: disable=invalid-name
+
+
+def concurrency_limits():
+    """
+    Returns current passback concurrency limits
+
+    :return: dict mapping outcome host to (limit, in flight)
+    """
+    return passback_limits.limits()
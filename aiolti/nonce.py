@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Nonce stores for oauth_nonce replay checks
+"""
+from __future__ import absolute_import
+
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+import time
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class MemoryNonceStore(object):
+    """
+    In-process nonce store with timestamp-bucketed expiry.
+
+    Nonces are filed under their request's ``oauth_timestamp``, in buckets
+    of ``bucket_seconds``. Requests outside the timestamp window are
+    rejected before the nonce check, so only buckets within ``ttl`` of now
+    need to be kept; older ones are dropped whole.
+    """
+
+    def __init__(self, ttl=600, bucket_seconds=60, clock=time.time):
+        self.ttl = ttl
+        self.bucket_seconds = bucket_seconds
+        self._clock = clock
+        self._buckets = dict()
+
+    def _expire(self):
+        oldest = int((self._clock() - self.ttl) // self.bucket_seconds)
+        for bucket in [b for b in self._buckets if b < oldest]:
+            del self._buckets[bucket]
+
+    def seen(self, consumer_key, nonce):
+        """
+        Whether nonce was already recorded (without recording it)
+
+        :param consumer_key: oauth_consumer_key of request
+        :param nonce: oauth_nonce of request
+        :return: True on replay
+        """
+        self._expire()
+        entry = (consumer_key, nonce)
+        return any(entry in nonces for nonces in self._buckets.values())
+
+    def check_and_add(self, consumer_key, nonce, timestamp):
+        """
+        Record nonce, unless it was already seen
+
+        :param consumer_key: oauth_consumer_key of request
+        :param nonce: oauth_nonce of request
+        :param timestamp: oauth_timestamp of request (seconds)
+        :return: True if nonce is new, False on replay
+        """
+        if self.seen(consumer_key, nonce):
+            return False
+        entry = (consumer_key, nonce)
+        bucket = int(int(timestamp) // self.bucket_seconds)
+        self._buckets.setdefault(bucket, set()).add(entry)
+        return True
+
+    def __len__(self):
+        return sum(len(nonces) for nonces in self._buckets.values())
+
+
+# Slot layout: 8-byte nonce fingerprint (0 marks an empty slot) and
+# 4-byte timestamp bucket
+_SLOT = struct.Struct('<Qi')
+
+
+def _fingerprint(consumer_key, nonce):
+    digest = hashlib.blake2b(
+        u'{}\0{}'.format(consumer_key, nonce).encode('utf-8'),
+        digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+def _track(shm, tracked):
+    """
+    Register or unregister segment with the multiprocessing resource
+    tracker, which unlinks registered segments when the process exits
+    """
+    # pylint: disable=import-outside-toplevel, protected-access
+    from multiprocessing import resource_tracker
+    if tracked:
+        resource_tracker.register(shm._name, 'shared_memory')
+    else:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+
+
+class SharedMemoryNonceStore(object):
+    """
+    Nonce store shared by all worker processes on a host.
+
+    Nonces are kept in a fixed-size open-addressing hash table in a
+    :py:mod:`multiprocessing.shared_memory` segment called ``name``,
+    created by whichever worker gets there first. Each slot holds a
+    64-bit fingerprint of (consumer key, nonce) and the nonce's timestamp
+    bucket; slots whose bucket is older than ``ttl`` count as free, so
+    expiry needs no sweeping. The table is split into ``stripes`` that
+    are locked independently (with ``fcntl`` byte-range locks on a lock
+    file), and a nonce only ever probes within its own stripe.
+
+    If a stripe has no free slot within ``max_probes``, the oldest entry
+    probed is evicted. Size the table well above the number of launches
+    per ``ttl``.
+
+    POSIX only.
+    """
+
+    def __init__(self, name, slots=1 << 16, stripes=64, max_probes=16,
+                 ttl=600, bucket_seconds=60, lock_path=None,
+                 clock=time.time):
+        # pylint: disable=too-many-arguments
+        # pylint: disable=import-outside-toplevel
+        from multiprocessing import shared_memory
+        if slots % stripes:
+            raise ValueError('slots must be a multiple of stripes')
+        self.slots = slots
+        self.stripes = stripes
+        self.max_probes = min(max_probes, slots // stripes)
+        self.ttl = ttl
+        self.bucket_seconds = bucket_seconds
+        self._clock = clock
+        size = slots * _SLOT.size
+        try:
+            self._shm = shared_memory.SharedMemory(name, create=True,
+                                                   size=size)
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name)
+        if self._shm.size < size:
+            raise ValueError('Shared memory segment {} is too small'.format(
+                name))
+        # The segment outlives any one worker: keep the resource tracker
+        # from unlinking it when this process exits
+        _track(self._shm, False)
+        self._buf = self._shm.buf
+        self._lock_fd = os.open(
+            lock_path or os.path.join(tempfile.gettempdir(),
+                                      '{}.lock'.format(name.lstrip('/'))),
+            os.O_RDWR | os.O_CREAT, 0o600)
+
+    def _probe(self, fingerprint):
+        """
+        Look fingerprint up in its stripe (which must be locked)
+
+        :return: (found, free slot offset, oldest slot offset)
+        """
+        stripe_slots = self.slots // self.stripes
+        home = fingerprint % self.slots
+        start = home - home % stripe_slots
+        oldest = int((self._clock() - self.ttl) // self.bucket_seconds)
+        free = None
+        victim, victim_bucket = None, None
+        for probe in range(self.max_probes):
+            slot = start + (home - start + probe) % stripe_slots
+            offset = slot * _SLOT.size
+            held, held_bucket = _SLOT.unpack_from(self._buf, offset)
+            if held == 0 or held_bucket < oldest:
+                if free is None:
+                    free = offset
+                if held == 0:
+                    # Nothing was ever stored past an empty slot
+                    break
+            elif held == fingerprint:
+                return True, None, None
+            elif victim is None or held_bucket < victim_bucket:
+                victim, victim_bucket = offset, held_bucket
+        return False, free, victim
+
+    def _stripe(self, fingerprint):
+        return fingerprint % self.slots // (self.slots // self.stripes)
+
+    def seen(self, consumer_key, nonce):
+        """
+        Whether nonce was already recorded (by any worker), without
+        recording it
+
+        :param consumer_key: oauth_consumer_key of request
+        :param nonce: oauth_nonce of request
+        :return: True on replay
+        """
+        # pylint: disable=import-outside-toplevel
+        import fcntl
+        fingerprint = _fingerprint(consumer_key, nonce)
+        stripe = self._stripe(fingerprint)
+        fcntl.lockf(self._lock_fd, fcntl.LOCK_SH, 1, stripe)
+        try:
+            return self._probe(fingerprint)[0]
+        finally:
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, stripe)
+
+    def check_and_add(self, consumer_key, nonce, timestamp):
+        """
+        Record nonce, unless it was already seen (by any worker)
+
+        :param consumer_key: oauth_consumer_key of request
+        :param nonce: oauth_nonce of request
+        :param timestamp: oauth_timestamp of request (seconds)
+        :return: True if nonce is new, False on replay
+        """
+        # pylint: disable=import-outside-toplevel
+        import fcntl
+        fingerprint = _fingerprint(consumer_key, nonce)
+        stripe = self._stripe(fingerprint)
+        bucket = int(int(timestamp) // self.bucket_seconds)
+
+        fcntl.lockf(self._lock_fd, fcntl.LOCK_EX, 1, stripe)
+        try:
+            found, free, victim = self._probe(fingerprint)
+            if found:
+                return False
+            if free is None:
+                log.warning('Nonce store %s stripe %d is full; evicting',
+                            self._shm.name, stripe)
+                free = victim
+            _SLOT.pack_into(self._buf, free, fingerprint, bucket)
+            return True
+        finally:
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, stripe)
+
+    def close(self):
+        """
+        Detach from the shared segment (it stays available to others)
+        """
+        self._buf = None
+        self._shm.close()
+        os.close(self._lock_fd)
+
+    def unlink(self):
+        """
+        Remove the shared segment (e.g. on deployment shutdown)
+        """
+        # unlink() also tells the resource tracker, which must know it
+        _track(self._shm, True)
+        self._shm.unlink()
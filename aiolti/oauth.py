@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+OAuth 1.0 request verification classes, built on the oauth2 package
+
+These are re-exported from :py:mod:`aiolti.common`, but live here so that
+oauth2 (and httplib2, which it imports) is only loaded on first use.
+"""
+from __future__ import absolute_import
+
+import logging
+from urllib.parse import urlparse, urlencode
+
+import oauth2
+from oauth2 import STRING_TYPES
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class LTIOAuthServer(oauth2.Server):
+    """
+    Largely taken from reference implementation
+    for app engine at https://code.google.com/p/ims-dev/
+    """
+
+    def __init__(self, consumers, signature_methods=None):
+        """
+        Create OAuth server
+        """
+        super(LTIOAuthServer, self).__init__(signature_methods)
+        self.consumers = consumers
+
+    def lookup_consumer(self, key):
+        """
+        Search through keys
+        """
+        if not self.consumers:
+            log.critical(("No consumers defined in settings."
+                          "Have you created a configuration file?"))
+            return None
+
+        consumer = self.consumers.get(key)
+        if not consumer:
+            log.info("Did not find consumer, using key: %s ", key)
+            return None
+
+        secret = consumer.get('secret', None)
+        if not secret:
+            log.critical(('Consumer %s, is missing secret'
+                          'in settings file, and needs correction.'), key)
+            return None
+        return oauth2.Consumer(key, secret)
+
+    def lookup_cert(self, key):
+        """
+        Search through keys
+        """
+        if not self.consumers:
+            log.critical(("No consumers defined in settings."
+                          "Have you created a configuration file?"))
+            return None
+
+        consumer = self.consumers.get(key)
+        if not consumer:
+            log.info("Did not find consumer, using key: %s ", key)
+            return None
+        cert = consumer.get('cert', None)
+        return cert
+
+
+class SignatureMethod_HMAC_SHA1_Unicode(oauth2.SignatureMethod_HMAC_SHA1):
+    """
+    Temporary workaround for
+    https://github.com/joestump/python-oauth2/issues/207
+
+    Original code is Copyright (c) 2007 Leah Culver, MIT license.
+    """
+
+    def check(self, request, consumer, token, signature):
+        """
+        Returns whether the given signature is the correct signature for
+        the given consumer and token signing the given request.
+        """
+        built = self.sign(request, consumer, token)
+        if isinstance(signature, STRING_TYPES):
+            signature = signature.encode("utf8")
+        return built == signature
+
+
+class SignatureMethod_PLAINTEXT_Unicode(oauth2.SignatureMethod_PLAINTEXT):
+    """
+    Temporary workaround for
+    https://github.com/joestump/python-oauth2/issues/207
+
+    Original code is Copyright (c) 2007 Leah Culver, MIT license.
+    """
+
+    def check(self, request, consumer, token, signature):
+        """
+        Returns whether the given signature is the correct signature for
+        the given consumer and token signing the given request.
+        """
+        built = self.sign(request, consumer, token)
+        if isinstance(signature, STRING_TYPES):
+            signature = signature.encode("utf8")
+        return built == signature
+
+
+class Request_Fix_Duplicate(oauth2.Request):
+    """
+    Temporary workaround for
+    https://github.com/joestump/python-oauth2/pull/197
+
+    Original code is Copyright (c) 2007 Leah Culver, MIT license.
+    """
+
+    def get_normalized_parameters(self):
+        """
+        Return a string that contains the parameters that must be signed.
+        """
+        items = []
+        for key, value in self.items():
+            if key == 'oauth_signature':
+                continue
+            # 1.0a/9.1.1 states that kvp must be sorted by key, then by value,
+            # so we unpack sequence values into multiple items for sorting.
+            if isinstance(value, STRING_TYPES):
+                items.append(
+                    (oauth2.to_utf8_if_string(key), oauth2.to_utf8(value))
+                )
+            else:
+                try:
+                    value = list(value)
+                except TypeError as e:
+                    assert 'is not iterable' in str(e)
+                    items.append(
+                        (oauth2.to_utf8_if_string(key),
+                         oauth2.to_utf8_if_string(value))
+                    )
+                else:
+                    items.extend(
+                        (oauth2.to_utf8_if_string(key),
+                         oauth2.to_utf8_if_string(item))
+                        for item in value
+                    )
+
+        # Include any query string parameters from the provided URL
+        query = urlparse(self.url)[4]
+        url_items = self._split_url_string(query).items()
+        url_items = [
+            (oauth2.to_utf8(k), oauth2.to_utf8_optional_iterator(v))
+            for k, v in url_items if k != 'oauth_signature'
+        ]
+
+        # Merge together URL and POST parameters.
+        # Eliminates parameters duplicated between URL and POST.
+        items_dict = {}
+        for k, v in items:
+            items_dict.setdefault(k, []).append(v)
+        for k, v in url_items:
+            if not (k in items_dict and v in items_dict[k]):
+                items.append((k, v))
+
+        items.sort()
+
+        encoded_str = urlencode(items, True)
+        # Encode signature parameters per Oauth Core 1.0 protocol
+        # spec draft 7, section 3.6
+        # (http://tools.ietf.org/html/draft-hammer-oauth-07#section-3.6)
+        # Spaces must be encoded with "%20" instead of "+"
+        return encoded_str.replace('+', '%20').replace('%7E', '~')
@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+"""
+Consumer side: receiving LTI 1.1 outcome (POX) callbacks
+"""
+from __future__ import absolute_import
+
+import base64
+from collections import namedtuple
+import hashlib
+import hmac
+from html import escape as html_escape
+import itertools
+import logging
+from xml.etree.ElementTree import ParseError, XMLPullParser
+
+from .asgi import header_name, scope_url
+from .common import (
+    OAUTH_ERROR,
+    STAGE_BODY_HASH,
+    STAGE_CONTENT_LENGTH,
+    STAGE_NONCE,
+    STAGE_SIGNATURE,
+    TIMESTAMP_THRESHOLD,
+    LTIException,
+    LTIOutcomeException,
+    LTIVerificationException,
+    check_content_length,
+    reject,
+    verify_oauth_params,
+)
+from .rotation import secret_order
+from .signer import SIGNATURE_METHOD, get_signer, make_nonce
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+REPLACE_RESULT = u'replaceResult'
+READ_RESULT = u'readResult'
+DELETE_RESULT = u'deleteResult'
+OPERATIONS = (REPLACE_RESULT, READ_RESULT, DELETE_RESULT)
+
+POX_CONTENT_TYPE = 'application/xml'
+DEFAULT_MAX_POX_SIZE = 16 * 1024
+
+# Outcome callback, as handed to the receiver's handler. ``score`` is
+# a float for replaceResult, None otherwise.
+OutcomeRequest = namedtuple('OutcomeRequest', [
+    'consumer_key', 'message_identifier', 'operation', 'sourcedid',
+    'score', 'language'])
+
+# Elements read from the request envelope, by local name
+_FIELDS = {
+    'imsx_messageIdentifier': 'message_identifier',
+    'sourcedId': 'sourcedid',
+    'textString': 'score',
+    'language': 'language',
+}
+
+# Markup that is never valid in POX (entity expansion, external entities)
+_FORBIDDEN = (b'<!DOCTYPE', b'<!ENTITY')
+
+_RESPONSE = (
+    u'<?xml version="1.0" encoding="UTF-8"?>\n'
+    u'<imsx_POXEnvelopeResponse xmlns="http://www.imsglobal.org/services/'
+    u'ltiv1p1/xsd/imsoms_v1p0"><imsx_POXHeader>'
+    u'<imsx_POXResponseHeaderInfo><imsx_version>V1.0</imsx_version>'
+    u'<imsx_messageIdentifier>{message_id}</imsx_messageIdentifier>'
+    u'<imsx_statusInfo><imsx_codeMajor>{code_major}</imsx_codeMajor>'
+    u'<imsx_severity>{severity}</imsx_severity>'
+    u'<imsx_description>{description}</imsx_description>'
+    u'<imsx_messageRefIdentifier>{ref_id}</imsx_messageRefIdentifier>'
+    u'<imsx_operationRefIdentifier>{operation}'
+    u'</imsx_operationRefIdentifier></imsx_statusInfo>'
+    u'</imsx_POXResponseHeaderInfo></imsx_POXHeader>'
+    u'<imsx_POXBody>{body}</imsx_POXBody></imsx_POXEnvelopeResponse>')
+
+_READ_RESULT_BODY = (
+    u'<readResultResponse><result><resultScore><language>{language}'
+    u'</language><textString>{score}</textString></resultScore></result>'
+    u'</readResultResponse>')
+
+# Response message identifiers: per-process prefix and counter
+_MESSAGE_PREFIX = make_nonce()[:12]
+_MESSAGE_IDS = itertools.count(1)
+
+
+def _text(value):
+    return html_escape(u'' if value is None else str(value), quote=False)
+
+
+def response_xml(code_major, description=u'', ref_id=None, operation=None,
+                 body=u''):
+    """
+    POX response envelope
+
+    :param code_major: ``success``, ``failure`` or ``unsupported``
+    :param description: human readable status description
+    :param ref_id: message identifier of the request answered
+    :param operation: operation answered, e.g. ``replaceResult``
+    :param body: content of imsx_POXBody (trusted XML)
+    :return: XML string
+    """
+    # pylint: disable=too-many-arguments
+    return _RESPONSE.format(
+        message_id=u'{}{:x}'.format(_MESSAGE_PREFIX, next(_MESSAGE_IDS)),
+        code_major=code_major,
+        severity=u'status' if code_major == u'success' else u'error',
+        description=_text(description),
+        ref_id=_text(ref_id),
+        operation=_text(operation),
+        body=body)
+
+
+def verify_outcome_headers(consumers, url, method, headers,
+                           nonce_store=None,
+                           timestamp_threshold=TIMESTAMP_THRESHOLD):
+    """
+    Verify the OAuth header of an outcome request, before its body is
+    read: the stages of :py:func:`aiolti.common.verify_oauth_params`
+    (with ``oauth_body_hash`` required), then the signature. The body
+    must then be checked against the returned ``oauth_body_hash``. The
+    nonce is only looked up here; record it (``nonce_store.check_and_add``)
+    once the body hash matches, so that requests which are not authentic
+    neither fill the store nor use up nonces seen in flight.
+
+    Signatures are checked with aiolti's own cached HMAC-SHA1 signer
+    (see :py:mod:`aiolti.signer`), against each of the consumer's valid
+    secrets (see :py:mod:`aiolti.rotation`).
+
+    :return: dict of OAuth protocol parameters
+    :raises: LTIVerificationException, with the rejecting ``stage``
+    """
+    # pylint: disable=too-many-arguments
+    params, consumer, _ = verify_oauth_params(
+        consumers, headers, nonce_store=nonce_store,
+        timestamp_threshold=timestamp_threshold,
+        extra_required=('oauth_body_hash',))
+    consumer_key = params['oauth_consumer_key']
+
+    if params['oauth_signature_method'] != SIGNATURE_METHOD:
+        raise reject(STAGE_SIGNATURE, OAUTH_ERROR)
+    if headers.get('X-Forwarded-Proto') == 'https':
+        url = url.replace('http:', 'https:', 1)
+    signed = [(key, value) for key, value in params.items()
+              if key != 'oauth_signature']
+    signature = params['oauth_signature'].encode('ascii', 'replace')
+    for secret in secret_order.candidates(consumer_key, consumer):
+        expected = get_signer(consumer_key, secret).signature(
+            method, url, signed)
+        if hmac.compare_digest(expected.encode('ascii'), signature):
+            secret_order.record_success(consumer_key, secret)
+            return params
+    raise reject(STAGE_SIGNATURE, OAUTH_ERROR)
+
+
+class PoxParser(object):
+    """
+    Incremental parser for outcome request envelopes: the body is fed
+    in chunks as it arrives, and elements are discarded as soon as they
+    have been read, so no document tree is kept. Envelopes nested deeper
+    than ``max_depth``, with more than ``max_elements`` elements, or with
+    values longer than ``max_text_size`` are rejected, as are DTDs.
+
+    Errors are held until :py:meth:`close`, so that a body is only
+    reported malformed once it is known to be authentic.
+    """
+
+    def __init__(self, max_depth=8, max_elements=64, max_text_size=1024):
+        self.max_depth = max_depth
+        self.max_elements = max_elements
+        self.max_text_size = max_text_size
+        self.fields = dict()
+        self.operation = None
+        self.error = None
+        self._parser = XMLPullParser(events=('start', 'end'))
+        self._stack = []
+        self._elements = 0
+        self._tail = b''
+
+    def feed(self, data):
+        """
+        Parse a chunk of the body
+        """
+        if self.error is not None:
+            return
+        window = self._tail + data
+        if any(markup in window for markup in _FORBIDDEN):
+            self.error = 'DTDs are not allowed'
+            return
+        self._tail = data[-8:]
+        try:
+            self._parser.feed(data)
+            self._read_events()
+        except ParseError:
+            self.error = 'Malformed XML'
+        except LTIOutcomeException as outcome_exception:
+            self.error = outcome_exception.args[0]
+
+    def _read_events(self):
+        for event, element in self._parser.read_events():
+            tag = element.tag.rpartition('}')[2]
+            if event == 'start':
+                if self._stack and self._stack[-1] == 'imsx_POXBody':
+                    if tag.endswith('Request') and self.operation is None:
+                        self.operation = tag[:-len('Request')]
+                self._stack.append(tag)
+                self._elements += 1
+                if len(self._stack) > self.max_depth:
+                    raise LTIOutcomeException('Envelope nested too deep')
+                if self._elements > self.max_elements:
+                    raise LTIOutcomeException('Envelope has too many elements')
+                continue
+            self._stack.pop()
+            field = _FIELDS.get(tag)
+            if field is not None and field not in self.fields:
+                text = (element.text or u'').strip()
+                if len(text) > self.max_text_size:
+                    raise LTIOutcomeException('Envelope value too large')
+                self.fields[field] = text
+            element.clear()
+
+    def close(self):
+        """
+        Finish parsing
+
+        :return: dict of fields read (message_identifier, sourcedid,
+            score, language)
+        :raises: LTIOutcomeException if the envelope is malformed
+        """
+        if self.error is None:
+            try:
+                self._parser.close()
+                self._read_events()
+            except ParseError:
+                self.error = 'Malformed XML'
+            except LTIOutcomeException as outcome_exception:
+                self.error = outcome_exception.args[0]
+        if self.error is None and self.operation is None:
+            self.error = 'No outcome operation in envelope'
+        if self.error is not None:
+            raise LTIOutcomeException(self.error)
+        return self.fields
+
+
+async def _chunks(body):
+    if isinstance(body, bytes):
+        yield body
+        return
+    async for chunk in body:
+        yield chunk
+
+
+class OutcomeReceiver(object):
+    """
+    Receives outcome callbacks (replaceResult, readResult, deleteResult)
+    from tools we launched, and hands them to an async ``handler``::
+
+        async def handler(request):
+            if request.operation == READ_RESULT:
+                return await scores.get(request.sourcedid)
+            ...
+
+        receiver = OutcomeReceiver(consumers, handler)
+
+    The handler gets an :py:data:`OutcomeRequest`; for readResult it
+    returns the score (or None if there is none). Raising LTIException
+    answers with a failure and the exception's message.
+
+    The OAuth header is verified before the body is read; the body is
+    then hashed and parsed as it streams in, up to ``max_body_size``
+    bytes (see :py:class:`PoxParser` for the other limits). Responses
+    are filled in from a template. The receiver is also an ASGI
+    application, for mounting at the outcome service URL given to tools.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, consumers, handler, nonce_store=None,
+                 timestamp_threshold=TIMESTAMP_THRESHOLD,
+                 max_body_size=DEFAULT_MAX_POX_SIZE, **parser_limits):
+        # pylint: disable=too-many-arguments
+        self.consumers = consumers
+        self.handler = handler
+        self.nonce_store = nonce_store
+        self.timestamp_threshold = timestamp_threshold
+        self.max_body_size = max_body_size
+        self.parser_limits = parser_limits
+
+    async def receive(self, url, method, headers, body):
+        """
+        Verify, parse and dispatch an outcome request
+
+        :param url: request URL
+        :param method: HTTP method
+        :param headers: request headers
+        :param body: request body, as bytes or an async iterable of
+            bytes chunks
+        :return: (HTTP status, response XML)
+        """
+        # pylint: disable=too-many-arguments
+        try:
+            check_content_length(headers, self.max_body_size)
+            params = verify_outcome_headers(
+                self.consumers, url, method, headers,
+                nonce_store=self.nonce_store,
+                timestamp_threshold=self.timestamp_threshold)
+            fields, operation = await self._read(params, body)
+        except LTIVerificationException as verification_exception:
+            status = (413 if verification_exception.stage ==
+                      STAGE_CONTENT_LENGTH else 401)
+            return status, response_xml(
+                u'failure', verification_exception.args[0])
+        except LTIOutcomeException as outcome_exception:
+            return 400, response_xml(u'failure', outcome_exception.args[0])
+
+        request = OutcomeRequest(
+            params['oauth_consumer_key'], fields.get('message_identifier'),
+            operation, fields.get('sourcedid'), None,
+            fields.get('language') or u'en')
+        return 200, await self._dispatch(request, fields.get('score'))
+
+    async def _read(self, params, body):
+        """
+        Stream body through the hash and the parser
+
+        :return: (fields, operation)
+        """
+        digest = hashlib.sha1()
+        parser = PoxParser(**self.parser_limits)
+        size = 0
+        async for chunk in _chunks(body):
+            size += len(chunk)
+            if size > self.max_body_size:
+                raise reject(STAGE_CONTENT_LENGTH, 'Request body too large')
+            digest.update(chunk)
+            parser.feed(chunk)
+        body_hash = base64.b64encode(digest.digest())
+        if not hmac.compare_digest(
+                body_hash, params['oauth_body_hash'].encode('ascii',
+                                                            'replace')):
+            raise reject(STAGE_BODY_HASH, 'Body hash does not match')
+        if self.nonce_store is not None and not self.nonce_store.check_and_add(
+                params['oauth_consumer_key'], params['oauth_nonce'],
+                int(params['oauth_timestamp'])):
+            raise reject(STAGE_NONCE, OAUTH_ERROR)
+        return parser.close(), parser.operation
+
+    async def _dispatch(self, request, score_text):
+        """
+        Run handler for an authentic, well-formed request
+
+        :return: response XML
+        """
+        operation = request.operation
+        ref_id = request.message_identifier
+        if operation not in OPERATIONS:
+            return response_xml(
+                u'unsupported', u'{} is not supported'.format(operation),
+                ref_id, operation)
+        if not request.sourcedid:
+            return response_xml(u'failure', u'No sourcedId', ref_id,
+                                operation)
+        if operation == REPLACE_RESULT:
+            try:
+                score = float(score_text)
+            except (TypeError, ValueError):
+                score = None
+            if score is None or not 0.0 <= score <= 1.0:
+                return response_xml(u'failure', u'Invalid score', ref_id,
+                                    operation)
+            request = request._replace(score=score)
+
+        try:
+            result = await self.handler(request)
+        except LTIException as lti_exception:
+            return response_xml(u'failure', lti_exception.args[0], ref_id,
+                                operation)
+        except Exception:  # pylint: disable=broad-except
+            log.exception('Outcome handler failed for %s', operation)
+            return response_xml(u'failure', u'Internal error', ref_id,
+                                operation)
+
+        if operation == READ_RESULT:
+            body = _READ_RESULT_BODY.format(
+                language=_text(request.language),
+                score=_text(result if result is not None else u''))
+            description = u'Result read'
+        elif operation == REPLACE_RESULT:
+            body = u'<replaceResultResponse/>'
+            description = u'Score for {} is now {}'.format(
+                request.sourcedid, request.score)
+        else:
+            body = u'<deleteResultResponse/>'
+            description = u'Score for {} deleted'.format(request.sourcedid)
+        return response_xml(u'success', description, ref_id, operation, body)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        headers = {header_name(name): value.decode('latin-1')
+                   for name, value in scope.get('headers', [])}
+        if scope['method'] != 'POST':
+            status, xml = 405, response_xml(u'failure', u'POST required')
+        else:
+            status, xml = await self.receive(
+                scope_url(scope, headers), 'POST', headers,
+                _receive_body(receive))
+        body = xml.encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/xml; charset=utf-8'),
+                (b'content-length', str(len(body)).encode('ascii')),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+async def _receive_body(receive):
+    """
+    Body chunks of an ASGI request
+    """
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise LTIOutcomeException('Client disconnected')
+        yield message.get('body', b'')
+        more_body = message.get('more_body', False)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Per-request profiling of LTI requests, keeping profiles of slow ones
+"""
+from __future__ import absolute_import
+
+import cProfile
+from datetime import datetime
+import itertools
+import logging
+import os
+import random
+import re
+import time
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def _safe(value):
+    """
+    value, made safe for use in a file name
+    """
+    return _UNSAFE.sub('_', str(value)).strip('.') or '_'
+
+
+class RequestProfiler(object):
+    """
+    Profiles a fraction (``sample_rate``) of requests with cProfile, and
+    writes a pstats dump for each one that takes at least ``threshold``
+    seconds (or for all of them, without a threshold). Dumps are named
+    after the time, duration, route, consumer key and request type::
+
+        20240131T120000-812ms-grade-__consumer_key__-initial-1234-1.pstats
+
+    and can be read with :py:class:`pstats.Stats` or snakeviz.
+
+    A profiler sees everything running in the thread, so concurrent
+    requests on the same event loop are included in the profile; only
+    one request is profiled at a time.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, directory, sample_rate=1.0, threshold=None,
+                 rand=random.random, clock=time.perf_counter):
+        # pylint: disable=too-many-arguments
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.dumps = 0
+        self._random = rand
+        self._clock = clock
+        self._active = False
+        self._sequence = itertools.count(1)
+
+    def begin(self):
+        """
+        Start profiling a request, if it is sampled and no other request
+        is being profiled
+
+        :return: profile state to pass to :py:meth:`end`, or None
+        """
+        if self._active or self._random() >= self.sample_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active
+            return None
+        self._active = True
+        return profile, self._clock()
+
+    def end(self, state, route, consumer_key=None, request_type=None):
+        """
+        Stop profiling a request, and write its profile if it was slow
+
+        :param state: value returned by :py:meth:`begin`
+        :param route: route (URL rule) of the request
+        :param consumer_key: oauth_consumer_key, if known
+        :param request_type: LTI request type of the route
+        :return: dump file name, or None if none was written
+        """
+        profile, started = state
+        profile.disable()
+        elapsed = self._clock() - started
+        self._active = False
+        if self.threshold is not None and elapsed < self.threshold:
+            return None
+        name = '{:%Y%m%dT%H%M%S}-{}ms-{}-{}-{}-{}-{}.pstats'.format(
+            datetime.now(), int(elapsed * 1000),
+            _safe(route).strip('_') or 'root',
+            _safe(consumer_key or 'unknown'), _safe(request_type or 'any'),
+            os.getpid(), next(self._sequence))
+        path = os.path.join(self.directory, name)
+        os.makedirs(self.directory, exist_ok=True)
+        profile.dump_stats(path)
+        self.dumps += 1
+        log.info("Request to %s took %.3fs, profile written to %s",
+                 route, elapsed, path)
+        return path
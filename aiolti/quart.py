@@ -4,20 +4,43 @@
 """
 from __future__ import absolute_import
 from functools import wraps
+from http import HTTPStatus
 import logging
+import math
 
-from quart import session, current_app, Quart
+from quart import session, current_app, g, Quart
 from quart.exceptions import BadRequest
 from quart import request as quart_request
+from werkzeug.datastructures import MultiDict
 
 from .common import (
     LTI_SESSION_KEY,
     LTI_PROPERTY_LIST,
     verify_request_common,
+    check_content_length,
+    TIMESTAMP_THRESHOLD,
     LTIException,
     LTINotInSessionException,
+    LTIRateLimitException,
+    LTITokenException,
+    LTIVerificationException,
+    STAGE_CONTENT_LENGTH,
     LTIBase
 )
+from .forms import (
+    DEFAULT_MAX_BODY_SIZE,
+    FORM_CONTENT_TYPE,
+    first_value,
+    read_form,
+)
+from .ratelimit import check_launch_rate
+from .tokens import (
+    DEFAULT_MAX_AGE,
+    TOKEN_CLAIMS,
+    bearer_token,
+    get_token_signer,
+)
+from .tracing import tracer
 
 
 log = logging.getLogger(__name__)  # pylint: disable=invalid-name
@@ -33,6 +56,32 @@ class LTIRequestError(BadRequest):
             self.description = "Unknown LTI Error"
 
 
+class LTIRateLimitError(LTIRequestError):
+    """
+    Raised (as 429) when a consumer exceeds its launch rate limit
+    """
+    status = HTTPStatus.TOO_MANY_REQUESTS
+
+    def get_headers(self):
+        headers = super().get_headers()
+        retry_after = getattr(self.lti_exception, 'retry_after', None)
+        if retry_after:
+            headers['Retry-After'] = str(int(math.ceil(retry_after)))
+        return headers
+
+
+class LTIUnauthorizedError(LTIRequestError):
+    """
+    Raised (as 401) when a bearer token is missing or invalid
+    """
+    status = HTTPStatus.UNAUTHORIZED
+
+    def get_headers(self):
+        headers = super().get_headers()
+        headers['WWW-Authenticate'] = 'Bearer'
+        return headers
+
+
 class LTI(LTIBase):
     """
     LTI Object represents abstraction of current LTI session. It provides
@@ -47,9 +96,11 @@ class LTI(LTIBase):
     #   aren't always the same throughout webapp...
     #   But, this will do for now (too much cruft in original code).
 
-    def __init__(self, lti_args, lti_kwargs):
-        self.session = session
+    def __init__(self, lti_args, lti_kwargs, lti_session=None):
+        # lti_session stands in for the Quart session (e.g. token claims)
+        self.session = session if lti_session is None else lti_session
         LTIBase.__init__(self, lti_args, lti_kwargs)
+        self._params = None
         # Set app to current_app if not specified
         if not self.lti_kwargs['app']:
             self.lti_kwargs['app'] = current_app
@@ -65,41 +116,184 @@ class LTI(LTIBase):
         consumers = config.get('consumers', dict())
         return consumers
 
+    def _context_registry(self):
+        """
+        Gets shared context data registry (``context_registry``)
+        from app config
+
+        :return: ContextRegistry or None
+        """
+        app_config = self.lti_kwargs['app'].config
+        config = app_config.get('AIOLTI_CONFIG', dict())
+        return config.get('context_registry')
+
+    def _verify_options(self):
+        """
+        Gets request verification options from app config
+        (``nonce_store``, ``max_content_length``, ``timestamp_threshold``)
+        and form limits (``max_content_length``, ``max_field_size``)
+
+        :return: keyword arguments for verify_request_common
+        """
+        app_config = self.lti_kwargs['app'].config
+        config = app_config.get('AIOLTI_CONFIG', dict())
+        return dict(
+            nonce_store=config.get('nonce_store'),
+            max_content_length=config.get('max_content_length',
+                                          DEFAULT_MAX_BODY_SIZE),
+            timestamp_threshold=config.get('timestamp_threshold',
+                                           TIMESTAMP_THRESHOLD),
+        )
+
+    def mint_token(self, max_age=None):
+        """
+        Mint a short-lived signed bearer token carrying the verified
+        launch claims (see :py:data:`aiolti.tokens.TOKEN_CLAIMS`), for
+        use with :py:func:`lti_bearer` routes
+
+        :param max_age: lifetime in seconds (default: AIOLTI_CONFIG's
+            ``token_max_age``, or 15 minutes)
+        :return: token string
+        """
+        claims = dict()
+        for claim in TOKEN_CLAIMS:
+            try:
+                claims[claim] = self.launch_param(claim)
+            except KeyError:
+                pass
+        return _token_signer(self.lti_kwargs['app']).mint(claims, max_age)
+
+    async def _launch_params(self):
+        """
+        Launch parameters of the current request: the form for POST
+        requests, the query string otherwise. The form is decoded while
+        the body is read, within the configured size limits, and fields
+        sent more than once are kept as lists. Decoded once per request.
+
+        :return: dict of parameters
+        :raises: LTIException if a size limit is exceeded
+        """
+        if self._params is not None:
+            return self._params
+        if quart_request.method != 'POST':
+            self._params = {
+                key: values[0] if len(values) == 1 else values
+                for key, values in quart_request.args.lists()}
+            return self._params
+
+        # Other bodies (e.g. uploads to session-authenticated views) are
+        # no launches, and are left alone
+        if quart_request.mimetype != FORM_CONTENT_TYPE:
+            self._params = dict()
+            return self._params
+        options = self._verify_options()
+        max_content_length = options['max_content_length']
+        app_config = self.lti_kwargs['app'].config
+        config = app_config.get('AIOLTI_CONFIG', dict())
+        raw = bytearray()
+
+        async def chunks():
+            async for chunk in quart_request.body:
+                raw.extend(chunk)
+                yield chunk
+
+        try:
+            # Oversized launches are turned away before the body is read
+            check_content_length(quart_request.headers, max_content_length)
+            with tracer.span('launch.form'):
+                params = await read_form(
+                    chunks(), max_content_length,
+                    config.get('max_field_size'),
+                    quart_request.mimetype_params.get('charset', 'utf-8'))
+        except LTIVerificationException as too_large:
+            # Routes that also take session requests get ordinary form
+            # posts, which the launch limits don't apply to
+            if self.lti_kwargs.get('request') == 'initial' or \
+                    too_large.stage != STAGE_CONTENT_LENGTH:
+                raise
+            self._params = await self._oversized_form(raw, too_large)
+            return self._params
+        # The body stream is now consumed: put the (bounded) raw body
+        # back for get_data(), and leave the decoded form where views
+        # expect it
+        quart_request.body.append(bytes(raw))
+        # pylint: disable=protected-access
+        quart_request._form = MultiDict(params)
+        quart_request._files = MultiDict()
+        self._params = params
+        return params
+
+    async def _oversized_form(self, raw, too_large):
+        """
+        Read a form over the launch limits with Quart's own form parsing.
+        It is only refused if it turns out to be a launch.
+
+        :param raw: the part of the body read so far
+        :param too_large: the exception raised for the limit
+        :return: empty dict, the request being no launch
+        :raises: LTIException if the form is a launch
+        """
+        async for chunk in quart_request.body:
+            raw.extend(chunk)
+        quart_request.body.append(bytes(raw))
+        form = await quart_request.form
+        if form.get('lti_message_type') == 'basic-lti-launch-request':
+            raise too_large
+        return dict()
+
+    async def _check_rate_limit(self):
+        """
+        Enforce per-consumer launch rate limit, before any signature work.
+        Only requests that carry launch parameters are counted.
+
+        :raises: LTIRateLimitException if consumer is over its limit
+        """
+        if self.lti_kwargs.get('request') not in ('initial', 'any'):
+            return
+        if (quart_request.method != 'POST' and
+                self.lti_kwargs.get('request') != 'initial'):
+            return
+        params = await self._launch_params()
+        lti_key = first_value(params.get('oauth_consumer_key'))
+        if not lti_key:
+            return
+        retry_after = check_launch_rate(self._consumers(), lti_key)
+        if retry_after:
+            raise LTIRateLimitException('Too many launch requests',
+                                        retry_after=retry_after)
+
     async def _verify_request(self):
         """
         Verify LTI request
         :raises: LTIException is request validation failed
         """
-        if quart_request.method == 'POST':
-            form = await quart_request.form
-            params = form.to_dict()
-        else:
-            params = quart_request.args.to_dict()
-        log.debug(params)
-        log.debug('_verify_request?')
+        options = self._verify_options()
         try:
-            verify_request_common(self._consumers(), quart_request.url,
-                                  quart_request.method, quart_request.headers,
-                                  params)
+            params = await self._launch_params()
+            log.debug(params)
+            log.debug('_verify_request?')
+            with tracer.span('launch.verify'):
+                verify_request_common(
+                    self._consumers(), quart_request.url,
+                    quart_request.method, quart_request.headers,
+                    params, **options)
             log.debug('_verify_request success')
 
-            # All good to go, store all of the LTI params into a
-            # session dict for use in views
-            for prop in self.lti_kwargs.get('property_list', LTI_PROPERTY_LIST):
-                if params.get(prop, None):
-                    log.debug("params %s=%s", prop, params.get(prop, None))
-                    session[prop] = params[prop]
-
-            # Set logged in session key
-            session[LTI_SESSION_KEY] = True
+            with tracer.span('launch.session'):
+                # All good to go, store all of the LTI params into a
+                # session dict for use in views (replacing those of any
+                # earlier launch)
+                self._update_session(
+                    params,
+                    self.lti_kwargs.get('property_list', LTI_PROPERTY_LIST))
+
+                # Set logged in session key
+                self._set_logged_in(True)
+            g.lti_launch_verified = True
             return True
         except LTIException:
             log.debug('_verify_request failed')
-            for prop in self.lti_kwargs.get('property_list', LTI_PROPERTY_LIST):
-                if session.get(prop, None):
-                    del session[prop]
-
-            session[LTI_SESSION_KEY] = False
+            self.close_session()
             raise
 
     @property
@@ -110,8 +304,7 @@ class LTI(LTIBase):
 
         :return: remapped lis_outcome_service_url
         """
-        url = ""
-        url = self.session['lis_outcome_service_url']
+        url = self.launch_param('lis_outcome_service_url')
         app_config = self.lti_kwargs['app'].config
         urls = app_config.get('AIOLTI_URL_FIX', dict())
         # url remapping is useful for using devstack
@@ -133,16 +326,12 @@ class LTI(LTIBase):
         # Check to see if there is a new LTI launch request incoming
         newrequest = False
         if quart_request.method == 'POST':
-            form = await quart_request.form
-            params = form.to_dict()
+            params = await self._launch_params()
             initiation = "basic-lti-launch-request"
-            if params.get("lti_message_type", None) == initiation:
+            if first_value(params.get("lti_message_type", None)) == initiation:
+                # The old authentication is replaced by _verify_request
+                # (or scrubbed, if verification fails)
                 newrequest = True
-                # Scrub the session of the old authentication
-                for prop in self.lti_kwargs.get('property_list', LTI_PROPERTY_LIST):
-                    if session.get(prop, None):
-                        del session[prop]
-                session[LTI_SESSION_KEY] = False
 
         # Attempt the appropriate validation
         # Both of these methods raise LTIException as necessary
@@ -165,10 +354,216 @@ class LTI(LTIBase):
         """
         Invalidates session
         """
-        for prop in self.lti_kwargs.get('property_list', LTI_PROPERTY_LIST):
-            if session.get(prop, None):
-                del session[prop]
-        session[LTI_SESSION_KEY] = False
+        self._update_session(
+            dict(), self.lti_kwargs.get('property_list', LTI_PROPERTY_LIST))
+        self._set_logged_in(False)
+
+
+def _token_signer(app):
+    """
+    Bearer token signer for app; the secret is AIOLTI_CONFIG's
+    ``token_secret``, or the app's secret key
+
+    :return: TokenSigner
+    """
+    config = app.config.get('AIOLTI_CONFIG', dict())
+    secret = config.get('token_secret') or app.secret_key
+    if not secret:
+        raise LTIException('No secret for signing tokens')
+    return get_token_signer(
+        secret, config.get('token_max_age', DEFAULT_MAX_AGE))
+
+
+def _profiler(app):
+    """
+    Request profiler (AIOLTI_CONFIG's ``profiler``), if one is configured
+
+    :return: RequestProfiler or None
+    """
+    config = (app or current_app).config.get('AIOLTI_CONFIG', dict())
+    return config.get('profiler')
+
+
+def _route():
+    """
+    URL rule of the current request (or its path, if it has none)
+    """
+    rule = quart_request.url_rule
+    return rule.rule if rule is not None else quart_request.path
+
+
+def _request_error(lti_exception):
+    """
+    HTTP error to raise for an LTI exception
+    """
+    if isinstance(lti_exception, LTIRateLimitException):
+        return LTIRateLimitError(lti_exception=lti_exception)
+    if isinstance(lti_exception, LTITokenException):
+        return LTIUnauthorizedError(lti_exception=lti_exception)
+    return LTIRequestError(lti_exception=lti_exception)
+
+
+def _satisfies(the_lti, request):
+    """
+    Whether an LTI object verified earlier in this request also
+    satisfies the given request type
+    """
+    if request in ('any', 'session'):
+        return True
+    # An 'initial' requirement is met by any earlier verification of
+    # this request's launch (e.g. by an 'any' guard); verifying again
+    # would re-read the consumed body and replay the nonce
+    return (g.get('lti_launch_verified', False) or
+            the_lti.lti_kwargs.get('request') == request)
+
+
+async def _verified_lti(lti_args, lti_kwargs):
+    """
+    Returns LTI object verified for the current request. Verification
+    runs at most once per request: the result is kept on ``g.lti`` and
+    reused by later guards and decorators.
+
+    :raises: LTIException
+    """
+    the_lti = g.get('lti')
+    if the_lti is not None and _satisfies(the_lti, lti_kwargs['request']):
+        return the_lti
+    the_lti = LTI(lti_args, lti_kwargs)
+    await the_lti._check_rate_limit()  # pylint: disable=protected-access
+    await the_lti.verify()
+    g.lti = the_lti
+    return the_lti
+
+
+def lti_guard(target, request='any', role='any', *lti_args, **lti_kwargs):
+    """
+    Verify LTI once per request for a whole blueprint (or app), in
+    ``before_request``. The verified LTI object is stored on ``g.lti``;
+    routes can then use :py:func:`lti_role` to declare role requirements
+    (or ``@lti``, which will reuse the verified object).
+
+    :param: target - Quart Blueprint or App object
+    :param: request - Request type from
+        :py:attr:`aiolti.common.LTI_REQUEST_TYPE`. (default: any)
+    :param: role - LTI Role required for every route (default: any)
+    :return: the registered before_request function
+    """
+    # pylint: disable=keyword-arg-before-vararg
+    lti_kwargs['request'] = request
+    lti_kwargs['role'] = role
+    lti_kwargs['app'] = target if isinstance(target, Quart) else None
+
+    async def lti_before_request():
+        """
+        Verify LTI request and check blueprint-wide role
+        """
+        try:
+            the_lti = await _verified_lti(lti_args, lti_kwargs)
+            the_lti._check_role(role)  # pylint: disable=protected-access
+        except LTIException as lti_exception:
+            raise _request_error(lti_exception)
+
+    target.before_request(lti_before_request)
+    return lti_before_request
+
+
+def lti_role(role='any'):
+    """
+    Declare the LTI role a route requires, for routes protected by
+    :py:func:`lti_guard`. The verified LTI object is passed to the
+    route as ``lti``, as with ``@lti``.
+
+    :param: role - LTI Role (default: any)
+    :return: decorator
+    """
+    def _lti_role(function):
+        @wraps(function)
+        async def wrapper(*args, **kwargs):
+            the_lti = g.get('lti')
+            try:
+                if the_lti is None:
+                    raise LTIException('LTI request not verified')
+                the_lti._check_role(role)  # pylint: disable=protected-access
+            except LTIException as lti_exception:
+                raise _request_error(lti_exception)
+            kwargs['lti'] = the_lti
+            return await function(*args, **kwargs)
+        return wrapper
+    return _lti_role
+
+
+def lti_websocket(app=None, role='any', *lti_args, **lti_kwargs):
+    """
+    LTI decorator for websocket routes. The connection is authenticated
+    once, at connect time, from the LTI session (as ``request='session'``)
+    with the same role check as ``@lti``; the LTI object is then passed
+    to the route as ``lti`` and stays valid for the connection's lifetime.
+
+    :param: app - Quart App object (optional).
+        :py:attr:`quart.current_app` is used if no object is passed in
+    :param: role - LTI Role (default: any)
+    :return: decorator
+    """
+    # pylint: disable=keyword-arg-before-vararg
+    lti_kwargs['request'] = 'session'
+    lti_kwargs['role'] = role
+    lti_kwargs['app'] = app if isinstance(app, Quart) else None
+
+    def _lti_websocket(function):
+        @wraps(function)
+        async def wrapper(*args, **kwargs):
+            try:
+                the_lti = await _verified_lti(lti_args, lti_kwargs)
+                the_lti._check_role(role)  # pylint: disable=protected-access
+            except LTIException as lti_exception:
+                raise _request_error(lti_exception)
+            kwargs['lti'] = the_lti
+            return await function(*args, **kwargs)
+        return wrapper
+
+    if app is not None and not isinstance(app, Quart):
+        # Used without arguments, as plain @lti_websocket
+        return _lti_websocket(app)
+    return _lti_websocket
+
+
+def lti_bearer(app=None, role='any', *lti_args, **lti_kwargs):
+    """
+    LTI decorator for API routes called with a token minted by
+    :py:meth:`LTI.mint_token`. The request is authenticated from its
+    ``Authorization: Bearer`` header alone (no session is used), with the
+    same role check as ``@lti``; the LTI object, backed by the token's
+    claims, is passed to the route as ``lti``.
+
+    :param: app - Quart App object (optional).
+        :py:attr:`quart.current_app` is used if no object is passed in
+    :param: role - LTI Role (default: any)
+    :return: decorator
+    """
+    # pylint: disable=keyword-arg-before-vararg
+    lti_kwargs['request'] = 'bearer'
+    lti_kwargs['role'] = role
+    lti_kwargs['app'] = app if isinstance(app, Quart) else None
+
+    def _lti_bearer(function):
+        @wraps(function)
+        async def wrapper(*args, **kwargs):
+            try:
+                token = bearer_token(quart_request.headers)
+                claims = _token_signer(
+                    lti_kwargs['app'] or current_app).verify(token)
+                the_lti = LTI(lti_args, dict(lti_kwargs), lti_session=claims)
+                the_lti._check_role(role)  # pylint: disable=protected-access
+            except LTIException as lti_exception:
+                raise _request_error(lti_exception)
+            kwargs['lti'] = the_lti
+            return await function(*args, **kwargs)
+        return wrapper
+
+    if app is not None and not isinstance(app, Quart):
+        # Used without arguments, as plain @lti_bearer
+        return _lti_bearer(app)
+    return _lti_bearer
 
 
 # XXX WTH re: varargs after optional args?? - spapadim
@@ -200,14 +595,28 @@ def lti(app=None, request='any', role='any',
             """
             Pass LTI reference to function or return error.
             """
+            profiler = _profiler(lti_kwargs['app'])
+            profile = profiler.begin() if profiler is not None else None
+            the_lti = None
             try:
-                the_lti = LTI(lti_args, lti_kwargs)
-                await the_lti.verify()
-                the_lti._check_role()  # pylint: disable=protected-access
-                kwargs['lti'] = the_lti
-                return await function(*args, **kwargs)
-            except LTIException as lti_exception:
-                raise LTIRequestError(lti_exception=lti_exception)
+                with tracer.span('lti', view=function.__name__):
+                    try:
+                        the_lti = await _verified_lti(lti_args, lti_kwargs)
+                        with tracer.span('launch.role'):
+                            # pylint: disable=protected-access
+                            the_lti._check_role(lti_kwargs['role'])
+                        kwargs['lti'] = the_lti
+                        with tracer.span('launch.view'):
+                            return await function(*args, **kwargs)
+                    except LTIException as lti_exception:
+                        raise _request_error(lti_exception)
+            finally:
+                if profile is not None:
+                    profiler.end(
+                        profile, _route(),
+                        the_lti.session.get('oauth_consumer_key')
+                        if the_lti is not None else None,
+                        lti_kwargs['request'])
 
         return wrapper
 
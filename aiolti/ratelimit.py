@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Per-consumer token-bucket rate limiting for LTI launches and passback
+"""
+from __future__ import absolute_import
+
+import asyncio
+import logging
+import time
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+LAUNCH_RATE_LIMIT_KEY = 'launch_rate_limit'
+PASSBACK_RATE_LIMIT_KEY = 'passback_rate_limit'
+
+
+class TokenBucket(object):
+    """
+    Classic token bucket: holds up to ``burst`` tokens and refills
+    at ``rate`` tokens per second.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        """
+        :param rate: refill rate, in tokens per second
+        :param burst: bucket capacity (defaults to ``rate``)
+        :param clock: monotonic time source, in seconds
+        """
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else rate)
+        if self.rate <= 0 or self.capacity < 1:
+            raise ValueError("Rate must be positive and burst at least 1")
+        self.tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        elapsed = now - self._updated
+        self._updated = now
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+
+    def consume(self, tokens=1):
+        """
+        Take tokens if available, without waiting
+
+        :param tokens: number of tokens to take
+        :return: True if the tokens were taken
+        """
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def retry_after(self, tokens=1):
+        """
+        Seconds until ``tokens`` would be available
+
+        :param tokens: number of tokens wanted
+        :return: seconds to wait (0 if available now)
+        """
+        self._refill()
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+    def reserve(self, tokens=1):
+        """
+        Take tokens unconditionally, going into debt if necessary.
+        Reservations are served in call order.
+
+        :param tokens: number of tokens to take
+        :return: seconds the caller must wait before proceeding
+        """
+        self._refill()
+        self.tokens -= tokens
+        return max(0.0, -self.tokens / self.rate)
+
+    async def acquire(self, tokens=1):
+        """
+        Wait until ``tokens`` have been granted
+
+        :param tokens: number of tokens to take
+        :return: seconds spent waiting
+        """
+        delay = self.reserve(tokens)
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                # Give the reservation back, so that abandoned waits do
+                # not use up the budget of later callers
+                self._refill()
+                self.tokens = min(self.capacity, self.tokens + tokens)
+                raise
+        return delay
+
+
+class RateLimiter(object):
+    """
+    Registry of token buckets, one per key, built lazily from
+    per-consumer settings in the consumers map.
+
+    Settings live under ``config_key`` in each consumer entry, e.g.::
+
+        "consumers": {
+            "key": {
+                "secret": "...",
+                "launch_rate_limit": {"rate": 5, "burst": 20},
+                "passback_rate_limit": {"rate": 10},
+            }
+        }
+    """
+
+    def __init__(self, config_key, clock=time.monotonic):
+        self.config_key = config_key
+        self._clock = clock
+        self._buckets = dict()
+
+    @staticmethod
+    def _settings(consumers, lti_key, config_key):
+        if not consumers:
+            return None
+        consumer = consumers.get(lti_key) or dict()
+        settings = consumer.get(config_key)
+        if not settings:
+            return None
+        return float(settings['rate']), settings.get('burst')
+
+    def bucket(self, consumers, lti_key, *scope):
+        """
+        Returns bucket for consumer (and optional scope, e.g. host),
+        or None if that consumer has no limit configured
+
+        :param consumers: consumers map
+        :param lti_key: consumer key
+        :param scope: additional key components
+        :return: TokenBucket or None
+        """
+        settings = self._settings(consumers, lti_key, self.config_key)
+        key = (lti_key,) + scope
+        if settings is None:
+            self._buckets.pop(key, None)
+            return None
+        entry = self._buckets.get(key)
+        if entry is None or entry[0] != settings:
+            rate, burst = settings
+            entry = (settings, TokenBucket(rate, burst, clock=self._clock))
+            self._buckets[key] = entry
+        return entry[1]
+
+    def reset(self):
+        """
+        Forget all buckets (e.g., after a configuration reload)
+        """
+        self._buckets.clear()
+
+
+launch_limiter = RateLimiter(  # pylint: disable=invalid-name
+    LAUNCH_RATE_LIMIT_KEY)
+passback_limiter = RateLimiter(  # pylint: disable=invalid-name
+    PASSBACK_RATE_LIMIT_KEY)
+
+
+def check_launch_rate(consumers, lti_key):
+    """
+    Take one launch token for consumer
+
+    :param consumers: consumers map
+    :param lti_key: consumer key
+    :return: 0 if launch may proceed, otherwise seconds until it could
+    """
+    bucket = launch_limiter.bucket(consumers, lti_key)
+    if bucket is None or bucket.consume():
+        return 0
+    retry_after = bucket.retry_after()
+    log.info("Launch rate limit exceeded for key %s", lti_key)
+    return retry_after
+
+
+async def throttle_passback(consumers, lti_key, host):
+    """
+    Wait for a passback token for consumer and outcome host
+
+    :param consumers: consumers map
+    :param lti_key: consumer key
+    :param host: outcome service host
+    :return: seconds spent waiting
+    """
+    bucket = passback_limiter.bucket(consumers, lti_key, host)
+    if bucket is None:
+        return 0
+    delay = await bucket.acquire()
+    if delay > 0:
+        log.debug("Passback to %s for key %s delayed %.3fs",
+                  host, lti_key, delay)
+    return delay
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Consumer secret rotation: current and previous secrets, tried in
+order of recent success
+"""
+from __future__ import absolute_import
+
+from datetime import datetime, timezone
+import logging
+import time
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+PREVIOUS_SECRETS_KEY = 'previous_secrets'
+
+
+def _expiry(value):
+    """
+    Expiry as seconds since epoch, from a number, datetime or
+    ISO 8601 string (None for no expiry). Datetimes without a time
+    zone are taken as UTC.
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        if value.endswith(('Z', 'z')):
+            # fromisoformat only accepts 'Z' from Python 3.11
+            value = value[:-1] + '+00:00'
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def consumer_secrets(consumer, now=None):
+    """
+    Secrets a consumer may sign with: its current ``secret``, then any
+    unexpired ``previous_secrets``, given as a list of secrets or of
+    ``{'secret': ..., 'expires': ...}`` dicts
+
+    :param consumer: consumer config dict
+    :param now: seconds since epoch (default: now)
+    :return: list of secrets
+    """
+    secrets = [consumer['secret']] if consumer.get('secret') else []
+    previous = consumer.get(PREVIOUS_SECRETS_KEY) or []
+    if previous:
+        now = time.time() if now is None else now
+    for entry in previous:
+        if not isinstance(entry, dict):
+            entry = {'secret': entry}
+        expires = _expiry(entry.get('expires'))
+        if entry.get('secret') and (expires is None or expires > now):
+            secrets.append(entry['secret'])
+    return secrets
+
+
+class SecretOrder(object):
+    """
+    Remembers, per consumer, which secrets verified most recently, so
+    that once a consumer has switched secrets the one it uses is tried
+    first (and verification stays a single HMAC).
+    """
+
+    def __init__(self):
+        self._recent = dict()
+
+    def candidates(self, lti_key, consumer, now=None):
+        """
+        Valid secrets for consumer, most recently successful first
+
+        :param lti_key: consumer key
+        :param consumer: consumer config dict
+        :return: list of secrets
+        """
+        secrets = consumer_secrets(consumer, now)
+        recent = self._recent.get(lti_key)
+        if not recent or len(secrets) < 2:
+            return secrets
+        rank = {secret: index for index, secret in enumerate(recent)}
+        return sorted(secrets, key=lambda secret: rank.get(secret, len(rank)))
+
+    def record_success(self, lti_key, secret):
+        """
+        Note that secret verified a request from consumer
+
+        :param lti_key: consumer key
+        :param secret: secret that verified
+        """
+        recent = self._recent.setdefault(lti_key, [])
+        if recent and recent[0] == secret:
+            return
+        if secret in recent:
+            recent.remove(secret)
+        else:
+            log.info('Consumer %s verified with a different secret', lti_key)
+        recent.insert(0, secret)
+
+    def reset(self):
+        """
+        Forget all recorded successes
+        """
+        self._recent.clear()
+
+
+secret_order = SecretOrder()  # pylint: disable=invalid-name
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Priority lanes for outcome passback
+"""
+from __future__ import absolute_import
+
+import asyncio
+from collections import deque
+import logging
+import os
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+INTERACTIVE = u'interactive'
+BULK = u'bulk'
+
+DEFAULT_WEIGHTS = {INTERACTIVE: 4, BULK: 1}
+
+# Same as the default thread executor, which the network transport uses
+DEFAULT_CONCURRENCY = min(32, (os.cpu_count() or 1) + 4)
+
+
+class LaneQueue(object):
+    """
+    Waiting calls (futures) in priority lanes, taken by smooth weighted
+    round-robin over the lanes that have calls waiting. Lanes without a
+    weight count as weight 1.
+    """
+
+    def __init__(self):
+        self._queues = dict()
+        self._credit = dict()
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def count(self, lane):
+        """
+        Number of calls waiting in lane
+        """
+        return len(self._queues.get(lane, ()))
+
+    def append(self, lane, waiter):
+        """
+        Add waiter at the end of its lane
+        """
+        self._queues.setdefault(lane, deque()).append(waiter)
+        self._credit.setdefault(lane, 0)
+
+    def remove(self, lane, waiter):
+        """
+        Take waiter out of its lane, if still there
+        """
+        queue = self._queues.get(lane, ())
+        if waiter in queue:
+            queue.remove(waiter)
+
+    def popleft(self, weights):
+        """
+        Take the next waiter
+
+        :param weights: dict mapping lane to weight
+        :return: waiter, or None if none is waiting
+        """
+        waiting = [lane for lane, queue in self._queues.items() if queue]
+        if not waiting:
+            return None
+        total = 0
+        for lane in waiting:
+            weight = weights.get(lane, 1)
+            self._credit[lane] += weight
+            total += weight
+        lane = max(waiting, key=lambda name: self._credit[name])
+        self._credit[lane] -= total
+        return self._queues[lane].popleft()
+
+    def reset(self):
+        """
+        Forget lane credit (waiters are not affected)
+        """
+        for lane in self._credit:
+            self._credit[lane] = 0
+
+
+class PassbackScheduler(object):
+    """
+    Runs passback calls at most ``concurrency`` at a time, queueing the
+    rest in priority lanes.
+
+    When a slot frees up, the next call is taken from a lane chosen by
+    smooth weighted round-robin over the lanes that have calls waiting:
+    with the default weights, interactive calls (made while a learner
+    waits) get four slots for every one given to bulk calls (e.g. a
+    regrade), so they jump a bulk backlog without starving it.
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, weights=None):
+        self.concurrency = concurrency
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+        self.active = 0
+        self._queues = LaneQueue()
+
+    def configure(self, concurrency=None, weights=None):
+        """
+        Change concurrency and/or lane weights; calls already queued
+        keep their place.
+        """
+        if concurrency is not None:
+            self.concurrency = concurrency
+        if weights is not None:
+            self.weights = dict(weights)
+        self._dispatch()
+
+    def queued(self, lane=None):
+        """
+        Number of calls waiting
+
+        :param lane: lane (default: all lanes)
+        :return: count
+        """
+        if lane is not None:
+            return self._queues.count(lane)
+        return len(self._queues)
+
+    def check_lane(self, lane):
+        """
+        Make sure lane is configured
+
+        :param lane: lane name
+        :raises: ValueError for an unknown lane
+        """
+        if lane not in self.weights:
+            raise ValueError('Unknown passback lane {!r}'.format(lane))
+
+    async def run(self, lane, send):
+        """
+        Make a call once a slot is free and it is its lane's turn
+
+        :param lane: lane name, e.g. INTERACTIVE or BULK
+        :param send: zero-argument coroutine function making the call
+        :return: result of the call
+        """
+        self.check_lane(lane)
+        if self.active >= self.concurrency or self.queued():
+            turn = asyncio.get_running_loop().create_future()
+            self._queues.append(lane, turn)
+            log.debug("Queued %s passback (%d waiting)", lane, self.queued())
+            self._dispatch()
+            try:
+                await turn
+            except asyncio.CancelledError:
+                if turn.cancelled():
+                    self._queues.remove(lane, turn)
+                else:
+                    # Slot was handed over just as we were cancelled
+                    self._release()
+                raise
+        else:
+            self.active += 1
+        try:
+            return await send()
+        finally:
+            self._release()
+
+    def _release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.active < self.concurrency:
+            turn = self._queues.popleft(self.weights)
+            if turn is None:
+                return
+            if turn.done():
+                # Caller gave up while queued
+                continue
+            self.active += 1
+            turn.set_result(None)
+
+    def reset(self):
+        """
+        Forget lane credit (queued calls are not affected)
+        """
+        self._queues.reset()
+
+
+passback_scheduler = PassbackScheduler()  # pylint: disable=invalid-name
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Self-contained OAuth 1.0a HMAC-SHA1 signing for outbound LTI messages
+"""
+from __future__ import absolute_import
+
+import base64
+import hashlib
+import hmac
+import os
+import time
+import binascii
+from urllib.parse import quote, urlsplit, parse_qsl
+
+OAUTH_VERSION = '1.0'
+SIGNATURE_METHOD = 'HMAC-SHA1'
+
+
+def escape(value):
+    """
+    Percent-encode per RFC 5849, section 3.6
+
+    :param value: str or bytes
+    :return: encoded str
+    """
+    return quote(value, safe='~')
+
+
+def base_string_uri(url):
+    """
+    Base string URI per RFC 5849, section 3.4.1.2: lowercase scheme and
+    host, no default port, no query or fragment
+
+    :param url: request URL
+    :return: (base URI, list of query parameters)
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, parts.port) in (('http', 80), ('https', 443)):
+        netloc = netloc.rsplit(':', 1)[0]
+    uri = '{}://{}{}'.format(scheme, netloc, parts.path or '/')
+    return uri, parse_qsl(parts.query, keep_blank_values=True)
+
+
+def normalize_parameters(params):
+    """
+    Normalized request parameters per RFC 5849, section 3.4.1.3.2
+
+    :param params: iterable of (name, value) pairs; oauth_signature
+        is skipped
+    :return: normalized parameter string
+    """
+    encoded = sorted(
+        (escape(key), escape(value))
+        for key, value in params if key != 'oauth_signature')
+    return '&'.join('{}={}'.format(key, value) for key, value in encoded)
+
+
+def body_hash(body):
+    """
+    oauth_body_hash value for a request body
+
+    :param body: bytes
+    :return: base64 encoded SHA1 digest
+    """
+    return base64.b64encode(hashlib.sha1(body).digest()).decode('ascii')
+
+
+def make_nonce():
+    """
+    Fresh random nonce
+
+    :return: str
+    """
+    return binascii.hexlify(os.urandom(16)).decode('ascii')
+
+
+class OAuthSigner(object):
+    """
+    HMAC-SHA1 signer for one consumer (two-legged, no token).
+    The HMAC key schedule is computed once and copied for each signature.
+    """
+
+    def __init__(self, key, secret):
+        self.key = key
+        self.secret = secret
+        signing_key = '{}&'.format(escape(secret)).encode('utf-8')
+        self._hmac = hmac.new(signing_key, digestmod=hashlib.sha1)
+
+    def oauth_params(self, timestamp=None, nonce=None):
+        """
+        Protocol parameters for a new request (without signature)
+
+        :param timestamp: seconds since epoch (default: now)
+        :param nonce: nonce (default: random)
+        :return: list of (name, value) pairs
+        """
+        return [
+            ('oauth_consumer_key', self.key),
+            ('oauth_nonce', nonce or make_nonce()),
+            ('oauth_signature_method', SIGNATURE_METHOD),
+            ('oauth_timestamp', str(int(
+                timestamp if timestamp is not None else time.time()))),
+            ('oauth_version', OAUTH_VERSION),
+        ]
+
+    def signature(self, method, url, params):
+        """
+        Compute signature over the request
+
+        :param method: HTTP method
+        :param url: request URL; its query parameters are included
+        :param params: other (name, value) pairs, including oauth_*
+        :return: base64 encoded signature
+        """
+        uri, query = base_string_uri(url)
+        return self.sign_base_string('&'.join((
+            escape(method.upper()),
+            escape(uri),
+            escape(normalize_parameters(list(params) + query)),
+        )))
+
+    def sign_base_string(self, base):
+        """
+        Compute signature over a signature base string
+        (RFC 5849, section 3.4.1)
+
+        :param base: base string
+        :return: base64 encoded signature
+        """
+        digest = self._hmac.copy()
+        digest.update(base.encode('utf-8'))
+        return base64.b64encode(digest.digest()).decode('ascii')
+
+    def sign_params(self, method, url, params, timestamp=None, nonce=None):
+        """
+        Sign form parameters (e.g. a launch), returning them with the
+        protocol parameters and signature added
+
+        :param method: HTTP method
+        :param url: request URL
+        :param params: dict of form parameters
+        :return: new dict of signed parameters
+        """
+        # pylint: disable=too-many-arguments
+        signed = dict(params)
+        signed.update(self.oauth_params(timestamp, nonce))
+        signed['oauth_signature'] = self.signature(
+            method, url, signed.items())
+        return signed
+
+    def sign_request(self, method, url, body=b'',
+                     timestamp=None, nonce=None):
+        """
+        Sign a request with a non-form body, per the OAuth body hash
+        extension
+
+        :param method: HTTP method
+        :param url: request URL
+        :param body: request body, as bytes
+        :return: dict with the Authorization header
+        """
+        # pylint: disable=too-many-arguments
+        params = self.oauth_params(timestamp, nonce)
+        params.append(('oauth_body_hash', body_hash(body)))
+        params.append(('oauth_signature',
+                       self.signature(method, url, params)))
+        parts = urlsplit(url)
+        header = ', '.join(
+            ['realm="{}://{}"'.format(parts.scheme, parts.netloc)] +
+            ['{}="{}"'.format(key, escape(value)) for key, value in params])
+        return {'Authorization': 'OAuth ' + header}
+
+
+_SIGNERS = dict()
+
+
+def get_signer(key, secret):
+    """
+    Cached signer for consumer
+
+    :param key: consumer key
+    :param secret: consumer secret
+    :return: OAuthSigner
+    """
+    signer = _SIGNERS.get((key, secret))
+    if signer is None:
+        signer = _SIGNERS[(key, secret)] = OAuthSigner(key, secret)
+    return signer
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Test aiolti/asgi.py module
+"""
+import unittest
+from urllib.parse import urlencode
+
+import oauthlib.oauth1
+
+from aiolti.asgi import LTIMiddleware, header_name, scope_url
+
+
+CONSUMERS = {
+    "__consumer_key__": {"secret": "__lti_secret__"}
+}
+
+LAUNCH_PARAMS = {
+    'resource_link_id': u'link',
+    'user_id': u'008437924c9852377e8994829aaac7a1',
+    'roles': u'Instructor',
+    'context_id': u'MITx/ODL_ENG/2014_T1',
+    'lti_version': u'LTI-1p0',
+    'lti_message_type': u'basic-lti-launch-request',
+}
+
+
+def signed_body(url, params):
+    """
+    Sign launch parameters as a form POST body
+    """
+    client = oauthlib.oauth1.Client('__consumer_key__',
+                                    client_secret='__lti_secret__',
+                                    signature_type=oauthlib.oauth1.
+                                    SIGNATURE_TYPE_BODY)
+    _, _, body = client.sign(
+        url, 'POST', urlencode(params),
+        {'Content-Type': 'application/x-www-form-urlencoded'})
+    return body.encode('utf-8')
+
+
+class TestLTIMiddleware(unittest.IsolatedAsyncioTestCase):
+    """
+    Tests for LTIMiddleware
+    """
+
+    def setUp(self):
+        self.scopes = []
+        self.bodies = []
+
+        async def app(scope, receive, send):
+            self.scopes.append(scope)
+            message = await receive()
+            self.bodies.append(message.get('body'))
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': []})
+            await send({'type': 'http.response.body', 'body': b'ok'})
+
+        self.app = LTIMiddleware(app, CONSUMERS, paths=['/launch'])
+
+    async def call(self, path, body=b'', method='POST', query=b'',
+                   headers=None, root_path=''):
+        """
+        Drive middleware with a single-chunk request
+        """
+        # pylint: disable=too-many-arguments
+        scope = {
+            'type': 'http',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'root_path': root_path,
+            'query_string': query,
+            'server': ('localhost', 80),
+            'headers': [
+                (b'host', b'localhost'),
+                (b'content-type', b'application/x-www-form-urlencoded'),
+            ] + (headers or []),
+        }
+        messages = [{'type': 'http.request', 'body': body[:10],
+                     'more_body': True},
+                    {'type': 'http.request', 'body': body[10:],
+                     'more_body': False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await self.app(scope, receive, send)
+        return sent[0]['status'], b''.join(m.get('body', b'')
+                                           for m in sent[1:])
+
+    async def test_valid_launch(self):
+        """
+        Valid launch reaches the app with claims and the original body.
+        """
+        body = signed_body('http://localhost/launch', LAUNCH_PARAMS)
+        status, _ = await self.call('/launch', body)
+        self.assertEqual(status, 200)
+        claims = self.scopes[0]['lti']
+        self.assertEqual(claims['user_id'], LAUNCH_PARAMS['user_id'])
+        self.assertEqual(claims['oauth_consumer_key'], '__consumer_key__')
+        self.assertEqual(self.bodies[0], body)
+
+    async def test_forwarded_proto(self):
+        """
+        Launch signed for https is accepted behind a TLS proxy.
+        """
+        body = signed_body('https://localhost/launch', LAUNCH_PARAMS)
+        status, _ = await self.call(
+            '/launch', body,
+            headers=[(b'x-forwarded-proto', b'https')])
+        self.assertEqual(status, 200)
+
+    async def test_invalid_launch(self):
+        """
+        Tampered launch is rejected before reaching the app.
+        """
+        body = signed_body('http://localhost/launch', LAUNCH_PARAMS)
+        status, data = await self.call('/launch', body + b'&FAIL=TRUE')
+        self.assertEqual(status, 400)
+        self.assertEqual(
+            data, b'LTI Error: OAuth error: Please check your key and secret')
+        self.assertEqual(self.scopes, [])
+
+    async def test_body_too_large(self):
+        """
+        Oversized bodies are rejected while reading.
+        """
+        self.app.max_body_size = 16
+        body = signed_body('http://localhost/launch', LAUNCH_PARAMS)
+        status, data = await self.call('/launch', body)
+        self.assertEqual(status, 400)
+        self.assertEqual(data, b'LTI Error: Request body too large')
+
+    async def test_root_path(self):
+        """
+        Under a mount prefix, the signed URL is the full path (which
+        includes root_path), with the prefix only once.
+        """
+        self.app.paths = ('/lti/launch',)
+        body = signed_body('http://localhost/lti/launch', LAUNCH_PARAMS)
+        status, _ = await self.call('/lti/launch', body, root_path='/lti')
+        self.assertEqual(status, 200)
+
+    async def test_no_body_limit(self):
+        """
+        max_body_size=None reads bodies of any size.
+        """
+        self.app.max_body_size = None
+        body = signed_body('http://localhost/launch', LAUNCH_PARAMS)
+        status, _ = await self.call('/launch', body)
+        self.assertEqual(status, 200)
+
+    async def test_unprotected_path(self):
+        """
+        Paths outside the protected set pass straight through.
+        """
+        status, _ = await self.call('/static/app.js', method='GET')
+        self.assertEqual(status, 200)
+        self.assertNotIn('lti', self.scopes[0])
+
+    def test_scope_helpers(self):
+        """
+        Header names and request URL as used for verification
+        """
+        self.assertEqual(header_name(b'x-forwarded-proto'),
+                         'X-Forwarded-Proto')
+        scope = {'scheme': 'https', 'path': '/lti/launch',
+                 'root_path': '/lti', 'query_string': b'a=1',
+                 'server': ('127.0.0.1', 8000)}
+        self.assertEqual(scope_url(scope, dict()),
+                         'https://127.0.0.1:8000/lti/launch?a=1')
+        self.assertEqual(scope_url(scope, {'Host': 'example.edu'}),
+                         'https://example.edu/lti/launch?a=1')
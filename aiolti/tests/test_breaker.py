@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Test aiolti/breaker.py module
+"""
+import unittest
+
+from aiolti.breaker import (
+    CircuitBreaker,
+    CircuitBreakerRegistry,
+    CLOSED,
+    OPEN,
+    HALF_OPEN,
+)
+from aiolti.tests.util import FakeClock
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """
+    Tests for CircuitBreaker
+    """
+
+    def test_opens_after_threshold(self):
+        """
+        Consecutive failures open the breaker; a success resets the count.
+        """
+        breaker = CircuitBreaker(failure_threshold=2, clock=FakeClock())
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertGreater(breaker.retry_after, 0)
+
+    def test_half_open_probe(self):
+        """
+        After the reset timeout a single probe is let through.
+        """
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10,
+                                 clock=clock)
+        breaker.record_failure()
+        clock.now += 10
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+        # Failed probe re-opens
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+
+        # Abandoned probe frees its slot, successful probe closes
+        clock.now += 10
+        self.assertTrue(breaker.allow())
+        breaker.release()
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_registry(self):
+        """
+        Registry keeps one breaker per host and reports states.
+        """
+        registry = CircuitBreakerRegistry(clock=FakeClock(),
+                                          failure_threshold=1)
+        self.assertIs(registry.get('a'), registry.get('a'))
+        registry.get('a').record_failure()
+        registry.get('b')
+        self.assertEqual(registry.states(), {'a': OPEN, 'b': CLOSED})
+        registry.configure(failure_threshold=3)
+        self.assertEqual(registry.states(), {})
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Test aiolti/coalesce.py module
+"""
+import asyncio
+import unittest
+
+import mock
+
+from aiolti.coalesce import Coalescer
+from aiolti.tests.util import SessionLTI
+
+
+class TestCoalescer(unittest.IsolatedAsyncioTestCase):
+    """
+    Tests for Coalescer
+    """
+
+    async def test_latest_call_wins(self):
+        """
+        Calls within the window collapse to the last one submitted.
+        """
+        coalescer = Coalescer()
+        sent = []
+
+        def make_send(value):
+            async def send():
+                sent.append(value)
+                return value
+            return send
+
+        results = await asyncio.gather(
+            coalescer.submit('k', make_send(1), 0.05),
+            coalescer.submit('k', make_send(2), 0.05),
+            coalescer.submit('other', make_send(3), 0.05),
+            coalescer.submit('k', make_send(4), 0.05),
+        )
+        self.assertEqual(results, [4, 4, 3, 4])
+        self.assertEqual(sorted(sent), [3, 4])
+        self.assertEqual(coalescer.pending('k'), 0)
+
+    async def test_exception_shared(self):
+        """
+        Every waiter sees the failure of the call actually made.
+        """
+        coalescer = Coalescer()
+
+        async def fail():
+            raise ValueError("boom")
+
+        results = await asyncio.gather(
+            coalescer.submit('k', fail, 0.01),
+            coalescer.submit('k', fail, 0.01),
+            return_exceptions=True,
+        )
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+
+    async def test_cancelled_waiter(self):
+        """
+        Cancelling one waiter doesn't cancel the shared call.
+        """
+        coalescer = Coalescer()
+
+        async def send():
+            return True
+
+        first = asyncio.ensure_future(coalescer.submit('k', send, 0.05))
+        second = asyncio.ensure_future(coalescer.submit('k', send, 0.05))
+        await asyncio.sleep(0)
+        first.cancel()
+        self.assertTrue(await second)
+
+    async def test_post_grade_coalesced(self):
+        """
+        post_grade sends a single message carrying the latest score.
+        """
+        lti = SessionLTI({
+            'oauth_consumer_key': '__consumer_key__',
+            'lis_result_sourcedid': 'sourcedid',
+            'lis_outcome_service_url': 'https://example.edu/grade_handler',
+        }, consumers={
+            "__consumer_key__": {"secret": "__lti_secret__",
+                                 "passback_coalesce_window": 0.05}
+        })
+        with mock.patch('aiolti.common.post_message',
+                        new=mock.AsyncMock(return_value=True)) as post:
+            results = await asyncio.gather(
+                lti.post_grade(0.1), lti.post_grade(0.5), lti.post_grade(0.9))
+            self.assertEqual(results, [True, True, True])
+            self.assertEqual(post.call_count, 1)
+            self.assertIn('<textString>0.9</textString>',
+                          post.call_args[0][3])
+
+            # Explicitly disabled per call
+            await lti.post_grade(0.2, coalesce_window=0)
+            self.assertEqual(post.call_count, 2)
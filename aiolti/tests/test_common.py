@@ -2,26 +2,121 @@
 """
 Test aiolti/test_common.py module
 """
+import asyncio
+import socket
+import threading
+import time
 import unittest
 import semantic_version
 
 from mocket.plugins import httpretty
 import oauthlib.oauth1
 
-from six.moves.urllib.parse import urlencode, urlparse, parse_qs
+from urllib.parse import quote, urlencode, urlparse, parse_qs
 
 import aiolti
+from aiolti.breaker import breakers, breaker_state, OPEN
 from aiolti.common import (
     LTIOAuthServer,
     verify_request_common,
     LTIException,
+    LTIVerificationException,
+    VERIFICATION_REJECTIONS,
+    STAGE_CONTENT_LENGTH,
+    STAGE_REQUIRED_FIELDS,
+    STAGE_CONSUMER,
+    STAGE_TIMESTAMP,
+    STAGE_NONCE,
+    STAGE_SIGNATURE,
+    LTICircuitOpenException,
+    LTIPostMessageTimeout,
+    Timeout,
     post_message,
     post_message2,
-    generate_request_xml
+    generate_request_xml,
+    verify_oauth_params,
 )
+from aiolti.nonce import MemoryNonceStore
+from aiolti.ratelimit import PASSBACK_RATE_LIMIT_KEY, passback_limiter
+from aiolti.rotation import secret_order
 from aiolti.tests.util import TEST_CLIENT_CERT
 
 
+class RecordingServer(object):
+    """
+    Local HTTP server that records one request and replies with a fixed
+    status and body.
+    """
+
+    def __init__(self, status, body):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.request = None
+        self.reply = ('HTTP/1.1 {} OK\r\nContent-Length: {}\r\n'
+                      'Connection: close\r\n\r\n{}').format(
+                          status, len(body.encode('utf-8')), body)
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        """ URL of the server """
+        return 'http://127.0.0.1:{}/grade_handler'.format(
+            self.sock.getsockname()[1])
+
+    def _serve(self):
+        conn, _ = self.sock.accept()
+        with conn:
+            data = b''
+            while b'\r\n\r\n' not in data:
+                data += conn.recv(65536)
+            head, _, body = data.partition(b'\r\n\r\n')
+            length = int(head.lower().split(b'content-length:')[1]
+                         .split(b'\r\n')[0])
+            while len(body) < length:
+                body += conn.recv(65536)
+            self.request = (head.decode('latin-1'), body)
+            conn.sendall(self.reply.encode('utf-8'))
+
+    def close(self):
+        """ Stop listening """
+        self.sock.close()
+        self.thread.join(2)
+
+
+class HangingServer(object):
+    """
+    Local server that accepts connections and never answers; records
+    when the client side goes away.
+    """
+
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        """ URL of the server """
+        return 'http://127.0.0.1:{}/grade_handler'.format(
+            self.sock.getsockname()[1])
+
+    def _serve(self):
+        conn, _ = self.sock.accept()
+        with conn:
+            while conn.recv(65536):
+                pass
+        self.closed.set()
+
+    def close(self):
+        """ Stop listening """
+        self.sock.close()
+
+
 class ExceptionHandler(object):
     """
     Custom exception handler.
@@ -181,6 +276,148 @@ edge.edx.org-i4x-StarX-StarX_DEMO-lti-40559041895b4065b2818c23b9cd9da8\
         with self.assertRaises(LTIException):
             verify_request_common(consumers, url, method, headers, params)
 
+    def assert_rejected_at(self, stage, *args, **kwargs):
+        """
+        verify_request_common rejects at given stage, and counts it
+        """
+        before = VERIFICATION_REJECTIONS[stage]
+        with self.assertRaises(LTIVerificationException) as context:
+            verify_request_common(*args, **kwargs)
+        self.assertEqual(context.exception.stage, stage)
+        self.assertEqual(VERIFICATION_REJECTIONS[stage], before + 1)
+
+    def test_verify_request_common_content_length(self):
+        """
+        Oversized requests are rejected on Content-Length alone
+        """
+        consumers, method, url, verify_params, _ = (
+            self.generate_oauth_request()
+        )
+        headers = {'Content-Length': '2048'}
+        self.assert_rejected_at(STAGE_CONTENT_LENGTH, consumers, url, method,
+                                headers, verify_params,
+                                max_content_length=1024)
+        self.assertTrue(verify_request_common(
+            consumers, url, method, headers, verify_params,
+            max_content_length=4096))
+
+    def test_verify_request_common_stages(self):
+        """
+        Cheap checks reject before the signature is looked at
+        """
+        consumers, method, url, verify_params, _ = (
+            self.generate_oauth_request()
+        )
+        missing = dict(verify_params)
+        del missing['oauth_nonce']
+        self.assert_rejected_at(STAGE_REQUIRED_FIELDS, consumers, url, method,
+                                dict(), missing)
+
+        # Unknown key, bad timestamp, and bad signature: the consumer
+        # check comes first
+        unknown = dict(verify_params, oauth_consumer_key='unknown',
+                       oauth_timestamp='0', oauth_signature='bad')
+        self.assert_rejected_at(STAGE_CONSUMER, consumers, url, method,
+                                dict(), unknown)
+
+        stale = dict(verify_params, oauth_timestamp='0',
+                     oauth_signature='bad')
+        self.assert_rejected_at(STAGE_TIMESTAMP, consumers, url, method,
+                                dict(), stale)
+
+        forged = dict(verify_params, oauth_signature='bad')
+        self.assert_rejected_at(STAGE_SIGNATURE, consumers, url, method,
+                                dict(), forged)
+
+    def test_verify_oauth_params(self):
+        """
+        Shared cheap stages read the Authorization header, then params,
+        and return what later stages need
+        """
+        consumers, _, _, verify_params, _ = self.generate_oauth_request()
+        header = 'OAuth ' + ', '.join(
+            '{}="{}"'.format(key, quote(value, safe=''))
+            for key, value in verify_params.items()
+            if key.startswith('oauth_'))
+        store = MemoryNonceStore()
+        for headers, params in (({'Authorization': header}, None),
+                                (dict(), verify_params)):
+            oauth_params, consumer, timestamp = verify_oauth_params(
+                consumers, headers, params, nonce_store=store)
+            self.assertEqual(oauth_params['oauth_nonce'],
+                             verify_params['oauth_nonce'])
+            self.assertIs(consumer, consumers['__consumer_key__'])
+            self.assertEqual(timestamp,
+                             int(verify_params['oauth_timestamp']))
+        self.assertEqual(len(store), 0)
+
+        with self.assertRaises(LTIVerificationException) as context:
+            verify_oauth_params(consumers, dict(), verify_params,
+                                extra_required=('oauth_body_hash',))
+        self.assertEqual(context.exception.stage, STAGE_REQUIRED_FIELDS)
+
+    def test_verify_request_common_nonce(self):
+        """
+        Replayed requests are rejected when a nonce store is given
+        """
+        consumers, method, url, verify_params, _ = (
+            self.generate_oauth_request()
+        )
+        store = MemoryNonceStore()
+        # A forged request does not use up (or store) the nonce
+        forged = dict(verify_params, oauth_signature='bad')
+        self.assert_rejected_at(STAGE_SIGNATURE, consumers, url, method,
+                                dict(), forged, nonce_store=store)
+        self.assertEqual(len(store), 0)
+        self.assertTrue(verify_request_common(
+            consumers, url, method, dict(), verify_params,
+            nonce_store=store))
+        self.assert_rejected_at(STAGE_NONCE, consumers, url, method, dict(),
+                                verify_params, nonce_store=store)
+        self.assert_rejected_at(STAGE_NONCE, consumers, url, method, dict(),
+                                forged, nonce_store=store)
+
+    def test_verify_request_common_rotated_secret(self):
+        """
+        Requests signed with an unexpired previous secret verify, and
+        that secret is tried first from then on
+        """
+        _, method, url, verify_params, _ = self.generate_oauth_request()
+        consumers = {
+            "__consumer_key__": {
+                "secret": "__new_secret__",
+                "previous_secrets": [
+                    {"secret": "__lti_secret__", "expires": time.time() + 60},
+                ],
+            }
+        }
+        secret_order.reset()
+        self.assertTrue(verify_request_common(consumers, url, method,
+                                              dict(), verify_params))
+        self.assertEqual(
+            secret_order.candidates("__consumer_key__",
+                                    consumers["__consumer_key__"]),
+            ["__lti_secret__", "__new_secret__"])
+
+        consumers["__consumer_key__"]["previous_secrets"][0]["expires"] = (
+            time.time() - 60)
+        self.assert_rejected_at(STAGE_SIGNATURE, consumers, url, method,
+                                dict(), verify_params)
+
+    def test_verify_request_common_header_params(self):
+        """
+        Required oauth fields may come from the Authorization header
+        """
+        consumers = {
+            "__consumer_key__": {"secret": "__lti_secret__"}
+        }
+        url = 'http://localhost:5000/?'
+        client = oauthlib.oauth1.Client('__consumer_key__',
+                                        client_secret='__lti_secret__')
+        _, headers, _ = client.sign(url, 'GET')
+        self.assertTrue(verify_request_common(consumers, url, 'GET',
+                                              headers, dict()))
+
     @httpretty.activate
     async def test_post_response_invalid_xml(self):
         """
@@ -234,6 +471,153 @@ edge.edx.org-i4x-StarX-StarX_DEMO-lti-40559041895b4065b2818c23b9cd9da8\
         ret = await post_message2(consumers, "__consumer_key__", uri, body)
         self.assertTrue(ret)
 
+    async def test_post_message_signed_request(self):
+        """
+        Outbound request carries a capitalized, body-hashed Authorization
+        header
+        """
+        server = RecordingServer(200, self.expected_response)
+        consumers = {
+            "__consumer_key__": {"secret": "__lti_secret__"}
+        }
+        body = generate_request_xml('message_identifier_id', 'replaceResult',
+                                    'lis_result_sourcedid', 1.0)
+        try:
+            ret = await post_message(consumers, "__consumer_key__",
+                                     server.url, body)
+        finally:
+            server.close()
+        self.assertTrue(ret)
+        head, sent = server.request
+        self.assertEqual(sent, body.encode('utf-8'))
+        self.assertIn('\r\nAuthorization: OAuth realm=', head)
+        self.assertIn('oauth_body_hash="', head)
+        self.assertIn('\r\nContent-Type: application/xml', head)
+
+    async def test_post_message2_status(self):
+        """
+        post_message2 reports success on HTTP 200 only
+        """
+        consumers = {
+            "__consumer_key__": {"secret": "__lti_secret__"}
+        }
+        for status, expected in ((200, True), (404, False)):
+            server = RecordingServer(status, '')
+            try:
+                ret = await post_message2(consumers, "__consumer_key__",
+                                          server.url, '{}', method='PUT')
+            finally:
+                server.close()
+            self.assertEqual(ret, expected)
+            self.assertTrue(server.request[0].startswith('PUT '))
+
+    async def test_post_message_circuit_open(self):
+        """
+        Passback fails immediately while the host's breaker is open
+        """
+        uri = 'https://unreachable.example.edu/grade_handler'
+        consumers = {
+            "__consumer_key__": {"secret": "__lti_secret__"}
+        }
+        breakers.configure(failure_threshold=1, reset_timeout=60)
+        try:
+            breakers.get('unreachable.example.edu').record_failure()
+            self.assertEqual(breaker_state('unreachable.example.edu'), OPEN)
+            with self.assertRaises(LTICircuitOpenException) as ctx:
+                await post_message(consumers, "__consumer_key__", uri,
+                                   '<xml></xml>')
+            self.assertEqual(ctx.exception.host, 'unreachable.example.edu')
+            self.assertGreater(ctx.exception.retry_after, 0)
+        finally:
+            breakers.configure()
+
+    async def test_post_message_cancelled_probe(self):
+        """
+        A half-open probe cancelled while throttled is given back
+        """
+        uri = 'https://unreachable.example.edu/grade_handler'
+        consumers = {
+            "__consumer_key__": {"secret": "__lti_secret__",
+                                 PASSBACK_RATE_LIMIT_KEY: {"rate": 1}}
+        }
+        breakers.configure(failure_threshold=1, reset_timeout=0)
+        try:
+            breaker = breakers.get('unreachable.example.edu')
+            breaker.record_failure()
+            passback_limiter.bucket(consumers, "__consumer_key__",
+                                    'unreachable.example.edu').reserve()
+            task = asyncio.ensure_future(post_message(
+                consumers, "__consumer_key__", uri, '<xml></xml>'))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertTrue(breaker.allow())
+        finally:
+            breakers.configure()
+            passback_limiter.reset()
+
+    async def test_post_message_total_timeout(self):
+        """
+        Hung outcome service is abandoned after the total timeout, and the
+        connection is actually closed
+        """
+        server = HangingServer()
+        consumers = {
+            "__consumer_key__": {"secret": "__lti_secret__"}
+        }
+        try:
+            with self.assertRaises(LTIPostMessageTimeout):
+                await post_message(consumers, "__consumer_key__", server.url,
+                                   '<xml></xml>',
+                                   timeout=Timeout(connect=1, total=0.2))
+            self.assertTrue(server.closed.wait(2))
+        finally:
+            server.close()
+
+    async def test_post_message_read_timeout(self):
+        """
+        Consumer-level read timeout is applied to the socket
+        """
+        server = HangingServer()
+        consumers = {
+            "__consumer_key__": {"secret": "__lti_secret__",
+                                 "passback_timeout": {"read": 0.2}}
+        }
+        try:
+            with self.assertRaises(LTIPostMessageTimeout):
+                await post_message2(consumers, "__consumer_key__", server.url,
+                                    '<xml></xml>')
+        finally:
+            server.close()
+
+    async def test_post_message_cancel(self):
+        """
+        Cancelling the caller aborts the underlying request
+        """
+        server = HangingServer()
+        consumers = {
+            "__consumer_key__": {"secret": "__lti_secret__"}
+        }
+        try:
+            task = asyncio.ensure_future(post_message(
+                consumers, "__consumer_key__", server.url, '<xml></xml>'))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertTrue(server.closed.wait(2))
+        finally:
+            server.close()
+
+    def test_timeout_coerce(self):
+        """
+        Timeouts can be given as numbers or dicts
+        """
+        self.assertEqual(Timeout.coerce(5), Timeout(5, 5, 5))
+        self.assertEqual(Timeout.coerce({'total': 3}), Timeout(total=3))
+        self.assertIsNone(Timeout.coerce(None))
+
     def test_generate_xml(self):
         """
         Generated post XML is valid
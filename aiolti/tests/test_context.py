@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Test aiolti/context.py module
+"""
+import unittest
+
+from aiolti.context import ContextRegistry, context_ref
+
+
+class CountingStore(dict):
+    """
+    Dict counting writes
+    """
+    writes = 0
+
+    def __setitem__(self, key, value):
+        self.writes += 1
+        super().__setitem__(key, value)
+
+
+class TestContextRegistry(unittest.TestCase):
+    """
+    Tests for the shared context data registry
+    """
+
+    params = {
+        'oauth_consumer_key': 'key',
+        'user_id': 'alice',
+        'context_id': 'course-1',
+        'context_label': 'C1',
+        'resource_link_id': 'link-1',
+        'lis_outcome_service_url': 'https://example.edu/grade',
+    }
+
+    def test_register_once(self):
+        """
+        Launches into the same context share one entry, written once
+        """
+        store = CountingStore()
+        registry = ContextRegistry(store)
+        ref = registry.register('key', self.params)
+        self.assertEqual(registry.register(['key'], dict(self.params,
+                                                         user_id='bob')),
+                         ref)
+        self.assertEqual(store.writes, 1)
+        self.assertEqual(ref, context_ref('key', 'course-1', 'link-1'))
+        self.assertEqual(registry.lookup(ref), {
+            'context_id': 'course-1',
+            'context_label': 'C1',
+            'resource_link_id': 'link-1',
+            'lis_outcome_service_url': 'https://example.edu/grade',
+        })
+
+        # Changed context data is written, and seen through the same ref
+        registry.register('key', dict(self.params, context_label='C1b'))
+        self.assertEqual(store.writes, 2)
+        self.assertEqual(registry.lookup(ref)['context_label'], 'C1b')
+
+    def test_partial_launch_keeps_fields(self):
+        """
+        A later launch without some fields (e.g. an instructor's, without
+        an outcome service) does not drop them from the shared entry
+        """
+        store = CountingStore()
+        registry = ContextRegistry(store)
+        ref = registry.register('key', self.params)
+        instructor = dict(self.params, user_id='carol')
+        del instructor['lis_outcome_service_url']
+        del instructor['context_label']
+        self.assertEqual(registry.register('key', instructor), ref)
+        self.assertEqual(store.writes, 1)
+        self.assertEqual(registry.lookup(ref)['lis_outcome_service_url'],
+                         'https://example.edu/grade')
+
+        # New fields are merged in
+        registry.register('key', dict(instructor, resource_link_title='Q'))
+        self.assertEqual(store.writes, 2)
+        self.assertEqual(registry.lookup(ref), {
+            'context_id': 'course-1',
+            'context_label': 'C1',
+            'resource_link_id': 'link-1',
+            'resource_link_title': 'Q',
+            'lis_outcome_service_url': 'https://example.edu/grade',
+        })
+
+    def test_distinct_contexts(self):
+        """
+        Consumers and resource links get their own entries
+        """
+        registry = ContextRegistry()
+        refs = {
+            registry.register('key', self.params),
+            registry.register('other', self.params),
+            registry.register('key', dict(self.params,
+                                          resource_link_id='link-2')),
+        }
+        self.assertEqual(len(refs), 3)
+        self.assertEqual(len(registry), 3)
+
+    def test_no_context(self):
+        """
+        Launches without context or resource link are not registered
+        """
+        registry = ContextRegistry()
+        self.assertIsNone(registry.register('key', {'user_id': 'alice'}))
+        self.assertIsNone(registry.register(None, self.params))
+        self.assertIsNone(registry.lookup('unknown'))
+        self.assertEqual(len(registry), 0)
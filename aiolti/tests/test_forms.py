@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Test aiolti/forms.py module
+"""
+import unittest
+
+from aiolti.common import LTIVerificationException, STAGE_CONTENT_LENGTH
+from aiolti.forms import FormDecoder, decode_form, first_value, read_form
+
+
+async def chunks(*parts):
+    """ Async iterable over parts """
+    for part in parts:
+        yield part
+
+
+class TestFormDecoder(unittest.IsolatedAsyncioTestCase):
+    """
+    Tests for FormDecoder
+    """
+
+    def test_decode(self):
+        """
+        Fields are decoded like parse_qs, keeping duplicates in order
+        """
+        params = decode_form(b'a=1&b=x+y%21&a=2&empty=&flag&&c=%C3%A9')
+        self.assertEqual(params, {'a': ['1', '2'], 'b': 'x y!',
+                                  'empty': '', 'flag': '', 'c': u'\xe9'})
+        self.assertEqual(first_value(params['a']), '1')
+        self.assertEqual(first_value(params['b']), 'x y!')
+
+    async def test_streaming(self):
+        """
+        Fields split across chunks are reassembled
+        """
+        params = await read_form(chunks(b'user_', b'id=12', b'3&ro',
+                                        b'les=Instr', b'uctor'))
+        self.assertEqual(params, {'user_id': '123', 'roles': 'Instructor'})
+
+    def test_limits(self):
+        """
+        Size limits are enforced while feeding
+        """
+        decoder = FormDecoder(max_body_size=16)
+        decoder.feed(b'a=1&b=2')
+        with self.assertRaises(LTIVerificationException) as context:
+            decoder.feed(b'&c=' + b'3' * 16)
+        self.assertEqual(context.exception.stage, STAGE_CONTENT_LENGTH)
+
+        # An oversized field is caught before it is complete
+        decoder = FormDecoder(max_field_size=8)
+        decoder.feed(b'a=1&b=2345')
+        with self.assertRaises(LTIVerificationException):
+            decoder.feed(b'6789')
+
+    def test_invalid_encoding(self):
+        """
+        Bodies that are not valid in the charset are rejected
+        """
+        with self.assertRaises(LTIVerificationException):
+            decode_form(b'a=%FF')
+        with self.assertRaises(LTIVerificationException):
+            decode_form(b'a=1', charset='bogus')
+        for codec in ('rot13', 'base64'):
+            with self.assertRaises(LTIVerificationException):
+                decode_form(b'a=1', charset=codec)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Test aiolti/hedge.py module
+"""
+import asyncio
+import unittest
+
+from aiolti.breaker import breakers
+from aiolti.hedge import HedgePolicy, hedge_policy, hedged
+from aiolti.limiter import passback_limits
+from aiolti.tests.util import SessionLTI
+from aiolti.transport import InMemoryTransport, set_transport
+
+SUCCESS = u"<imsx_codeMajor>success</imsx_codeMajor>"
+
+
+class TestHedge(unittest.IsolatedAsyncioTestCase):
+    """
+    Tests for hedged requests
+    """
+
+    def setUp(self):
+        self.policy = HedgePolicy(min_samples=5, budget=1, burst=1)
+        for _ in range(5):
+            self.policy.record('host', 0.01)
+        self.started = []
+
+    def attempts(self, *delays):
+        """
+        send() whose successive calls take the given times (and fail,
+        for negative times)
+        """
+        delays = list(delays)
+
+        async def send():
+            name = len(self.started)
+            self.started.append(name)
+            delay = delays.pop(0)
+            await asyncio.sleep(abs(delay))
+            if delay < 0:
+                raise ValueError(name)
+            return name
+        return send
+
+    def test_delay(self):
+        """
+        Delay is the learned latency percentile, once known
+        """
+        policy = HedgePolicy(min_samples=10, percentile=0.9)
+        self.assertIsNone(policy.delay('host'))
+        for latency in range(1, 11):
+            policy.record('host', latency / 100.0)
+        self.assertEqual(policy.delay('host'), 0.1)
+
+    async def test_fast(self):
+        """
+        Calls faster than the delay are not hedged
+        """
+        self.assertEqual(await hedged('host', self.attempts(0),
+                                      self.policy), 0)
+        self.assertEqual(self.started, [0])
+
+    async def test_hedge_wins(self):
+        """
+        A slow first attempt is hedged, and the faster answer wins
+        """
+        self.assertEqual(await hedged('host', self.attempts(1, 0),
+                                      self.policy), 1)
+        self.assertEqual(self.policy.hedges, 1)
+
+    async def test_failure(self):
+        """
+        A failed attempt doesn't beat one that succeeds
+        """
+        self.assertEqual(await hedged(
+            'host', self.attempts(-0.02, 0.05), self.policy), 1)
+        self.started = []
+        with self.assertRaises(ValueError) as context:
+            await hedged('host', self.attempts(-0.05, -0.01), self.policy)
+        self.assertEqual(context.exception.args, (0, ))
+
+    async def test_budget(self):
+        """
+        Hedges stay within budget
+        """
+        self.policy.burst = 10
+        self.policy.budget = 0.5
+        for _ in range(4):
+            await hedged('host', self.attempts(0.05, 0), self.policy)
+        self.assertEqual(self.policy.hedges, 2)
+
+    async def test_post_grade(self):
+        """
+        post_grade hedges when asked to
+        """
+        breakers.reset()
+        passback_limits.reset()
+        hedge_policy.reset()
+        for _ in range(hedge_policy.min_samples):
+            hedge_policy.record('example.edu', 0.01)
+        # Budget saved up from earlier calls
+        for _ in range(int(1 / hedge_policy.budget)):
+            hedge_policy.earn('example.edu')
+        delays = [1, 0]
+
+        async def handler(request):
+            # pylint: disable=unused-argument
+            await asyncio.sleep(delays.pop(0))
+            return 200, SUCCESS
+
+        previous = set_transport(InMemoryTransport(handler))
+        try:
+            lti = SessionLTI({
+                'oauth_consumer_key': '__consumer_key__',
+                'lis_result_sourcedid': 'sourcedid',
+                'lis_outcome_service_url': 'https://example.edu/grade',
+            })
+            self.assertTrue(await asyncio.wait_for(
+                lti.post_grade(0.5, hedge=True), 0.5))
+            self.assertEqual(hedge_policy.hedges, 1)
+        finally:
+            set_transport(previous)
+            hedge_policy.reset()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Import-time regression tests for aiolti
+"""
+import os
+import subprocess
+import sys
+import unittest
+
+# Modules that must only be loaded on first use, not at import time
+LAZY_MODULES = (
+    'oauth2',
+    'httplib2',
+    'six',
+    'xml.etree.ElementTree',
+    'aiolti.oauth',
+)
+
+# Generous budget (in microseconds) for aiolti's own import cost;
+# override with AIOLTI_IMPORT_BUDGET_US
+IMPORT_BUDGET_US = int(os.environ.get('AIOLTI_IMPORT_BUDGET_US', 50000))
+
+
+def import_times(statement):
+    """
+    Run statement under ``python -X importtime`` in a fresh interpreter
+
+    :param statement: python code to run
+    :return: dict mapping module name to (self, cumulative) microseconds
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    times = dict()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # header line
+        times[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+    return times
+
+
+class TestImportTime(unittest.TestCase):
+    """
+    Tests for import-time cost
+    """
+
+    def test_quart_import_is_lazy(self):
+        """
+        Importing aiolti.quart doesn't load the outbound HTTP, XML
+        or OAuth signing stacks.
+        """
+        times = import_times('import aiolti.quart')
+        self.assertIn('aiolti.common', times)
+        for module in LAZY_MODULES:
+            self.assertNotIn(module, times)
+
+    def test_common_import_budget(self):
+        """
+        aiolti.common, including everything it alone pulls in, stays
+        within budget.
+        """
+        times = import_times('import asyncio, logging, json; '
+                             'import aiolti.common')
+        self.assertLess(times['aiolti.common'][1], IMPORT_BUDGET_US)
+
+    def test_lazy_names_resolve(self):
+        """
+        Lazily exported classes are still reachable from aiolti.common.
+        """
+        times = import_times('import aiolti.common as c; c.LTIOAuthServer')
+        self.assertIn('aiolti.oauth', times)
+        self.assertIn('oauth2', times)
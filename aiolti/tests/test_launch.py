@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Test aiolti/launch.py module
+"""
+import unittest
+
+from aiolti.common import LTIException, verify_request_common
+from aiolti.launch import LaunchBuilder, launch_form
+from aiolti.signer import get_signer
+
+
+class TestLaunchBuilder(unittest.TestCase):
+    """
+    Tests for consumer-side launches
+    """
+    consumers = {
+        "__consumer_key__": {"secret": "__lti_secret__"}
+    }
+
+    def setUp(self):
+        self.builder = LaunchBuilder('__consumer_key__', '__lti_secret__')
+
+    def verify(self, url, params):
+        """
+        Check launch with aiolti's own (tool side) verification
+        """
+        self.assertTrue(verify_request_common(
+            self.consumers, url, 'POST', dict(), dict(params)))
+
+    def test_params(self):
+        """
+        Launch parameters are signed with the cached consumer signer
+        """
+        self.assertIs(self.builder.signer,
+                      get_signer('__consumer_key__', '__lti_secret__'))
+        url = 'https://tool.example.com/launch?course=1'
+        params = self.builder.params(url, {
+            'resource_link_id': u'link-1',
+            'user_id': u'é',
+            'roles': u'Learner',
+        })
+        self.assertEqual(params['lti_message_type'],
+                         u'basic-lti-launch-request')
+        self.assertEqual(params['lti_version'], u'LTI-1p0')
+        self.verify(url, params)
+
+        with self.assertRaises(LTIException):
+            self.builder.params(url, {'user_id': u'alice'})
+
+    def test_batch(self):
+        """
+        Batch launches share a timestamp and are each validly signed
+        """
+        launches = [
+            ('https://tool.example.com/launch',
+             {'resource_link_id': u'link-{}'.format(index)})
+            for index in range(20)]
+        launches.append(('https://Tool.example.com:443/other?a=b&c=%7E',
+                         {'resource_link_id': u'x', 'roles': u'Instructor'}))
+        signed = self.builder.batch(
+            launches, common={'user_id': u'alice', 'roles': u'Learner'})
+        self.assertEqual(len(signed), 21)
+        self.assertEqual(len({params['oauth_nonce'] for params in signed}),
+                         21)
+        self.assertEqual(len({params['oauth_timestamp']
+                              for params in signed}), 1)
+        self.assertEqual(signed[3]['resource_link_id'], u'link-3')
+        self.assertEqual(signed[-1]['roles'], u'Instructor')
+        for (url, _), params in zip(launches, signed):
+            expected = self.builder.signer.signature(
+                'POST', url, [(key, value) for key, value in params.items()
+                              if key != 'oauth_signature'])
+            self.assertEqual(params['oauth_signature'], expected)
+        self.verify(launches[0][0], signed[0])
+        self.verify(launches[19][0], signed[19])
+
+        with self.assertRaises(LTIException):
+            self.builder.batch([('https://tool.example.com/launch', dict())])
+
+    def test_forms(self):
+        """
+        Forms carry escaped signed parameters
+        """
+        html = self.builder.form('https://tool.example.com/launch?a=1&b=2', {
+            'resource_link_id': u'link-1',
+            'resource_link_title': u'"Quiz" <1>',
+        }, target='toolFrame')
+        self.assertTrue(html.startswith(
+            u'<form action="https://tool.example.com/launch?a=1&amp;b=2" '
+            u'method="post" id="ltiLaunchForm" '))
+        self.assertIn(u' target="toolFrame"', html)
+        self.assertIn(u'value="&quot;Quiz&quot; &lt;1&gt;"', html)
+        self.assertIn(u'name="oauth_signature"', html)
+        self.assertTrue(html.endswith(
+            u'<script>document.getElementById("ltiLaunchForm").submit();'
+            u'</script>'))
+
+        forms = self.builder.batch_forms(
+            [('https://tool.example.com/launch', {'resource_link_id': u'a'}),
+             ('https://tool.example.com/launch', {'resource_link_id': u'b'})],
+            common={'user_id': u'alice'})
+        self.assertEqual(len(forms), 2)
+        self.assertIn(u'id="ltiLaunchForm-1"', forms[1])
+        self.assertNotIn(u'<script>', forms[1])
+        self.assertIn(u'value="b"', forms[1])
+
+        self.assertIn(u'<button type="submit">Go</button></form>', launch_form(
+            'https://tool.example.com/launch', dict(), auto_submit=False,
+            submit_label=u'Go'))
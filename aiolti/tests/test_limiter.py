@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Test aiolti/limiter.py module
+"""
+import asyncio
+import unittest
+
+from aiolti.breaker import breakers
+from aiolti.common import (
+    LTIPostMessageTimeout,
+    Timeout,
+    post_message,
+    post_message2,
+)
+from aiolti.limiter import AdaptiveLimit, concurrency_limits, passback_limits
+from aiolti.scheduler import BULK, INTERACTIVE
+from aiolti.tests.util import FakeClock
+from aiolti.transport import InMemoryTransport, set_transport
+
+
+class TestAdaptiveLimit(unittest.IsolatedAsyncioTestCase):
+    """
+    Tests for AdaptiveLimit
+    """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limit = AdaptiveLimit(initial=2, max_limit=8, clock=self.clock)
+
+    async def test_additive_increase(self):
+        """
+        Fast successful calls raise the limit by about one per window
+        """
+        for _ in range(7):
+            await self.limit.acquire()
+            self.limit.release(0.1)
+        self.assertEqual(int(self.limit.limit), 4)
+        for _ in range(100):
+            await self.limit.acquire()
+            self.limit.release(0.1)
+        self.assertEqual(self.limit.limit, 8)
+
+    async def test_multiplicative_decrease(self):
+        """
+        Failures and slow calls halve the limit, once per latency
+        """
+        self.limit.limit = 8.0
+        await self.limit.acquire()
+        self.limit.release(0.1)
+        await self.limit.acquire()
+        self.limit.release(0.1, success=False)
+        self.assertEqual(self.limit.limit, 4)
+        # Another failure right away is from the same episode
+        await self.limit.acquire()
+        self.limit.release(0.1, success=False)
+        self.assertEqual(self.limit.limit, 4)
+
+        self.clock.now += 1
+        await self.limit.acquire()
+        self.limit.release(1.0)
+        self.assertEqual(self.limit.limit, 2)
+
+        self.clock.now += 1
+        for _ in range(3):
+            await self.limit.acquire()
+            self.limit.release(0.1, success=False)
+            self.clock.now += 1
+        self.assertEqual(self.limit.limit, 1)
+
+    async def test_waiters(self):
+        """
+        Calls beyond the limit wait for a slot
+        """
+        await self.limit.acquire()
+        await self.limit.acquire()
+        waiter = asyncio.ensure_future(self.limit.acquire())
+        cancelled = asyncio.ensure_future(self.limit.acquire())
+        await asyncio.sleep(0)
+        self.assertFalse(waiter.done())
+        cancelled.cancel()
+        self.limit.release()
+        await waiter
+        self.assertEqual(self.limit.in_flight, 2)
+        # pylint: disable=protected-access
+        self.assertEqual(len(self.limit._waiters), 0)
+
+
+class TestPassbackLimits(unittest.IsolatedAsyncioTestCase):
+    """
+    Passback goes through per-host limits
+    """
+
+    def setUp(self):
+        breakers.reset()
+        passback_limits.reset()
+
+    async def test_limits_exposed(self):
+        """
+        Limits of hosts passed back to are visible
+        """
+        in_flight = []
+
+        async def handler(request):
+            # pylint: disable=unused-argument
+            in_flight.append(concurrency_limits()['example.edu'][1])
+            return 200, u''
+
+        consumers = {"__consumer_key__": {"secret": "__lti_secret__"}}
+        previous = set_transport(InMemoryTransport(handler))
+        try:
+            for _ in range(3):
+                await post_message2(consumers, '__consumer_key__',
+                                    'https://example.edu/grade_handler',
+                                    u'{}')
+        finally:
+            set_transport(previous)
+        self.assertEqual(in_flight, [1, 1, 1])
+        limit, current = concurrency_limits()['example.edu']
+        self.assertGreaterEqual(limit, 4)
+        self.assertEqual(current, 0)
+
+    async def test_lanes(self):
+        """
+        An interactive call jumps a bulk backlog waiting for the same
+        host's slots
+        """
+        done = []
+
+        async def handler(request):
+            await asyncio.sleep(0.001)
+            done.append(request.body)
+            return 200, b'<imsx_codeMajor>success</imsx_codeMajor>'
+
+        consumers = {"__consumer_key__": {"secret": "__lti_secret__"}}
+        url = 'https://example.edu/grade_handler'
+        previous = set_transport(InMemoryTransport(handler))
+        try:
+            calls = [asyncio.ensure_future(post_message(
+                consumers, '__consumer_key__', url, u'<bulk/>', lane=BULK))
+                for _ in range(200)]
+            await asyncio.sleep(0)
+            calls.append(asyncio.ensure_future(post_message(
+                consumers, '__consumer_key__', url, u'<interactive/>',
+                lane=INTERACTIVE)))
+            self.assertTrue(all(await asyncio.gather(*calls)))
+        finally:
+            set_transport(previous)
+        self.assertLess(done.index(b'<interactive/>'), 10)
+
+    async def test_unknown_lane(self):
+        """
+        An unknown lane is refused before the host's breaker and limit
+        are involved
+        """
+        breakers.configure(failure_threshold=1)
+        try:
+            with self.assertRaises(ValueError):
+                await post_message(
+                    {"__consumer_key__": {"secret": "__lti_secret__"}},
+                    '__consumer_key__', 'https://example.edu/grade_handler',
+                    u'<x/>', lane='urgent')
+            self.assertEqual(breakers.get('example.edu').failures, 0)
+            self.assertEqual(concurrency_limits(), dict())
+        finally:
+            breakers.configure()
+
+    async def test_total_timeout_while_waiting(self):
+        """
+        The total timeout covers the wait for a host's slot, which does
+        not count against the host
+        """
+        release = asyncio.Event()
+
+        async def handler(request):
+            # pylint: disable=unused-argument
+            await release.wait()
+            return 200, b'<imsx_codeMajor>success</imsx_codeMajor>'
+
+        consumers = {"__consumer_key__": {"secret": "__lti_secret__"}}
+        url = 'https://example.edu/grade_handler'
+        previous = set_transport(InMemoryTransport(handler))
+        try:
+            busy = [asyncio.ensure_future(post_message(
+                consumers, '__consumer_key__', url, u'<x/>'))
+                for _ in range(4)]
+            await asyncio.sleep(0)
+            started = asyncio.get_running_loop().time()
+            with self.assertRaises(LTIPostMessageTimeout):
+                await post_message(consumers, '__consumer_key__', url,
+                                   u'<x/>', timeout=Timeout(total=0.2))
+            self.assertLess(asyncio.get_running_loop().time() - started, 0.5)
+            self.assertEqual(concurrency_limits()['example.edu'], (4, 4))
+            self.assertEqual(breakers.get('example.edu').failures, 0)
+            release.set()
+            self.assertTrue(all(await asyncio.gather(*busy)))
+        finally:
+            set_transport(previous)
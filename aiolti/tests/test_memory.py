@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Memory regression tests for the launch and passback paths
+
+Run with AIOLTI_MEMORY_SUITE=1 (tracing makes requests several times
+slower). Budgets are in bytes per operation and can be overridden:
+
+- AIOLTI_MEMORY_OPERATIONS: operations measured per path (2000)
+- AIOLTI_MEMORY_LAUNCH_BUDGET: peak allocation per launch
+- AIOLTI_MEMORY_PASSBACK_BUDGET: peak allocation per post_grade
+- AIOLTI_MEMORY_RETAINED_BUDGET: memory still held after the run,
+  beyond a fixed allowance for one-off allocations
+"""
+import asyncio
+import gc
+import os
+import sys
+import tracemalloc
+import unittest
+
+from aiolti.tests import test_quart
+from aiolti.tests.test_quart_app import app, app_exception
+from aiolti.transport import InMemoryTransport, set_transport
+
+MEMORY_SUITE = bool(os.environ.get('AIOLTI_MEMORY_SUITE'))
+OPERATIONS = int(os.environ.get('AIOLTI_MEMORY_OPERATIONS', 2000))
+WARMUP = 200
+
+# Peak allocations include the test client's own request handling
+LAUNCH_BUDGET = int(os.environ.get('AIOLTI_MEMORY_LAUNCH_BUDGET', 512 * 1024))
+PASSBACK_BUDGET = int(os.environ.get('AIOLTI_MEMORY_PASSBACK_BUDGET',
+                                     96 * 1024))
+RETAINED_BUDGET = int(os.environ.get('AIOLTI_MEMORY_RETAINED_BUDGET', 16))
+# Lazily created objects, caches filled on first use, cookie jar etc.
+RETAINED_ALLOWANCE = 64 * 1024
+
+# Distinct learners launched into the same context
+LEARNERS = 50
+
+_IGNORE = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+async def measure(operation, count):
+    """
+    Run operation count times under tracemalloc, after a warm-up that
+    fills caches and bounded buffers
+
+    :param operation: coroutine function taking the iteration number
+    :param count: number of measured operations
+    :return: (peak bytes allocated per operation, bytes retained,
+        largest retained differences by line)
+    """
+    for index in range(WARMUP):
+        await operation(index)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        allocated = 0
+        for index in range(count):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            await operation(index)
+            allocated += tracemalloc.get_traced_memory()[1] - current
+        gc.collect()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    growth = after.filter_traces(_IGNORE).compare_to(
+        before.filter_traces(_IGNORE), 'lineno')
+    retained = sum(stat.size_diff for stat in growth)
+    return allocated / count, retained, growth[:10]
+
+
+@unittest.skipUnless(MEMORY_SUITE, 'set AIOLTI_MEMORY_SUITE=1 to run')
+class TestMemory(unittest.IsolatedAsyncioTestCase):
+    """
+    Memory budgets for launches through ``@lti`` and for passback
+    """
+
+    consumers = test_quart.TestQuart.consumers
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SERVER_NAME'] = 'localhost'
+        app.config['AIOLTI_CONFIG'] = {'consumers': self.consumers}
+        app_exception.reset()
+        self.app_client = app.test_client()
+        self.launches = [
+            test_quart.TestQuart.generate_launch_request(
+                self.consumers, 'http://localhost/initial?',
+                add_params={'user_id': u'learner{}'.format(index)})
+            for index in range(LEARNERS)]
+
+        async def handler(request):
+            # pylint: disable=unused-argument
+            return 200, test_quart.TestQuart.expected_response
+
+        self.previous_transport = set_transport(InMemoryTransport(handler))
+
+    async def asyncSetUp(self):
+        # Debug mode keeps a traceback for every callback and task
+        asyncio.get_running_loop().set_debug(False)
+
+    def tearDown(self):
+        set_transport(self.previous_transport)
+
+    def check_budget(self, name, results, budget):
+        """
+        Report results, and fail if over budget
+        """
+        allocated, retained, growth = results
+        sys.stderr.write(
+            '\n{}: {:.0f} bytes allocated/op, {} bytes retained '
+            '({:.1f}/op, {} ops)\n'.format(name, allocated, retained,
+                                           retained / OPERATIONS,
+                                           OPERATIONS))
+        self.assertLessEqual(
+            allocated, budget,
+            '{} allocates {:.0f} bytes/op'.format(name, allocated))
+        per_op = max(0, retained - RETAINED_ALLOWANCE) / OPERATIONS
+        self.assertLessEqual(
+            per_op, RETAINED_BUDGET,
+            '{} retains {:.1f} bytes/op; largest growth:\n{}'.format(
+                name, per_op, '\n'.join(str(stat) for stat in growth)))
+
+    async def test_launch(self):
+        """
+        Launches through ``@lti`` stay within budget
+        """
+        async def launch(index):
+            ret = await self.app_client.get(
+                self.launches[index % LEARNERS])
+            self.assertEqual(ret.status_code, 200)
+
+        results = await measure(launch, OPERATIONS)
+        self.assertFalse(app_exception.get())
+        self.check_budget('launch', results, LAUNCH_BUDGET)
+
+    async def test_post_grade(self):
+        """
+        post_grade calls against a local stub stay within budget
+        """
+        await self.app_client.get(self.launches[0])
+
+        async def post_grade(index):
+            # pylint: disable=unused-argument
+            ret = await self.app_client.get('/post_grade/1.0')
+            self.assertEqual(await ret.get_data(), b'grade=True')
+
+        results = await measure(post_grade, OPERATIONS)
+        self.check_budget('post_grade', results, PASSBACK_BUDGET)
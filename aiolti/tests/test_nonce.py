@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Test aiolti/nonce.py module
+"""
+import multiprocessing
+import os
+import time
+import unittest
+
+from aiolti.nonce import MemoryNonceStore, SharedMemoryNonceStore
+from aiolti.tests.util import FakeClock
+
+
+class TestMemoryNonceStore(unittest.TestCase):
+    """
+    Tests for MemoryNonceStore
+    """
+
+    def test_replay(self):
+        """
+        A nonce is accepted once per consumer
+        """
+        clock = FakeClock()
+        clock.now = 1000.0
+        store = MemoryNonceStore(clock=clock)
+        self.assertFalse(store.seen('key', 'nonce'))
+        self.assertEqual(len(store), 0)
+        self.assertTrue(store.check_and_add('key', 'nonce', 1000))
+        self.assertTrue(store.seen('key', 'nonce'))
+        self.assertFalse(store.check_and_add('key', 'nonce', 1000))
+        self.assertFalse(store.check_and_add('key', 'nonce', 1100))
+        self.assertTrue(store.check_and_add('other', 'nonce', 1000))
+        self.assertEqual(len(store), 2)
+
+    def test_expiry(self):
+        """
+        Buckets older than the ttl are dropped
+        """
+        clock = FakeClock()
+        clock.now = 1000.0
+        store = MemoryNonceStore(ttl=120, bucket_seconds=60, clock=clock)
+        store.check_and_add('key', 'old', 1000)
+        clock.now += 300
+        store.check_and_add('key', 'new', 1300)
+        self.assertEqual(len(store), 1)
+        self.assertTrue(store.check_and_add('key', 'old', 1300))
+
+
+def _add_nonces(name, nonces, timestamp, results):
+    """
+    Worker process: check nonces against the shared store
+    """
+    store = SharedMemoryNonceStore(name, slots=1024, stripes=8)
+    for nonce in nonces:
+        results.put((nonce, store.check_and_add('key', nonce, timestamp)))
+    store.close()
+
+
+class TestSharedMemoryNonceStore(unittest.TestCase):
+    """
+    Tests for SharedMemoryNonceStore
+    """
+
+    def setUp(self):
+        self.name = 'aiolti-test-{}'.format(os.getpid())
+        self.clock = FakeClock()
+        self.clock.now = 1000.0
+        self.store = SharedMemoryNonceStore(
+            self.name, slots=1024, stripes=8, clock=self.clock)
+
+    def tearDown(self):
+        self.store.close()
+        self.store.unlink()
+
+    def test_replay(self):
+        """
+        A nonce is accepted once per consumer
+        """
+        self.assertFalse(self.store.seen('key', 'nonce'))
+        self.assertTrue(self.store.check_and_add('key', 'nonce', 1000))
+        self.assertTrue(self.store.seen('key', 'nonce'))
+        self.assertFalse(self.store.check_and_add('key', 'nonce', 1000))
+        self.assertFalse(self.store.seen('other', 'nonce'))
+        self.assertTrue(self.store.check_and_add('other', 'nonce', 1000))
+
+    def test_shared(self):
+        """
+        Nonces seen by one process are replays in another
+        """
+        # The worker uses the real clock
+        self.clock.now = timestamp = int(time.time())
+        self.store.check_and_add('key', 'seen', timestamp)
+        results = multiprocessing.Queue()
+        worker = multiprocessing.Process(
+            target=_add_nonces,
+            args=(self.name, ['seen', 'fresh', 'fresh'], timestamp, results))
+        worker.start()
+        worker.join(10)
+        self.assertEqual([results.get(timeout=1) for _ in range(3)],
+                         [('seen', False), ('fresh', True),
+                          ('fresh', False)])
+        self.assertFalse(self.store.check_and_add('key', 'fresh', timestamp))
+
+    def test_expiry(self):
+        """
+        Slots of expired nonces are reused
+        """
+        for nonce in range(1024):
+            self.store.check_and_add('key', str(nonce), 1000)
+        self.clock.now += 900
+        self.assertTrue(self.store.check_and_add('key', '0', 1900))
+        self.assertFalse(self.store.check_and_add('key', '0', 1900))
+
+    def test_full_stripe(self):
+        """
+        A full stripe evicts rather than failing
+        """
+        with self.assertLogs('aiolti.nonce', 'WARNING'):
+            for nonce in range(2048):
+                self.assertTrue(self.store.check_and_add(
+                    'key', str(nonce), 1000))
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Test aiolti/outcomes.py module
+"""
+import unittest
+
+from aiolti.common import (
+    LTIException,
+    LTIOutcomeException,
+    generate_request_xml,
+    post_message,
+    post_message2,
+)
+from aiolti.nonce import MemoryNonceStore
+from aiolti.outcomes import (
+    READ_RESULT,
+    REPLACE_RESULT,
+    OutcomeReceiver,
+    PoxParser,
+    response_xml,
+)
+from aiolti.signer import get_signer
+from aiolti.transport import InMemoryTransport, set_transport
+
+URL = 'https://lms.example.com/outcomes?course=1'
+
+
+class TestPoxParser(unittest.TestCase):
+    """
+    Tests for incremental envelope parsing
+    """
+
+    def parse(self, xml, chunk_size=7, **limits):
+        """
+        Feed xml in small chunks
+        """
+        parser = PoxParser(**limits)
+        data = xml.encode('utf-8')
+        for start in range(0, len(data), chunk_size):
+            parser.feed(data[start:start + chunk_size])
+        return parser.close(), parser.operation
+
+    def test_fields(self):
+        """
+        Fields and operation are read from chunked input
+        """
+        fields, operation = self.parse(generate_request_xml(
+            u'msg-1', 'replaceResult', u'source <1>', 0.5))
+        self.assertEqual(operation, u'replaceResult')
+        self.assertEqual(fields, {
+            'message_identifier': u'msg-1',
+            'sourcedid': u'source <1>',
+            'score': u'0.5',
+            'language': u'en',
+        })
+
+    def test_limits(self):
+        """
+        Malformed, oversized and DTD-bearing envelopes are rejected
+        """
+        xml = generate_request_xml(u'msg-1', 'readResult', u'source', None)
+        with self.assertRaises(LTIOutcomeException):
+            self.parse(xml[:-10])
+        with self.assertRaises(LTIOutcomeException):
+            self.parse(xml, max_depth=4)
+        with self.assertRaises(LTIOutcomeException):
+            self.parse(xml, max_elements=5)
+        with self.assertRaises(LTIOutcomeException):
+            self.parse(xml, max_text_size=3)
+        with self.assertRaises(LTIOutcomeException):
+            self.parse(u'<?xml version="1.0"?><!DOCTYPE x [<!ENTITY a "b">]>'
+                       u'<x>&a;</x>', chunk_size=3)
+        with self.assertRaises(LTIOutcomeException):
+            self.parse(u'<imsx_POXEnvelopeRequest/>')
+
+
+class TestOutcomeReceiver(unittest.IsolatedAsyncioTestCase):
+    """
+    Tests for outcome callbacks, sent with aiolti's own passback
+    """
+    consumers = {
+        "__consumer_key__": {"secret": "__lti_secret__"}
+    }
+
+    def setUp(self):
+        self.scores = dict()
+        self.received = []
+        self.receiver = OutcomeReceiver(self.consumers, self.handler,
+                                        nonce_store=MemoryNonceStore())
+        self.responses = []
+        self.previous = set_transport(InMemoryTransport(self.transport))
+
+    def tearDown(self):
+        set_transport(self.previous)
+
+    async def handler(self, request):
+        """
+        Outcome handler keeping scores in a dict
+        """
+        self.received.append(request)
+        if request.sourcedid == u'locked':
+            raise LTIException('Gradebook is locked')
+        if request.operation == REPLACE_RESULT:
+            self.scores[request.sourcedid] = request.score
+        elif request.operation == READ_RESULT:
+            return self.scores.get(request.sourcedid)
+        else:
+            self.scores.pop(request.sourcedid, None)
+        return None
+
+    async def transport(self, request):
+        """
+        Hand passback requests to the receiver
+        """
+        status, xml = await self.receiver.receive(
+            request.url, request.method, request.headers, request.body)
+        self.responses.append(xml)
+        return status, xml.encode('utf-8')
+
+    async def test_operations(self):
+        """
+        replaceResult, readResult and deleteResult reach the handler
+        """
+        self.assertTrue(await post_message(
+            self.consumers, '__consumer_key__', URL,
+            generate_request_xml(u'msg-1', 'replaceResult', u'src', 0.75)))
+        self.assertEqual(self.scores, {u'src': 0.75})
+        request = self.received[0]
+        self.assertEqual(request.consumer_key, '__consumer_key__')
+        self.assertEqual(request.message_identifier, u'msg-1')
+        self.assertIn(u'<imsx_messageRefIdentifier>msg-1<', self.responses[0])
+        self.assertIn(u'<imsx_operationRefIdentifier>replaceResult<',
+                      self.responses[0])
+
+        self.assertTrue(await post_message(
+            self.consumers, '__consumer_key__', URL,
+            generate_request_xml(u'msg-2', 'readResult', u'src', None)))
+        self.assertIn(u'<textString>0.75</textString>', self.responses[1])
+
+        self.assertTrue(await post_message2(
+            self.consumers, '__consumer_key__', URL,
+            generate_request_xml(u'msg-3', 'deleteResult', u'src', None)))
+        self.assertEqual(self.scores, dict())
+
+    async def test_failures(self):
+        """
+        Invalid scores, handler errors and unknown operations are
+        answered with a failure envelope
+        """
+        self.assertFalse(await post_message(
+            self.consumers, '__consumer_key__', URL,
+            generate_request_xml(u'msg-1', 'replaceResult', u'src', 1.5)))
+        self.assertFalse(await post_message(
+            self.consumers, '__consumer_key__', URL,
+            generate_request_xml(u'msg-2', 'replaceResult', u'locked', 0.5)))
+        self.assertIn(u'Gradebook is locked', self.responses[1])
+        self.assertFalse(await post_message(
+            self.consumers, '__consumer_key__', URL,
+            generate_request_xml(u'msg-3', 'readMembership', u'src', None)))
+        self.assertIn(u'<imsx_codeMajor>unsupported<', self.responses[2])
+        self.assertEqual(len(self.received), 1)
+
+    async def test_verification(self):
+        """
+        Requests with a bad signature, body hash or size are refused
+        before reaching the handler
+        """
+        body = generate_request_xml(
+            u'msg-1', 'replaceResult', u'src', 0.5).encode('utf-8')
+        headers = get_signer('__consumer_key__', '__lti_secret__') \
+            .sign_request('POST', URL, body)
+        status, _ = await self.receiver.receive(URL, 'POST', headers, body)
+        self.assertEqual(status, 200)
+
+        # Replay
+        status, _ = await self.receiver.receive(URL, 'POST', headers, body)
+        self.assertEqual(status, 401)
+
+        headers = get_signer('__consumer_key__', '__lti_secret__') \
+            .sign_request('POST', URL, body)
+        status, _ = await self.receiver.receive(
+            URL, 'POST', headers, body.replace(b'0.5', b'1.0'))
+        self.assertEqual(status, 401)
+        # The tampered copy did not use up the genuine request's nonce
+        status, _ = await self.receiver.receive(URL, 'POST', headers, body)
+        self.assertEqual(status, 200)
+
+        headers = get_signer('__consumer_key__', '__wrong_secret__') \
+            .sign_request('POST', URL, body)
+        status, _ = await self.receiver.receive(URL, 'POST', headers, body)
+        self.assertEqual(status, 401)
+        self.assertEqual(len(self.receiver.nonce_store), 2)
+
+        status, _ = await self.receiver.receive(URL, 'POST', dict(), body)
+        self.assertEqual(status, 401)
+
+        # Malformed, but authentic
+        body = body[:-20]
+        headers = get_signer('__consumer_key__', '__lti_secret__') \
+            .sign_request('POST', URL, body)
+        status, _ = await self.receiver.receive(URL, 'POST', headers, body)
+        self.assertEqual(status, 400)
+
+        self.receiver.max_body_size = 100
+        headers = get_signer('__consumer_key__', '__lti_secret__') \
+            .sign_request('POST', URL, body)
+
+        async def chunks():
+            yield body[:80]
+            yield body[80:]
+        status, _ = await self.receiver.receive(URL, 'POST', headers,
+                                                chunks())
+        self.assertEqual(status, 413)
+        self.assertEqual(len(self.received), 2)
+
+    async def test_asgi(self):
+        """
+        Receiver as an ASGI application, with a streamed body
+        """
+        url = 'http://lms.example.com/outcomes?'
+        body = generate_request_xml(
+            u'msg-1', 'replaceResult', u'src', 0.25).encode('utf-8')
+        headers = get_signer('__consumer_key__', '__lti_secret__') \
+            .sign_request('POST', url, body)
+        scope = {
+            'type': 'http', 'method': 'POST', 'scheme': 'http',
+            'path': '/outcomes', 'query_string': b'',
+            'headers': [(b'host', b'lms.example.com'),
+                        (b'authorization',
+                         headers['Authorization'].encode('latin-1'))],
+        }
+        messages = [
+            {'type': 'http.request', 'body': body[:50], 'more_body': True},
+            {'type': 'http.request', 'body': body[50:], 'more_body': False},
+        ]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await self.receiver(scope, receive, send)
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn(b'<imsx_codeMajor>success</imsx_codeMajor>',
+                      sent[1]['body'])
+        self.assertEqual(self.scores, {u'src': 0.25})
+
+        sent = []
+        await self.receiver(dict(scope, method='GET'), receive, send)
+        self.assertEqual(sent[0]['status'], 405)
+
+    def test_response_xml(self):
+        """
+        Response values are escaped
+        """
+        xml = response_xml(u'failure', u'<bad> & worse', u'id"1')
+        self.assertIn(u'<imsx_description>&lt;bad&gt; &amp; worse<', xml)
+        self.assertIn(u'<imsx_messageRefIdentifier>id"1<', xml)
+        self.assertIn(u'<imsx_severity>error</imsx_severity>', xml)
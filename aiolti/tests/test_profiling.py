@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Test aiolti/profiling.py module
+"""
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+from aiolti.profiling import RequestProfiler
+from aiolti.tests import test_quart
+from aiolti.tests.test_quart_app import app, app_exception
+from aiolti.tests.util import FakeClock
+
+
+class TestRequestProfiler(unittest.TestCase):
+    """
+    Tests for sampling and threshold decisions
+    """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_threshold(self):
+        """
+        Only requests slower than the threshold are written
+        """
+        clock = FakeClock()
+        profiler = RequestProfiler(self.dir, threshold=0.5, clock=clock)
+        state = profiler.begin()
+        clock.now = 0.2
+        self.assertIsNone(profiler.end(state, '/fast'))
+
+        state = profiler.begin()
+        clock.now = 0.9
+        path = profiler.end(state, '/grade/<float:g>', 'key 1', 'initial')
+        self.assertEqual(profiler.dumps, 1)
+        self.assertEqual(os.path.dirname(path), self.dir)
+        self.assertRegex(os.path.basename(path),
+                         r'-700ms-grade_float_g-key_1-initial-\d+-1\.pstats$')
+        pstats.Stats(path)
+
+    def test_sampling(self):
+        """
+        Only the sampled fraction of requests is profiled, one at a time
+        """
+        draws = iter([0.5, 0.05, 0.0])
+        profiler = RequestProfiler(self.dir, sample_rate=0.1,
+                                   rand=lambda: next(draws))
+        self.assertIsNone(profiler.begin())
+        state = profiler.begin()
+        self.assertIsNotNone(state)
+        # Another request while one is being profiled
+        self.assertIsNone(profiler.begin())
+        self.assertIsNotNone(profiler.end(state, '/any'))
+        self.assertEqual(len(os.listdir(self.dir)), 1)
+
+
+class TestProfiledLaunch(unittest.IsolatedAsyncioTestCase):
+    """
+    Profiler hook in the lti decorator
+    """
+
+    consumers = test_quart.TestQuart.consumers
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    async def test_launch_profile(self):
+        """
+        A slow launch leaves a profile naming its route, consumer and
+        request type, with aiolti's frames in it
+        """
+        profiler = RequestProfiler(self.dir, threshold=0.0)
+        app.config['TESTING'] = True
+        app.config['SERVER_NAME'] = 'localhost'
+        app.config['AIOLTI_CONFIG'] = {'consumers': self.consumers,
+                                       'profiler': profiler}
+        app_exception.reset()
+        client = app.test_client()
+        ret = await client.get(test_quart.TestQuart.generate_launch_request(
+            self.consumers, 'http://localhost/initial?'))
+        self.assertEqual(ret.status_code, 200)
+        self.assertFalse(app_exception.get())
+
+        dumps = os.listdir(self.dir)
+        self.assertEqual(len(dumps), 1)
+        self.assertIn('-initial-__consumer_key__-initial-', dumps[0])
+        stats = pstats.Stats(os.path.join(self.dir, dumps[0]))
+        functions = {function for _, _, function in stats.stats}
+        self.assertIn('verify_request_common', functions)
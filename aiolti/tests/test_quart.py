@@ -3,6 +3,7 @@
 Test aiolti/test_quart.py module
 """
 from __future__ import absolute_import
+import asyncio
 import unittest
 
 #import httpretty
@@ -10,12 +11,25 @@ from mocket.plugins import httpretty
 import mock
 import oauthlib.oauth1
 
-from six.moves.urllib.parse import urlencode
-
-from quart.testing import QuartClient
-
-from aiolti.common import LTIException
-from aiolti.quart import LTI
+from urllib.parse import urlencode
+
+from quart.testing import QuartClient, WebsocketResponse
+
+from aiolti.common import (
+    LTIException,
+    LTIRateLimitException,
+    LTIRoleException,
+    LTITokenException,
+)
+from aiolti.context import (
+    CONTEXT_PROPERTIES,
+    CONTEXT_REF_KEY,
+    ContextRegistry,
+)
+from aiolti.nonce import MemoryNonceStore
+from aiolti.quart import LTI, LTIUnauthorizedError
+from aiolti.ratelimit import launch_limiter
+from aiolti.transport import InMemoryTransport, set_transport
 from aiolti.tests.test_quart_app import app_exception, app
 
 
@@ -69,6 +83,7 @@ edge.edx.org-i4x-StarX-StarX_DEMO-lti-40559041895b4065b2818c23b9cd9da8\
         }
         self.app_client = app.test_client()
         app_exception.reset()
+        launch_limiter.reset()
 
     @staticmethod
     def get_exception():
@@ -181,6 +196,297 @@ edge.edx.org-i4x-StarX-StarX_DEMO-lti-40559041895b4065b2818c23b9cd9da8\
         await self.app_client.get(new_url)
         self.assertFalse(self.has_exception())
 
+    async def test_access_to_oauth_resource_rate_limited(self):
+        """
+        Launches beyond the consumer's rate limit are rejected.
+        """
+        consumers = {
+            "__consumer_key__": {
+                "secret": "__lti_secret__",
+                "launch_rate_limit": {"rate": 0.01, "burst": 1},
+            }
+        }
+        app.config['AIOLTI_CONFIG'] = {'consumers': consumers}
+        url = 'http://localhost/initial?'
+
+        await self.app_client.get(self.generate_launch_request(consumers, url))
+        self.assertFalse(self.has_exception())
+
+        await self.app_client.get(self.generate_launch_request(consumers, url))
+        self.assertTrue(self.has_exception())
+        self.assertIsInstance(self.get_exception(), LTIRateLimitException)
+        self.assertGreater(self.get_exception().retry_after, 0)
+
+        # Session requests are not counted against the launch limit
+        app_exception.reset()
+        await self.app_client.get('/setup_session')
+        await self.app_client.get('/session')
+        self.assertFalse(self.has_exception())
+
+    @staticmethod
+    def generate_launch_form(url, fields):
+        """
+        Generate signed basic-lti-launch-request form body.
+        :param url: URL to sign
+        :param fields: list of (name, value) form fields
+        :return: (headers, body)
+        """
+        client = oauthlib.oauth1.Client('__consumer_key__',
+                                        client_secret='__lti_secret__',
+                                        signature_type=oauthlib.oauth1.
+                                        SIGNATURE_TYPE_BODY)
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        _, headers, body = client.sign(url, 'POST', urlencode(fields),
+                                       headers)
+        return headers, body
+
+    async def test_access_to_oauth_resource_post_form(self):
+        """
+        Form launches verify with duplicate fields kept; the form is
+        still available to the view.
+        """
+        headers, body = self.generate_launch_form(
+            'http://localhost/name', [
+                ('user_id', u'008437924c9852377e8994829aaac7a1'),
+                ('lis_person_sourcedid', u'alice'),
+                ('custom_tag', u'b'),
+                ('custom_tag', u'a'),
+            ])
+        ret = await self.app_client.post('/name', data=body, headers=headers)
+        self.assertFalse(self.has_exception())
+        self.assertEqual(await ret.get_data(), b'alice')
+
+    async def test_access_to_oauth_resource_post_form_too_large(self):
+        """
+        Form launches beyond the configured size limits are rejected.
+        """
+        app.config['AIOLTI_CONFIG'] = {'consumers': self.consumers,
+                                       'max_field_size': 64}
+        headers, body = self.generate_launch_form(
+            'http://localhost/initial', [('custom_note', u'x' * 128)])
+        await self.app_client.post('/initial', data=body, headers=headers)
+        self.assertTrue(self.has_exception())
+        self.assertEqual(self.get_exception_as_string(),
+                         'Form field too large')
+
+        app_exception.reset()
+        app.config['AIOLTI_CONFIG'] = {'consumers': self.consumers,
+                                       'max_content_length': 256}
+        headers, body = self.generate_launch_form(
+            'http://localhost/initial', [('custom_note', u'x' * 512)])
+        await self.app_client.post('/initial', data=body, headers=headers)
+        self.assertTrue(self.has_exception())
+        self.assertEqual(self.get_exception_as_string(),
+                         'Request body too large')
+
+    async def test_access_to_oauth_resource_post_form_bad_charset(self):
+        """
+        Form launches in an unknown charset are rejected, not an error.
+        """
+        headers, body = self.generate_launch_form(
+            'http://localhost/initial', [('user_id', u'alice')])
+        headers['Content-Type'] += '; charset=bogus'
+        await self.app_client.post('/initial', data=body, headers=headers)
+        self.assertTrue(self.has_exception())
+        self.assertEqual(self.get_exception_as_string(),
+                         'Invalid form encoding')
+
+    async def test_post_body_available(self):
+        """
+        The raw body of a form launch is still available to the view, and
+        large non-form bodies to session views are not size checked.
+        """
+        headers, body = self.generate_launch_form(
+            'http://localhost/body', [
+                ('lti_message_type', u'basic-lti-launch-request'),
+                ('user_id', u'alice'),
+            ])
+        ret = await self.app_client.post('/body', data=body, headers=headers)
+        self.assertFalse(self.has_exception())
+        self.assertEqual(await ret.get_data(),
+                         '{} {}'.format(8, len(body)).encode('utf-8'))
+
+        await self.app_client.get('/setup_session')
+        upload = b'x' * (128 * 1024)
+        ret = await self.app_client.post('/body', data=upload, headers={
+            'Content-Type': 'application/octet-stream',
+            'Content-Length': str(len(upload))})
+        self.assertFalse(self.has_exception())
+        self.assertEqual(await ret.get_data(),
+                         '0 {}'.format(len(upload)).encode('utf-8'))
+
+    async def test_post_large_form_in_session(self):
+        """
+        Form posts over the launch limits reach session views on 'any'
+        routes, while launches that large are still rejected there.
+        """
+        await self.app_client.get('/setup_session')
+        form = urlencode([('essay', u'x' * (70 * 1024))]).encode('utf-8')
+        for headers in ({}, {'Content-Length': str(len(form))}):
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            ret = await self.app_client.post('/body', data=form,
+                                             headers=headers)
+            self.assertFalse(self.has_exception())
+            self.assertEqual(await ret.get_data(),
+                             '1 {}'.format(len(form)).encode('utf-8'))
+
+        headers, body = self.generate_launch_form(
+            'http://localhost/body', [
+                ('lti_message_type', u'basic-lti-launch-request'),
+                ('custom_note', u'x' * (70 * 1024)),
+            ])
+        await self.app_client.post('/body', data=body, headers=headers)
+        self.assertTrue(self.has_exception())
+        self.assertEqual(self.get_exception_as_string(),
+                         'Request body too large')
+
+    async def test_repeated_launch_session_writes(self):
+        """
+        Repeating an identical launch, or closing a closed session, does
+        not re-send the session cookie.
+        """
+        url = 'http://localhost/initial?'
+        set_cookies = []
+        for _ in range(3):
+            ret = await self.app_client.get(
+                self.generate_launch_request(self.consumers, url))
+            self.assertFalse(self.has_exception())
+            set_cookies.append(len(ret.headers.getlist('Set-Cookie')))
+        self.assertEqual(set_cookies, [1, 0, 0])
+
+        # A launch with changed properties is written
+        ret = await self.app_client.get(self.generate_launch_request(
+            self.consumers, url, roles=u'Student'))
+        self.assertEqual(len(ret.headers.getlist('Set-Cookie')), 1)
+
+        set_cookies = []
+        for _ in range(2):
+            ret = await self.app_client.get('/close_session')
+            set_cookies.append(len(ret.headers.getlist('Set-Cookie')))
+        self.assertEqual(set_cookies, [1, 0])
+
+    async def test_bearer_token(self):
+        """
+        Tokens minted from an LTI session authenticate API calls
+        without the session.
+        """
+        url = 'http://localhost/initial?'
+        await self.app_client.get(self.generate_launch_request(
+            self.consumers, url, roles=u'Student'))
+        ret = await self.app_client.get('/token')
+        self.assertFalse(self.has_exception())
+        token = (await ret.get_data()).decode('ascii')
+
+        api_client = app.test_client()
+        ret = await api_client.get('/api', headers={
+            'Authorization': 'Bearer {}'.format(token)})
+        self.assertFalse(self.has_exception())
+        self.assertEqual(await ret.get_data(),
+                         b'008437924c9852377e8994829aaac7a1')
+        self.assertEqual(len(ret.headers.getlist('Set-Cookie')), 0)
+
+        await api_client.get('/api_staff', headers={
+            'Authorization': 'Bearer {}'.format(token)})
+        self.assertIsInstance(self.get_exception(), LTIRoleException)
+
+        for headers in (dict(), {'Authorization': 'Bearer x' + token}):
+            app_exception.reset()
+            await api_client.get('/api', headers=headers)
+            self.assertIsInstance(self.get_exception(), LTITokenException)
+        error = LTIUnauthorizedError(self.get_exception())
+        self.assertEqual(error.status_code, 401)
+        self.assertEqual(error.get_headers()['WWW-Authenticate'], 'Bearer')
+
+    async def test_guard_verifies_once(self):
+        """
+        Blueprint guard verifies once; role routes and nested decorated
+        helpers reuse the result.
+        """
+        await self.app_client.get('/setup_session')
+        with mock.patch.object(LTI, 'verify', autospec=True,
+                               side_effect=LTI.verify) as verify:
+            ret = await self.app_client.get('/guarded/nested')
+            self.assertFalse(self.has_exception())
+            self.assertEqual(verify.call_count, 1)
+            data = await ret.get_data()
+            self.assertEqual(data.decode('utf-8'), '')
+
+            await self.app_client.get('/guarded/any')
+            self.assertFalse(self.has_exception())
+            self.assertEqual(verify.call_count, 2)
+
+    async def test_guard_with_initial_route(self):
+        """
+        A launch verified by the guard satisfies a route requiring an
+        initial request: it is not verified (nor its nonce used) again.
+        """
+        app.config['AIOLTI_CONFIG'] = {'consumers': self.consumers,
+                                       'nonce_store': MemoryNonceStore()}
+        headers, body = self.generate_launch_form(
+            'http://localhost/guarded/launch', [
+                ('lti_message_type', u'basic-lti-launch-request'),
+                ('user_id', u'alice'),
+            ])
+        with mock.patch.object(LTI, 'verify', autospec=True,
+                               side_effect=LTI.verify) as verify:
+            ret = await self.app_client.post('/guarded/launch', data=body,
+                                             headers=headers)
+            self.assertFalse(self.has_exception())
+            self.assertEqual(verify.call_count, 1)
+        self.assertEqual(await ret.get_data(), b'alice')
+
+        # A session request is no launch, so the route still refuses it
+        await self.app_client.get('/guarded/launch')
+        self.assertTrue(self.has_exception())
+
+    async def test_guard_role(self):
+        """
+        Route-level role requirement is enforced under the guard.
+        """
+        await self.app_client.get('/setup_session')
+        await self.app_client.get('/guarded/staff')
+        self.assertIsInstance(self.get_exception(), LTIRoleException)
+
+    async def test_guard_rejects_without_session(self):
+        """
+        Guard rejects requests before the route runs.
+        """
+        await self.app_client.get('/guarded/any')
+        self.assertEqual(self.get_exception_as_string(),
+                         'Session expired or unavailable')
+
+    async def test_websocket_session(self):
+        """
+        Websocket authenticates once from the LTI session and keeps the
+        LTI object for the connection.
+        """
+        await self.app_client.get('/setup_session')
+        async with self.app_client.websocket('/ws') as test_websocket:
+            await test_websocket.send('one')
+            self.assertEqual(await test_websocket.receive(), 'Student:one')
+            await test_websocket.send('two')
+            self.assertEqual(await test_websocket.receive(), 'Student:two')
+        self.assertFalse(self.has_exception())
+
+    async def test_websocket_rejected(self):
+        """
+        Websocket without session, or with the wrong role, is rejected.
+        """
+        with self.assertRaises(WebsocketResponse):
+            async with self.app_client.websocket('/ws') as test_websocket:
+                # Let the handler reject before waiting for a message
+                await asyncio.wait([test_websocket.task], timeout=1)
+                await test_websocket.receive()
+        self.assertEqual(self.get_exception_as_string(),
+                         'Session expired or unavailable')
+
+        await self.app_client.get('/setup_session')
+        with self.assertRaises(WebsocketResponse):
+            async with self.app_client.websocket('/ws_staff') as staff_ws:
+                await asyncio.wait([staff_ws.task], timeout=1)
+                await staff_ws.receive()
+        self.assertIsInstance(self.get_exception(), LTIRoleException)
+
     async def test_access_to_oauth_resource_name_passed(self):
         """
         Check that name is returned if passed via initial request.
@@ -461,6 +767,46 @@ edge.edx.org-i4x-StarX-StarX_DEMO-lti-40559041895b4065b2818c23b9cd9da8\
         self.assertFalse(self.has_exception())
         self.assertEqual(ret.data.decode('utf-8'), "grade=False")
 
+    async def test_context_registry(self):
+        """
+        With a context registry, sessions hold a reference to the shared
+        context data, and passback still finds the outcome service.
+        """
+        urls = []
+
+        async def handler(request):
+            urls.append(request.url)
+            return 200, self.expected_response
+
+        registry = ContextRegistry()
+        app.config['AIOLTI_CONFIG'] = {'consumers': self.consumers,
+                                       'context_registry': registry}
+        url = 'http://localhost/initial?'
+        await self.app_client.get(
+            self.generate_launch_request(self.consumers, url))
+        self.assertFalse(self.has_exception())
+        self.assertEqual(len(registry), 1)
+        async with self.app_client.session_transaction() as sess:
+            self.assertIn(CONTEXT_REF_KEY, sess)
+            self.assertEqual(sess['user_id'],
+                             u'008437924c9852377e8994829aaac7a1')
+            for prop in CONTEXT_PROPERTIES:
+                self.assertNotIn(prop, sess)
+
+        previous = set_transport(InMemoryTransport(handler))
+        try:
+            ret = await self.app_client.get("/post_grade/1.0")
+        finally:
+            set_transport(previous)
+        self.assertFalse(self.has_exception())
+        self.assertEqual(await ret.get_data(), b'grade=True')
+        self.assertEqual(len(urls), 1)
+        self.assertTrue(urls[0].startswith('https://example.edu/courses/'))
+
+        await self.app_client.get('/close_session')
+        async with self.app_client.session_transaction() as sess:
+            self.assertNotIn(CONTEXT_REF_KEY, sess)
+
     @httpretty.activate
     async def test_access_to_oauth_resource_post_grade_fail(self):
         """
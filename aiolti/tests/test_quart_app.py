@@ -1,9 +1,10 @@
 """
 Test pylti/test_flask_app.py module
 """
-from quart import Quart, session
+from quart import Blueprint, Quart, request, session, websocket
 
 from aiolti.quart import lti as lti_quart
+from aiolti.quart import lti_bearer, lti_guard, lti_role, lti_websocket
 from aiolti.quart import LTIRequestError
 from aiolti.common import LTI_SESSION_KEY
 from aiolti.tests.test_common import ExceptionHandler
@@ -107,6 +108,21 @@ async def name(lti):
     return lti.name
 
 
+@app.route("/body", methods=['POST'])
+@lti_quart(request='any', app=app)
+async def body_route(lti):
+    # pylint: disable=unused-argument,
+    """
+    Access route with 'any' request, reading the request body.
+
+    :param lti: `lti` object
+    :return: size of form and of raw body
+    """
+    form = await request.form
+    data = await request.get_data()
+    return '{} {}'.format(len(form), len(data))
+
+
 @app.route("/initial_staff", methods=['GET', 'POST'])
 @lti_quart(request='initial', role='staff', app=app)
 async def initial_staff_route(lti):
@@ -206,3 +222,135 @@ async def default_lti(lti=lti_quart):
     Make sure default LTI decorator works.
     """
     return 'hi'  # pragma: no cover
+
+
+@app.websocket("/ws")
+@lti_websocket(app=app)
+async def websocket_route(lti):
+    """
+    Websocket echoing messages prefixed with the LTI user's roles.
+
+    :param lti: `lti` object
+    """
+    while True:
+        data = await websocket.receive()
+        await websocket.send("{}:{}".format(lti.role, data))
+
+
+@app.websocket("/ws_staff")
+@lti_websocket(app=app, role='staff')
+async def websocket_staff_route(lti):
+    # pylint: disable=unused-argument,
+    """
+    Websocket requiring 'staff' role.
+
+    :param lti: `lti` object
+    """
+    await websocket.send("hi")  # pragma: no cover
+
+
+@app.route("/token")
+@lti_quart(request='session', app=app)
+async def token_route(lti):
+    """
+    Mint bearer token for the LTI session.
+
+    :param lti: `lti` object
+    :return: token
+    """
+    return lti.mint_token()
+
+
+@app.route("/api")
+@lti_bearer(app=app)
+async def api_route(lti):
+    """
+    API route authenticated by bearer token.
+
+    :param lti: `lti` object
+    :return: user_id
+    """
+    return lti.user_id
+
+
+@app.route("/api_staff")
+@lti_bearer(app=app, role='staff')
+async def api_staff_route(lti):
+    # pylint: disable=unused-argument,
+    """
+    API route requiring 'staff' role.
+
+    :param lti: `lti` object
+    :return: string "hi"
+    """
+    return "hi"  # pragma: no cover
+
+
+guarded = Blueprint('guarded', __name__,  # pylint: disable=invalid-name
+                    url_prefix='/guarded')
+lti_guard(guarded, request='any')
+
+
+@lti_quart(request='session', app=app)
+async def nested_helper(lti):
+    """
+    Decorated helper called from a guarded route.
+
+    :param lti: `lti` object
+    :return: user name
+    """
+    return lti.name
+
+
+@guarded.route("/any")
+@lti_role()
+async def guarded_any(lti):
+    # pylint: disable=unused-argument,
+    """
+    Guarded route with no role requirement.
+
+    :param lti: `lti` object
+    :return: string "hi"
+    """
+    return "hi"
+
+
+@guarded.route("/staff")
+@lti_role('staff')
+async def guarded_staff(lti):
+    # pylint: disable=unused-argument,
+    """
+    Guarded route requiring 'staff' role.
+
+    :param lti: `lti` object
+    :return: string "hi"
+    """
+    return "hi"
+
+
+@guarded.route("/nested")
+@lti_role('student')
+async def guarded_nested(lti):
+    # pylint: disable=unused-argument,
+    """
+    Guarded route calling a decorated helper.
+
+    :param lti: `lti` object
+    :return: result of helper
+    """
+    return await nested_helper()
+
+
+@guarded.route("/launch", methods=['GET', 'POST'])
+@lti_quart(request='initial', app=app)
+async def guarded_launch(lti):
+    """
+    Guarded route that must be reached by a launch.
+
+    :param lti: `lti` object
+    :return: user id
+    """
+    return lti.user_id
+
+
+app.register_blueprint(guarded)
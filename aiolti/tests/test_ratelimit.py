@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Test aiolti/ratelimit.py module
+"""
+import asyncio
+import unittest
+
+from aiolti.ratelimit import (
+    TokenBucket,
+    RateLimiter,
+    LAUNCH_RATE_LIMIT_KEY,
+)
+from aiolti.tests.util import FakeClock
+
+
+class TestTokenBucket(unittest.TestCase):
+    """
+    Tests for TokenBucket
+    """
+
+    def test_consume_and_refill(self):
+        """
+        Burst is available at once, then refills at rate.
+        """
+        clock = FakeClock()
+        bucket = TokenBucket(2, burst=3, clock=clock)
+        self.assertTrue(bucket.consume())
+        self.assertTrue(bucket.consume())
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+        self.assertAlmostEqual(bucket.retry_after(), 0.5)
+
+        clock.now += 0.5
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+
+        clock.now += 100
+        self.assertEqual(bucket.retry_after(), 0)
+        self.assertEqual(bucket.tokens, 3)
+
+    def test_reserve_queues_in_order(self):
+        """
+        Reservations go into debt and report increasing delays.
+        """
+        clock = FakeClock()
+        bucket = TokenBucket(10, burst=1, clock=clock)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1)
+        self.assertAlmostEqual(bucket.reserve(), 0.2)
+
+    def test_cancelled_acquire_refunds(self):
+        """
+        A cancelled wait gives its reservation back.
+        """
+        async def cancel_waiter():
+            clock = FakeClock()
+            bucket = TokenBucket(10, burst=1, clock=clock)
+            bucket.reserve()
+            task = asyncio.ensure_future(bucket.acquire())
+            await asyncio.sleep(0)
+            self.assertAlmostEqual(bucket.tokens, -1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertAlmostEqual(bucket.tokens, 0)
+            self.assertAlmostEqual(bucket.reserve(), 0.1)
+
+        asyncio.run(cancel_waiter())
+
+    def test_invalid_settings(self):
+        """
+        Zero rate is rejected.
+        """
+        with self.assertRaises(ValueError):
+            TokenBucket(0)
+
+
+class TestRateLimiter(unittest.IsolatedAsyncioTestCase):
+    """
+    Tests for RateLimiter registry
+    """
+
+    def test_bucket_per_consumer(self):
+        """
+        Buckets are only created for consumers with limits configured.
+        """
+        consumers = {
+            "limited": {"secret": "s", LAUNCH_RATE_LIMIT_KEY: {"rate": 1}},
+            "unlimited": {"secret": "s"},
+        }
+        limiter = RateLimiter(LAUNCH_RATE_LIMIT_KEY, clock=FakeClock())
+        self.assertIsNone(limiter.bucket(consumers, "unlimited"))
+        self.assertIsNone(limiter.bucket(consumers, "unknown"))
+        bucket = limiter.bucket(consumers, "limited")
+        self.assertIs(bucket, limiter.bucket(consumers, "limited"))
+        self.assertIsNot(bucket, limiter.bucket(consumers, "limited", "host"))
+
+        consumers["limited"][LAUNCH_RATE_LIMIT_KEY] = {"rate": 2}
+        self.assertIsNot(bucket, limiter.bucket(consumers, "limited"))
+
+    async def test_acquire_delays(self):
+        """
+        acquire waits rather than failing when out of tokens.
+        """
+        bucket = TokenBucket(1000, burst=1)
+        self.assertEqual(await bucket.acquire(), 0)
+        self.assertGreater(await bucket.acquire(), 0)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Test aiolti/rotation.py module
+"""
+from datetime import datetime, timedelta, timezone
+import unittest
+
+from aiolti.rotation import SecretOrder, consumer_secrets
+
+
+class TestRotation(unittest.TestCase):
+    """
+    Tests for secret rotation
+    """
+
+    def test_consumer_secrets(self):
+        """
+        Current secret comes first; expired previous secrets are dropped
+        """
+        later = datetime.now(timezone.utc) + timedelta(days=1)
+        consumer = {
+            'secret': 'current',
+            'previous_secrets': [
+                'plain',
+                {'secret': 'dated', 'expires': later},
+                {'secret': 'iso', 'expires': later.isoformat()},
+                {'secret': 'expired', 'expires': 1000},
+            ],
+        }
+        self.assertEqual(consumer_secrets(consumer),
+                         ['current', 'plain', 'dated', 'iso'])
+        self.assertEqual(consumer_secrets({'secret': 'current'}),
+                         ['current'])
+
+    def test_expiry_utc(self):
+        """
+        Expiry datetimes without a time zone are UTC; 'Z' is accepted
+        """
+        now = datetime(2024, 1, 31, 12, 0, tzinfo=timezone.utc).timestamp()
+        consumer = {
+            'secret': 'current',
+            'previous_secrets': [
+                {'secret': 'zulu', 'expires': '2024-01-31T12:30:00Z'},
+                {'secret': 'naive', 'expires': '2024-01-31T12:30:00'},
+                {'secret': 'naive_dt',
+                 'expires': datetime(2024, 1, 31, 12, 30)},
+                {'secret': 'offset', 'expires': '2024-01-31T14:30:00+02:00'},
+                {'secret': 'gone', 'expires': '2024-01-31T11:30:00Z'},
+                {'secret': 'gone_naive', 'expires': '2024-01-31T11:30:00'},
+                {'secret': 'gone_naive_dt',
+                 'expires': datetime(2024, 1, 31, 11, 30)},
+            ],
+        }
+        self.assertEqual(consumer_secrets(consumer, now),
+                         ['current', 'zulu', 'naive', 'naive_dt', 'offset'])
+
+    def test_order(self):
+        """
+        Secrets are tried most recently successful first
+        """
+        consumer = {'secret': 'new',
+                    'previous_secrets': ['old', 'older']}
+        order = SecretOrder()
+        self.assertEqual(order.candidates('key', consumer),
+                         ['new', 'old', 'older'])
+        order.record_success('key', 'older')
+        order.record_success('key', 'old')
+        self.assertEqual(order.candidates('key', consumer),
+                         ['old', 'older', 'new'])
+        self.assertEqual(order.candidates('other', consumer),
+                         ['new', 'old', 'older'])
+
+        # Secrets that are no longer valid are not tried
+        self.assertEqual(order.candidates('key', {'secret': 'new'}),
+                         ['new'])
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Test aiolti/scheduler.py module
+"""
+import asyncio
+import unittest
+
+from aiolti.breaker import breakers
+from aiolti.common import LTIPostMessageTimeout, Timeout, post_message
+from aiolti.limiter import concurrency_limits
+from aiolti.ratelimit import PASSBACK_RATE_LIMIT_KEY, passback_limiter
+from aiolti.scheduler import (
+    BULK,
+    INTERACTIVE,
+    PassbackScheduler,
+    passback_scheduler,
+)
+from aiolti.transport import InMemoryTransport, set_transport
+
+
+class TestPassbackScheduler(unittest.IsolatedAsyncioTestCase):
+    """
+    Tests for PassbackScheduler
+    """
+
+    def setUp(self):
+        self.order = []
+        self.gate = None
+
+    def call(self, name):
+        """ Coroutine function recording when it runs """
+        async def send():
+            self.order.append(name)
+            if self.gate is not None:
+                await self.gate.wait()
+            return name
+        return send
+
+    async def fill(self, scheduler):
+        """ Occupy the scheduler's single slot until gate is set """
+        self.gate = asyncio.Event()
+        blocker = asyncio.ensure_future(
+            scheduler.run(BULK, self.call('blocker')))
+        await asyncio.sleep(0)
+        return blocker
+
+    async def test_interactive_first(self):
+        """
+        Interactive calls jump a bulk backlog
+        """
+        scheduler = PassbackScheduler(concurrency=1)
+        blocker = await self.fill(scheduler)
+        calls = [scheduler.run(BULK, self.call('b{}'.format(i)))
+                 for i in range(4)]
+        calls += [scheduler.run(INTERACTIVE, self.call('i{}'.format(i)))
+                  for i in range(2)]
+        tasks = [asyncio.ensure_future(call) for call in calls]
+        await asyncio.sleep(0)
+        self.assertEqual(scheduler.queued(BULK), 4)
+        self.assertEqual(scheduler.queued(INTERACTIVE), 2)
+
+        self.gate.set()
+        results = await asyncio.gather(blocker, *tasks)
+        self.assertEqual(results[1:], ['b0', 'b1', 'b2', 'b3', 'i0', 'i1'])
+        self.assertEqual(self.order,
+                         ['blocker', 'i0', 'i1', 'b0', 'b1', 'b2', 'b3'])
+        self.assertEqual(scheduler.active, 0)
+
+    async def test_no_starvation(self):
+        """
+        Bulk calls get their share while interactive calls are waiting
+        """
+        scheduler = PassbackScheduler(concurrency=1)
+        blocker = await self.fill(scheduler)
+        tasks = [asyncio.ensure_future(scheduler.run(lane, self.call(lane)))
+                 for lane in [BULK] * 5 + [INTERACTIVE] * 20]
+        await asyncio.sleep(0)
+        self.gate.set()
+        await asyncio.gather(blocker, *tasks)
+        self.assertEqual(self.order[1:11].count(BULK), 2)
+
+    async def test_cancel_queued(self):
+        """
+        A call cancelled while queued gives up its place
+        """
+        scheduler = PassbackScheduler(concurrency=1)
+        blocker = await self.fill(scheduler)
+        cancelled = asyncio.ensure_future(
+            scheduler.run(INTERACTIVE, self.call('cancelled')))
+        queued = asyncio.ensure_future(
+            scheduler.run(BULK, self.call('queued')))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        self.assertEqual(scheduler.queued(), 1)
+        self.gate.set()
+        self.assertEqual(await queued, 'queued')
+        await blocker
+        self.assertEqual(self.order, ['blocker', 'queued'])
+        self.assertEqual(scheduler.active, 0)
+
+    async def test_unknown_lane(self):
+        """
+        Lanes must be configured
+        """
+        with self.assertRaises(ValueError):
+            await PassbackScheduler().run('urgent', self.call('x'))
+
+    async def test_throttled_passback_holds_no_slot(self):
+        """
+        A passback waiting on its consumer's rate limit does not hold a
+        scheduler slot, so other consumers' passbacks go ahead
+        """
+        consumers = {
+            "limited": {"secret": "s", PASSBACK_RATE_LIMIT_KEY: {"rate": 1}},
+            "other": {"secret": "s"},
+        }
+
+        async def handler(request):
+            # pylint: disable=unused-argument
+            return 200, b'<imsx_codeMajor>success</imsx_codeMajor>'
+
+        previous = set_transport(InMemoryTransport(handler))
+        passback_scheduler.configure(concurrency=1)
+        try:
+            passback_limiter.bucket(consumers, "limited",
+                                    'a.example.edu').reserve()
+            throttled = asyncio.ensure_future(post_message(
+                consumers, "limited", 'https://a.example.edu/grade', '<x/>',
+                lane=BULK))
+            await asyncio.sleep(0.01)
+            self.assertEqual(passback_scheduler.active, 0)
+            self.assertTrue(await asyncio.wait_for(post_message(
+                consumers, "other", 'https://b.example.edu/grade', '<x/>',
+                lane=INTERACTIVE), 0.5))
+            throttled.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await throttled
+        finally:
+            passback_scheduler.configure(
+                concurrency=PassbackScheduler().concurrency)
+            passback_limiter.reset()
+            set_transport(previous)
+
+    async def test_total_timeout_while_queued(self):
+        """
+        The total timeout covers the wait for a scheduler slot, which
+        does not count against the host
+        """
+        release = asyncio.Event()
+
+        async def handler(request):
+            if 'a.example.edu' in request.url:
+                await release.wait()
+            return 200, b'<imsx_codeMajor>success</imsx_codeMajor>'
+
+        consumers = {"__consumer_key__": {"secret": "__lti_secret__"}}
+        previous = set_transport(InMemoryTransport(handler))
+        passback_scheduler.configure(concurrency=1)
+        try:
+            busy = asyncio.ensure_future(post_message(
+                consumers, "__consumer_key__", 'https://a.example.edu/grade',
+                '<x/>', lane=BULK))
+            await asyncio.sleep(0)
+            with self.assertRaises(LTIPostMessageTimeout):
+                await asyncio.wait_for(post_message(
+                    consumers, "__consumer_key__",
+                    'https://b.example.edu/grade', '<x/>',
+                    timeout=Timeout(total=0.2), lane=INTERACTIVE), 0.5)
+            self.assertEqual(breakers.get('b.example.edu').failures, 0)
+            self.assertEqual(concurrency_limits()['b.example.edu'][1], 0)
+            release.set()
+            self.assertTrue(await busy)
+        finally:
+            passback_scheduler.configure(
+                concurrency=PassbackScheduler().concurrency)
+            set_transport(previous)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Test aiolti/signer.py module
+"""
+import unittest
+from urllib.parse import unquote
+
+import oauthlib.oauth1
+
+from aiolti.oauth import (
+    LTIOAuthServer,
+    Request_Fix_Duplicate,
+    SignatureMethod_HMAC_SHA1_Unicode,
+)
+from aiolti.signer import (
+    OAuthSigner,
+    get_signer,
+    base_string_uri,
+    body_hash,
+)
+
+
+class TestSigner(unittest.TestCase):
+    """
+    Tests for OAuthSigner
+    """
+    consumers = {
+        "__consumer_key__": {"secret": "__lti_secret__"}
+    }
+
+    def test_matches_oauthlib(self):
+        """
+        Body-hash signature matches oauthlib's for the same inputs.
+        """
+        url = 'https://Example.edu:443/grade_handler?a=1&b=%7Ex'
+        body = b'<xml>\xc3\xa9</xml>'
+        headers = OAuthSigner('__consumer_key__', '__lti_secret__') \
+            .sign_request('POST', url, body,
+                          timestamp=1600000000, nonce='abc')
+
+        client = oauthlib.oauth1.Client(
+            '__consumer_key__', client_secret='__lti_secret__',
+            timestamp='1600000000', nonce='abc')
+        _, expected, _ = client.sign(url, 'POST', body.decode('utf-8'),
+                                     {'Content-Type': 'application/xml'})
+        parse_header = oauthlib.oauth1.rfc5849.utils.parse_authorization_header
+        params = dict(parse_header(headers['Authorization']))
+        expected = dict(parse_header(expected['Authorization']))
+        self.assertEqual(unquote(params['oauth_body_hash']), body_hash(body))
+        self.assertEqual(params['oauth_body_hash'],
+                         expected['oauth_body_hash'])
+        self.assertEqual(params['oauth_signature'],
+                         expected['oauth_signature'])
+
+    def test_header_verifies_with_server(self):
+        """
+        Signed header is accepted by the inbound verifier.
+        """
+        url = 'http://localhost:5000/grade_handler?x=y'
+        headers = get_signer('__consumer_key__', '__lti_secret__') \
+            .sign_request('POST', url, b'<xml></xml>')
+        self.assertTrue(headers['Authorization'].startswith(
+            'OAuth realm="http://localhost:5000", '))
+
+        server = LTIOAuthServer(self.consumers)
+        server.add_signature_method(SignatureMethod_HMAC_SHA1_Unicode())
+        request = Request_Fix_Duplicate.from_request('POST', url,
+                                                     headers=headers)
+        consumer = server.lookup_consumer('__consumer_key__')
+        server.verify_request(request, consumer, None)
+
+    def test_sign_params_verifies_with_server(self):
+        """
+        Signed form parameters are accepted by the inbound verifier.
+        """
+        url = 'http://localhost/launch'
+        params = get_signer('__consumer_key__', '__lti_secret__') \
+            .sign_params('POST', url, {'user_id': u'é', 'roles': ''})
+        server = LTIOAuthServer(self.consumers)
+        server.add_signature_method(SignatureMethod_HMAC_SHA1_Unicode())
+        request = Request_Fix_Duplicate.from_request('POST', url,
+                                                     parameters=params)
+        consumer = server.lookup_consumer('__consumer_key__')
+        server.verify_request(request, consumer, None)
+
+    def test_signer_cached(self):
+        """
+        Signers are reused per consumer.
+        """
+        self.assertIs(get_signer('k', 's'), get_signer('k', 's'))
+        self.assertIsNot(get_signer('k', 's'), get_signer('k', 's2'))
+
+    def test_base_string_uri(self):
+        """
+        Default ports, query and fragment are dropped.
+        """
+        self.assertEqual(base_string_uri('HTTP://Host:80/p?q=1#f'),
+                         ('http://host/p', [('q', '1')]))
+        self.assertEqual(base_string_uri('https://host:8443'),
+                         ('https://host:8443/', []))
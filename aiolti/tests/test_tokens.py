@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Test aiolti/tokens.py module
+"""
+import unittest
+
+from aiolti.common import LTITokenException
+from aiolti.tests.util import FakeClock
+from aiolti.tokens import TokenSigner, bearer_token, get_token_signer
+
+
+class TestTokenSigner(unittest.TestCase):
+    """
+    Tests for TokenSigner
+    """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.clock.now = 1000.0
+        self.signer = TokenSigner('secret', max_age=60, clock=self.clock)
+
+    def test_round_trip(self):
+        """
+        Minted claims are returned by verify
+        """
+        claims = {'user_id': u'user', 'roles': u'Learner'}
+        token = self.signer.mint(claims)
+        self.assertEqual(self.signer.verify(token), claims)
+
+    def test_expiry(self):
+        """
+        Tokens are rejected after max_age
+        """
+        token = self.signer.mint({'user_id': u'user'})
+        long_lived = self.signer.mint({'user_id': u'user'}, max_age=600)
+        self.clock.now += 61
+        with self.assertRaises(LTITokenException):
+            self.signer.verify(token)
+        self.assertEqual(self.signer.verify(long_lived)['user_id'], u'user')
+
+    def test_forged(self):
+        """
+        Tokens signed with another secret, tampered or malformed
+        are rejected
+        """
+        other = TokenSigner('other', clock=self.clock)
+        token = self.signer.mint({'user_id': u'user'})
+        payload, signature = token.split('.')
+        forged = other.mint({'user_id': u'admin'}).split('.')[0]
+        for bad in (other.mint({'user_id': u'user'}),
+                    '{}.{}'.format(forged, signature),
+                    payload, 'a.b.c', u'\xe9.\xe9'):
+            with self.assertRaises(LTITokenException):
+                self.signer.verify(bad)
+
+    def test_cached(self):
+        """
+        Signers are cached per secret
+        """
+        self.assertIs(get_token_signer('secret'), get_token_signer('secret'))
+
+    def test_bearer_token(self):
+        """
+        Token is read from Authorization header
+        """
+        self.assertEqual(bearer_token({'Authorization': 'Bearer abc'}), 'abc')
+        for headers in (dict(), {'Authorization': 'Basic abc'},
+                        {'Authorization': 'Bearer '}):
+            with self.assertRaises(LTITokenException):
+                bearer_token(headers)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Test aiolti/tracing.py module
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from aiolti.common import post_message2
+from aiolti.tests import test_quart
+from aiolti.tests.test_common import RecordingServer
+from aiolti.tests.test_quart_app import app, app_exception
+from aiolti.tracing import Tracer, start_tracing, stop_tracing, tracer
+from aiolti.transport import InMemoryTransport, set_transport
+
+
+def spans(path):
+    """
+    Complete events of a trace file, by name
+    """
+    with open(path) as trace:
+        events = json.load(trace)
+    return {event['name']: event for event in events if event['ph'] == 'X'}
+
+
+class TestTracer(unittest.TestCase):
+    """
+    Tests for the span tracer
+    """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'trace.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_disabled(self):
+        """
+        Spans are free no-ops until tracing starts
+        """
+        trace = Tracer()
+        self.assertFalse(trace.enabled)
+        with trace.span('noop') as span:
+            span.args['dropped'] = True
+        self.assertEqual(span.args, dict())
+        self.assertIs(trace.span('other'), span)
+
+    def test_trace_file(self):
+        """
+        Nested spans are written as a Chrome trace
+        """
+        trace = Tracer()
+        trace.start(self.path)
+        with trace.span('outer', route='/x') as outer:
+            with trace.span('inner'):
+                pass
+            outer.args['status'] = 200
+        with self.assertRaises(ValueError):
+            with trace.span('failed'):
+                raise ValueError()
+        trace.stop()
+        trace.stop()
+
+        with open(self.path) as trace_file:
+            events = json.load(trace_file)
+        self.assertEqual(
+            [(event['name'], event['ph']) for event in events],
+            [('process_name', 'M'), ('thread_name', 'M'), ('inner', 'X'),
+             ('outer', 'X'), ('failed', 'X')])
+        outer, inner = events[3], events[2]
+        self.assertEqual(outer['args'], {'route': '/x', 'status': 200})
+        self.assertEqual(outer['tid'], inner['tid'])
+        self.assertLessEqual(outer['ts'], inner['ts'])
+        self.assertGreaterEqual(outer['ts'] + outer['dur'],
+                                inner['ts'] + inner['dur'])
+        self.assertEqual(events[4]['args'], {'error': 'ValueError'})
+
+        with trace.span('after_stop'):
+            pass
+        self.assertNotIn('after_stop', spans(self.path))
+
+
+class TestTracedPhases(unittest.IsolatedAsyncioTestCase):
+    """
+    Launch and passback phases show up in traces
+    """
+
+    consumers = test_quart.TestQuart.consumers
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'trace.json')
+        start_tracing(self.path)
+
+    def tearDown(self):
+        stop_tracing()
+        shutil.rmtree(self.dir)
+
+    async def test_launch_and_post_grade(self):
+        """
+        Launch through @lti, then post_grade through it
+        """
+        app.config['TESTING'] = True
+        app.config['SERVER_NAME'] = 'localhost'
+        app.config['AIOLTI_CONFIG'] = {'consumers': self.consumers}
+        app_exception.reset()
+        client = app.test_client()
+        await client.get(test_quart.TestQuart.generate_launch_request(
+            self.consumers, 'http://localhost/initial?'))
+
+        async def handler(request):
+            # pylint: disable=unused-argument
+            return 200, test_quart.TestQuart.expected_response
+
+        previous = set_transport(InMemoryTransport(handler))
+        try:
+            ret = await client.get('/post_grade/1.0')
+        finally:
+            set_transport(previous)
+        self.assertEqual(await ret.get_data(), b'grade=True')
+        self.assertFalse(app_exception.get())
+        stop_tracing()
+
+        traced = spans(self.path)
+        for name in ('lti', 'launch.verify', 'launch.signature',
+                     'launch.session', 'launch.role', 'launch.view',
+                     'passback', 'passback.throttle', 'passback.sign',
+                     'passback.slot', 'passback.request'):
+            self.assertIn(name, traced)
+        self.assertEqual(traced['passback']['args']['status'], 200)
+        self.assertEqual(traced['lti']['args']['view'], 'post_grade')
+
+    async def test_network_passback(self):
+        """
+        Network passback is split into executor queueing, connect and
+        response
+        """
+        server = RecordingServer(200, u'')
+        try:
+            await post_message2(self.consumers, '__consumer_key__',
+                                server.url, u'{}')
+        finally:
+            server.close()
+        self.assertTrue(tracer.enabled)
+        stop_tracing()
+
+        traced = spans(self.path)
+        for name in ('passback.queue', 'passback.connect',
+                     'passback.response'):
+            self.assertIn(name, traced)
+        self.assertEqual(traced['passback.response']['args']['status'], 200)
+        # Worker thread spans are on the thread's own track
+        self.assertNotEqual(traced['passback.connect']['tid'],
+                            traced['passback']['tid'])
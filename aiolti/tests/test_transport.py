@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Test aiolti/transport.py module
+"""
+import asyncio
+import unittest
+
+from aiolti.breaker import breakers
+from aiolti.common import LTIPostMessageTimeout, post_message2
+from aiolti.signer import body_hash
+from aiolti.tests.util import SessionLTI
+from aiolti.transport import (
+    HTTPTransport,
+    InMemoryTransport,
+    get_transport,
+    set_transport,
+)
+
+SUCCESS = u"""<?xml version="1.0" encoding="UTF-8"?>
+<imsx_POXEnvelopeResponse>
+    <imsx_POXHeader><imsx_POXResponseHeaderInfo><imsx_statusInfo>
+        <imsx_codeMajor>success</imsx_codeMajor>
+    </imsx_statusInfo></imsx_POXResponseHeaderInfo></imsx_POXHeader>
+</imsx_POXEnvelopeResponse>"""
+
+
+class TestTransport(unittest.IsolatedAsyncioTestCase):
+    """
+    Tests for passback transports
+    """
+
+    def setUp(self):
+        breakers.reset()
+        self.requests = []
+        self.previous = set_transport(InMemoryTransport(self.handler))
+
+    def tearDown(self):
+        set_transport(self.previous)
+
+    async def handler(self, request):
+        """ Records requests, succeeds """
+        self.requests.append(request)
+        return 200, SUCCESS
+
+    def test_default(self):
+        """
+        Network transport is the default
+        """
+        set_transport(None)
+        self.assertIsInstance(get_transport(), HTTPTransport)
+
+    async def test_post_grade(self):
+        """
+        post_grade runs in-process with the in-memory transport
+        """
+        lti = SessionLTI({
+            'oauth_consumer_key': '__consumer_key__',
+            'lis_result_sourcedid': 'sourcedid',
+            'lis_outcome_service_url': 'https://example.edu/grade_handler',
+        })
+        self.assertTrue(await lti.post_grade(0.5))
+        self.assertEqual(len(self.requests), 1)
+        request = self.requests[0]
+        self.assertEqual(request.url, 'https://example.edu/grade_handler')
+        self.assertEqual(request.method, 'POST')
+        self.assertIn(b'<textString>0.5</textString>', request.body)
+        self.assertEqual(request.headers['Content-Type'], 'application/xml')
+        self.assertIn(body_hash(request.body).replace('=', '%3D'),
+                      request.headers['Authorization'])
+
+    async def test_timeout(self):
+        """
+        Total timeout applies to the handler
+        """
+        async def slow(request):
+            # pylint: disable=unused-argument
+            await asyncio.sleep(1)
+
+        set_transport(InMemoryTransport(slow))
+        with self.assertRaises(LTIPostMessageTimeout):
+            await post_message2(
+                {"__consumer_key__": {"secret": "__lti_secret__"}},
+                '__consumer_key__', 'https://example.edu/grade_handler',
+                u'{}', timeout=0.01)
@@ -6,6 +6,8 @@ Test pylti/test_common.py module
 
 import os
 
+from aiolti.common import LTIBase
+
 
 TEST_DATA_ROOT = os.path.join(
     os.path.dirname(os.path.realpath(__file__)),
@@ -13,3 +15,45 @@ TEST_DATA_ROOT = os.path.join(
 )
 
 TEST_CLIENT_CERT = os.path.join(TEST_DATA_ROOT, 'certs', 'snakeoil.pem')
+
+
+class FakeClock(object):
+    """
+    Manually advanced monotonic clock.
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class SessionLTI(LTIBase):
+    """
+    Minimal LTIBase over a plain dict session.
+    """
+    consumers = {
+        "__consumer_key__": {"secret": "__lti_secret__"}
+    }
+
+    def __init__(self, session, consumers=None, **lti_kwargs):
+        self.session = session
+        if consumers is not None:
+            self.consumers = consumers
+        LTIBase.__init__(self, [], lti_kwargs)
+
+    def _consumers(self):
+        return self.consumers
+
+    @property
+    def response_url(self):
+        return self.session['lis_outcome_service_url']
+
+    def _verify_session(self):
+        pass
+
+    async def _verify_any(self):
+        pass
+
+    async def _verify_request(self):
+        pass
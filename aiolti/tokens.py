@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Compact signed bearer tokens carrying verified LTI launch claims
+"""
+from __future__ import absolute_import
+
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import time
+
+from .common import LTITokenException
+
+# Launch properties carried in tokens
+TOKEN_CLAIMS = (
+    'user_id',
+    'oauth_consumer_key',
+    'roles',
+    'lis_result_sourcedid',
+    'lis_outcome_service_url',
+)
+
+DEFAULT_MAX_AGE = 15 * 60
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(data):
+    data = data.encode('ascii')
+    return base64.urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+
+
+class TokenSigner(object):
+    """
+    Mints and checks ``<payload>.<signature>`` tokens, where the payload
+    is base64url encoded JSON and the signature its HMAC-SHA256. The HMAC
+    key schedule is computed once and copied for each token.
+    """
+
+    def __init__(self, secret, max_age=DEFAULT_MAX_AGE, clock=time.time):
+        if isinstance(secret, str):
+            secret = secret.encode('utf-8')
+        self.max_age = max_age
+        self._clock = clock
+        self._hmac = hmac.new(secret, digestmod=hashlib.sha256)
+
+    def _signature(self, payload):
+        digest = self._hmac.copy()
+        digest.update(payload)
+        return digest.digest()
+
+    def mint(self, claims, max_age=None):
+        """
+        Create token for claims
+
+        :param claims: dict of claims (JSON serializable)
+        :param max_age: lifetime in seconds (default: signer's max_age)
+        :return: token string
+        """
+        claims = dict(claims)
+        claims['exp'] = int(self._clock() + (max_age or self.max_age))
+        payload = json.dumps(claims, separators=(',', ':'),
+                             sort_keys=True).encode('utf-8')
+        return '{}.{}'.format(_b64encode(payload),
+                              _b64encode(self._signature(payload)))
+
+    def verify(self, token):
+        """
+        Check token signature and expiry
+
+        :param token: token string
+        :return: dict of claims
+        :raises: LTITokenException
+        """
+        try:
+            payload, signature = token.split('.')
+            payload = _b64decode(payload)
+            signature = _b64decode(signature)
+        except (ValueError, UnicodeError, binascii.Error):
+            raise LTITokenException('Malformed token')
+        if not hmac.compare_digest(signature, self._signature(payload)):
+            raise LTITokenException('Invalid token signature')
+        claims = json.loads(payload.decode('utf-8'))
+        if claims.pop('exp', 0) < self._clock():
+            raise LTITokenException('Token expired')
+        return claims
+
+
+_TOKEN_SIGNERS = dict()
+
+
+def get_token_signer(secret, max_age=DEFAULT_MAX_AGE):
+    """
+    Cached token signer for secret
+
+    :param secret: signing secret (str or bytes)
+    :param max_age: default token lifetime in seconds
+    :return: TokenSigner
+    """
+    signer = _TOKEN_SIGNERS.get((secret, max_age))
+    if signer is None:
+        signer = _TOKEN_SIGNERS[(secret, max_age)] = TokenSigner(
+            secret, max_age)
+    return signer
+
+
+def bearer_token(headers):
+    """
+    Token from an ``Authorization: Bearer`` header
+
+    :param headers: request headers
+    :return: token string
+    :raises: LTITokenException if there is none
+    """
+    auth = headers.get('Authorization', '')
+    scheme, _, token = auth.partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        raise LTITokenException('Bearer token required')
+    return token.strip()
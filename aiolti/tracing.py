@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Span instrumentation of launch and passback phases, written as Chrome
+trace events (viewable in chrome://tracing, Perfetto or speedscope)
+"""
+from __future__ import absolute_import
+
+import asyncio
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+TRACE_CATEGORY = 'aiolti'
+
+
+def now():
+    """
+    Current trace timestamp, e.g. for :py:meth:`Tracer.complete`
+
+    :return: microseconds
+    """
+    return time.perf_counter() * 1e6
+
+
+def _track():
+    """
+    Trace track for the caller: its asyncio task, or else its thread,
+    so that spans on a track always nest
+
+    :return: (track id, track name)
+    """
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        return id(task), task.get_name()
+    thread = threading.current_thread()
+    return thread.ident, thread.name
+
+
+class _Span(object):
+    """
+    Times a ``with`` block as one complete ("X") event
+    """
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = now()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.complete(self.name, self.start, now(), **self.args)
+        return False
+
+
+class _NoSpan(object):
+    """
+    Stand-in for spans while tracing is off
+    """
+
+    @property
+    def args(self):
+        """
+        Values added to this are dropped
+        """
+        return dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Tracer(object):
+    """
+    Writes spans to a trace file while started; off (and close to free)
+    otherwise.
+
+    Events are streamed as a JSON array, one per line, so the file of a
+    worker that never stopped tracing still loads in trace viewers.
+    Spans go on one track per asyncio task (or thread, for work run in an
+    executor), named after it.
+    """
+
+    def __init__(self):
+        self._file = None
+        self._lock = threading.Lock()
+        self._tracks = set()
+        self._pid = None
+        self._events = 0
+
+    @property
+    def enabled(self):
+        """
+        Whether spans are being recorded
+        """
+        return self._file is not None
+
+    def start(self, path):
+        """
+        Start writing spans to path (replacing its contents)
+
+        :param path: trace file name
+        """
+        with self._lock:
+            if self._file is not None:
+                self._close()
+            self._file = open(path, 'w')  # pylint: disable=consider-using-with
+            self._file.write('[')
+            self._tracks = set()
+            self._events = 0
+            self._pid = os.getpid()
+            self._write(dict(name='process_name', ph='M', pid=self._pid,
+                             args=dict(name='aiolti')))
+        log.info("Tracing to %s", path)
+
+    def stop(self):
+        """
+        Stop tracing, completing and closing the trace file
+        """
+        with self._lock:
+            if self._file is not None:
+                self._close()
+
+    def _close(self):
+        self._file.write('\n]\n')
+        self._file.close()
+        self._file = None
+
+    def _write(self, event):
+        self._file.write(',\n' if self._events else '\n')
+        self._file.write(json.dumps(event, separators=(',', ':')))
+        self._events += 1
+
+    def span(self, name, **args):
+        """
+        Context manager timing a block, e.g.
+        ``with tracer.span('launch.form'): ...``
+
+        :param name: span name
+        :param args: extra values shown with the span (JSON serializable)
+        :return: context manager; its ``args`` dict may be added to
+            within the block
+        """
+        if self._file is None:
+            return _NO_SPAN
+        return _Span(self, name, args)
+
+    def complete(self, name, start, end, **args):
+        """
+        Record a span with known start and end
+
+        :param name: span name
+        :param start: start, as a :py:func:`now` timestamp
+        :param end: end, as a :py:func:`now` timestamp
+        :param args: extra values shown with the span
+        """
+        track, track_name = _track()
+        event = dict(name=name, cat=TRACE_CATEGORY, ph='X', ts=start,
+                     dur=max(0.0, end - start), pid=self._pid, tid=track)
+        if args:
+            event['args'] = args
+        with self._lock:
+            if self._file is None:
+                return
+            if track not in self._tracks:
+                self._tracks.add(track)
+                self._write(dict(name='thread_name', ph='M', pid=self._pid,
+                                 tid=track, args=dict(name=track_name)))
+            self._write(event)
+
+
+tracer = Tracer()  # pylint: disable=invalid-name
+
+atexit.register(tracer.stop)
+
+
+def start_tracing(path):
+    """
+    Start writing launch and passback spans to a Chrome trace file
+
+    :param path: trace file name
+    """
+    tracer.start(path)
+
+
+def stop_tracing():
+    """
+    Stop tracing and complete the trace file
+    """
+    tracer.stop()
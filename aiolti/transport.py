@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Transports for outbound (passback) requests
+"""
+from __future__ import absolute_import
+
+from abc import ABC, abstractmethod
+import asyncio
+from collections import namedtuple
+from functools import partial
+import logging
+import socket
+from urllib.parse import urlsplit
+
+from .tracing import now, tracer
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+# Response to a passback request: status code and headers (the content
+# is returned alongside)
+Response = namedtuple('Response', ['status', 'headers'])
+
+# Passback request, as handed to an InMemoryTransport handler
+Request = namedtuple('Request', ['url', 'method', 'headers', 'body'])
+
+
+class Transport(ABC):
+    """
+    Sends signed passback requests. :py:func:`aiolti.common.post_message`
+    and friends build and sign the request, and leave sending it to the
+    current transport (see :py:func:`set_transport`).
+    """
+
+    @abstractmethod
+    async def request(self, url, method, headers, body, timeout, cert=None):
+        """
+        Send request
+
+        :param url: request URL
+        :param method: HTTP method
+        :param headers: dict of headers (already signed)
+        :param body: request body, as bytes
+        :param timeout: :py:class:`aiolti.common.Timeout`
+        :param cert: client certificate file, or None
+        :return: (Response, content bytes)
+        :raises: asyncio.TimeoutError if a timeout expired
+        """
+        # pylint: disable=too-many-arguments
+
+
+class _RequestLimits(object):
+    """
+    Per-call state shared between the event loop and the worker thread
+    making the request, so that the loop can abort it.
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, timeout):
+        self.connect = timeout.connect
+        self.read = timeout.read
+        self.aborted = False
+        self.connection = None
+        # When the request was handed to the executor, if tracing
+        self.submitted = None
+
+
+def _proxy_for(parts):
+    """
+    Proxy (host, port) from the environment for a URL, or None
+    """
+    # pylint: disable=import-outside-toplevel
+    from urllib.request import getproxies, proxy_bypass
+    proxy = getproxies().get(parts.scheme)
+    if not proxy or proxy_bypass(parts.hostname):
+        return None
+    proxy = urlsplit(proxy if '://' in proxy else 'http://' + proxy)
+    return proxy.hostname, proxy.port or 80
+
+
+def _http_request(url, method, headers, body, cert, limits):
+    """
+    Make a blocking HTTP request with separate connect and read timeouts.
+    Runs in a worker thread; :py:func:`_abort_request` may be called
+    from the event loop to interrupt it.
+
+    :return: (response, content)
+    """
+    # pylint: disable=too-many-arguments, import-outside-toplevel
+    import http.client
+
+    parts = urlsplit(url)
+    proxy = _proxy_for(parts)
+    host, port = proxy or (parts.hostname, parts.port)
+    path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+    if parts.scheme == 'https':
+        import ssl
+        context = ssl.create_default_context()
+        if cert:
+            context.load_cert_chain(cert)
+            log.debug("cert %s", cert)
+        conn = http.client.HTTPSConnection(
+            host, port, timeout=limits.connect, context=context)
+        if proxy:
+            conn.set_tunnel(parts.hostname, parts.port)
+    else:
+        conn = http.client.HTTPConnection(host, port, timeout=limits.connect)
+        if proxy:
+            path = url
+    limits.connection = conn
+    if limits.submitted is not None:
+        tracer.complete('passback.queue', limits.submitted, now())
+    try:
+        if limits.aborted:
+            raise socket.error("Passback request aborted")
+        with tracer.span('passback.connect', host=host):
+            conn.connect()
+        if limits.aborted:
+            raise socket.error("Passback request aborted")
+        conn.sock.settimeout(limits.read)
+        with tracer.span('passback.response') as span:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            span.args['status'] = response.status
+            return response, response.read()
+    finally:
+        conn.close()
+
+
+def _abort_request(limits):
+    """
+    Abort an in-flight request from outside its worker thread: shutting
+    the socket down wakes the blocked read and releases the connection.
+    """
+    limits.aborted = True
+    conn = limits.connection
+    sock = conn.sock if conn is not None else None
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class HTTPTransport(Transport):
+    """
+    Network transport: blocking HTTP in a thread executor (the loop's
+    default one, unless given), with separate connect and read timeouts.
+    Cancellation and the total timeout are made real by aborting the
+    socket from the event loop, rather than leaving the worker thread
+    blocked on it.
+    """
+
+    def __init__(self, executor=None):
+        self.executor = executor
+
+    async def request(self, url, method, headers, body, timeout, cert=None):
+        # pylint: disable=too-many-arguments
+        limits = _RequestLimits(timeout)
+        if tracer.enabled:
+            limits.submitted = now()
+        request = asyncio.get_running_loop().run_in_executor(
+            self.executor, partial(
+                _http_request, url, method, headers, body, cert, limits))
+        try:
+            response, content = await asyncio.wait_for(request,
+                                                       timeout.total)
+        except (asyncio.CancelledError, asyncio.TimeoutError,
+                socket.timeout):
+            _abort_request(limits)
+            raise
+        return Response(response.status, dict(response.getheaders())), content
+
+
+class InMemoryTransport(Transport):
+    """
+    Transport that hands requests straight to an async handler, with no
+    network (or threads) involved, e.g. for tests and benchmarks::
+
+        async def handler(request):
+            return 200, SUCCESS_XML
+
+        set_transport(InMemoryTransport(handler))
+
+    The handler gets a :py:data:`Request` and returns ``(status,
+    content)`` or ``(status, headers, content)``. The total timeout
+    applies to it as to a real request.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = 0
+
+    async def request(self, url, method, headers, body, timeout, cert=None):
+        # pylint: disable=too-many-arguments
+        self.requests += 1
+        result = await asyncio.wait_for(
+            self.handler(Request(url, method, headers, body)), timeout.total)
+        if len(result) == 2:
+            status, content = result
+            response_headers = dict()
+        else:
+            status, response_headers, content = result
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        return Response(status, response_headers), content
+
+
+_TRANSPORT = HTTPTransport()
+
+
+def get_transport():
+    """
+    Returns current passback transport
+
+    :return: Transport
+    """
+    return _TRANSPORT
+
+
+def set_transport(transport):
+    """
+    Set passback transport (None for the default network transport)
+
+    :param transport: Transport
+    :return: previous transport
+    """
+    global _TRANSPORT  # pylint: disable=global-statement
+    previous = _TRANSPORT
+    _TRANSPORT = transport or HTTPTransport()
+    return previous
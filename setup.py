@@ -61,7 +61,7 @@ try:
                                 "oauthlib>=0.6.3", "semantic_version>=2.3.1",
                                 "mock==1.0.1"],
                  cmdclass={"test": PyTest},
-                 install_requires=["oauth2>=1.9.0.post1", "httplib2>=0.9", "six>=1.15.0"],
+                 install_requires=["oauth2>=1.9.0.post1"],
                  include_package_data=True,
                  zip_safe=False)
 except ImportError as err: